@@ -23,10 +23,9 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure database connection
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///sbpanel.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+# Pool, timeout and pragma settings for the kind of database the URL points at
+from utils.db_engine import engine_options, configure_engine
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize database with the app
@@ -41,16 +40,27 @@ login_manager.login_message_category = 'info'
 # Import models to ensure tables are created
 with app.app_context():
     import models
+    configure_engine(db.engine)
 
     # Create all tables
     db.create_all()
     
-    # Register user loader for Flask-Login
-    from models import User
+    # Add indexes declared since an existing database was created
+    from utils.schema import ensure_indexes
+    ensure_indexes(db)
+    
+    # Partition activity_logs by month on PostgreSQL
+    from utils.schema import partition_activity_logs
+    partition_activity_logs(db)
+    
+    # Register user loader for Flask-Login; users are cached per worker and dropped
+    # from every worker's cache when a change to them is committed
+    from utils.user_cache import load_user as load_cached_user, init_user_cache
+    init_user_cache()
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return load_cached_user(int(user_id))
 
 # Register blueprints
 from routes.auth import auth_bp
@@ -63,6 +73,7 @@ from routes.services import services_bp
 from routes.files import files_bp
 from routes.cronjobs import cronjobs_bp
 from routes.profiles import profiles_bp
+from routes.metrics import metrics_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(admin_bp)
@@ -74,5 +85,52 @@ app.register_blueprint(services_bp)
 app.register_blueprint(files_bp)
 app.register_blueprint(cronjobs_bp)
 app.register_blueprint(profiles_bp)
+app.register_blueprint(metrics_bp)
+
+# Request latency, SQL and job queue figures for /metrics
+from utils.openmetrics import instrument_app, registry
+from utils.jobs import job_queue_metrics
+instrument_app(app)
+registry.register_collector(job_queue_metrics)
+
+# Per-request SQL counts, N+1 warnings and the Server-Timing header
+from utils.sql_profiler import init_sql_profiler
+init_sql_profiler(app)
+
+# Queue activity log entries and write them in batches instead of in each request
+from utils.activity_log import init_activity_log
+init_activity_log(app)
+
+# Move activity log entries past retention to compressed archives
+from utils.log_retention import start_log_retention
+start_log_retention(app)
+
+# Keep the admin overview counts up to date as rows are added, removed and change status
+from utils.counters import init_counters
+init_counters(app)
+
+# Run queued provisioning, website, database and SSL jobs in the background
+from utils.jobs import start_job_workers
+start_job_workers(app)
+
+# Keep container status in the database in sync with the Docker daemon
+from utils.docker_events import start_docker_events
+start_docker_events(app)
+
+# Sample host usage once for all workers instead of once per request
+from utils.monitoring import start_host_sampler
+start_host_sampler()
+
+# Follow per-container Docker stats for the dashboard
+from utils.metrics import start_metrics_collector
+start_metrics_collector()
+
+# Pull and build container images before the first creation needs them
+from utils.images import start_image_prepull
+start_image_prepull()
+
+# Keep pre-provisioned containers ready so creation doesn't wait on provisioning
+from utils.warm_pool import start_warm_pool
+start_warm_pool()
 
 logger.info("SBPanel application initialized")
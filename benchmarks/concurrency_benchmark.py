@@ -0,0 +1,209 @@
+"""
+Throughput and latency of the panel's database work under concurrent gunicorn-style load,
+with the old engine settings and with the profile from utils.db_engine.
+
+Several processes (standing in for gunicorn workers), each with several threads, run a
+mix of dashboard reads and small writes (activity log inserts, container status updates)
+against the same database for a fixed time, first with the old settings and then with
+the tuned profile.
+
+    python benchmarks/concurrency_benchmark.py [--processes 4] [--threads 8] [--seconds 15]
+                                               [--write-ratio 0.2] [--database-url URL]
+
+Without --database-url each profile gets its own temporary SQLite file. A PostgreSQL URL
+must point at an empty scratch database: its tables are dropped and refilled.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+import multiprocessing
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--processes', type=int, default=4, help='worker processes, like gunicorn --workers')
+parser.add_argument('--threads', type=int, default=8, help='threads per process')
+parser.add_argument('--seconds', type=float, default=15, help='run time per profile')
+parser.add_argument('--write-ratio', type=float, default=0.2, help='share of operations that write')
+parser.add_argument('--users', type=int, default=200)
+parser.add_argument('--logs', type=int, default=100_000, help='activity log rows to seed')
+parser.add_argument('--database-url')
+args = parser.parse_args()
+
+app_scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{app_scratch}'
+# Keep the app's background services out of the measurements.
+os.environ.setdefault('SBPANEL_JOB_WORKERS', '0')
+os.environ.setdefault('SBPANEL_WARM_POOL_SIZE', '0')
+os.environ.setdefault('SBPANEL_ACTIVITY_LOG_RETENTION_DAYS', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, insert, update, func  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from app import db  # noqa: E402
+from models import User, Container, ActivityLog  # noqa: E402
+from utils.db_engine import engine_options, configure_engine  # noqa: E402
+
+# What app.py configured before engine profiles.
+BASELINE_OPTIONS = {'pool_recycle': 300, 'pool_pre_ping': True}
+CONTAINERS_PER_USER = 5
+STATUSES = ['running', 'stopped']
+
+
+def make_engine(profile, url):
+    if profile == 'baseline':
+        return create_engine(url, **BASELINE_OPTIONS)
+    engine = create_engine(url, **engine_options(url))
+    configure_engine(engine)
+    return engine
+
+
+def seed(engine):
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            # A new file starts with the rollback journal; the tuned profile's connect
+            # hook switches it to WAL.
+            mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+        print(f"  journal_mode={mode}")
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x'}
+            for i in range(args.users)])
+        conn.execute(insert(Container), [
+            {'name': f'c{i}', 'user_id': i % args.users + 1, 'container_id': f'bench-{i}', 'template': 'nginx',
+             'status': rng.choice(STATUSES)}
+            for i in range(args.users * CONTAINERS_PER_USER)])
+        for start in range(0, args.logs, 10_000):
+            conn.execute(insert(ActivityLog), [
+                {'user_id': rng.randint(1, args.users), 'action': 'Benchmark', 'details': 'seed',
+                 'ip_address': '10.0.0.1', 'created_at': now - timedelta(seconds=rng.randint(0, 90 * 86400))}
+                for _ in range(min(10_000, args.logs - start))])
+
+
+def dashboard_read(conn, rng):
+    user_id = rng.randint(1, args.users)
+    conn.execute(select(Container).where(Container.user_id == user_id)).all()
+    conn.execute(select(ActivityLog).where(ActivityLog.user_id == user_id)
+                 .order_by(ActivityLog.created_at.desc()).limit(10)).all()
+    conn.execute(select(func.count()).select_from(Container)
+                 .where(Container.user_id == user_id, Container.status == 'running')).scalar()
+
+
+def small_write(conn, rng):
+    user_id = rng.randint(1, args.users)
+    conn.execute(insert(ActivityLog).values(user_id=user_id, action='Benchmark', details='write',
+                                            ip_address='10.0.0.2', created_at=datetime.utcnow()))
+    conn.execute(update(Container).where(Container.id == rng.randint(1, args.users * CONTAINERS_PER_USER))
+                 .values(status=rng.choice(STATUSES)))
+
+
+def run_thread(engine, seed_value, deadline, results):
+    rng = random.Random(seed_value)
+    while time.monotonic() < deadline:
+        write = rng.random() < args.write_ratio
+        started = time.perf_counter()
+        try:
+            if write:
+                with engine.begin() as conn:
+                    small_write(conn, rng)
+            else:
+                with engine.connect() as conn:
+                    dashboard_read(conn, rng)
+        except OperationalError:
+            results['errors'] += 1
+            continue
+        results['writes' if write else 'reads'].append((time.perf_counter() - started) * 1000)
+
+
+def run_process(profile, url, index, start_at, queue):
+    engine = make_engine(profile, url)
+    while time.time() < start_at:
+        time.sleep(0.01)
+    deadline = time.monotonic() + args.seconds
+    per_thread = [{'reads': [], 'writes': [], 'errors': 0} for _ in range(args.threads)]
+    threads = [threading.Thread(target=run_thread, args=(engine, index * 1000 + i, deadline, per_thread[i]))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    queue.put({
+        'reads': [t for r in per_thread for t in r['reads']],
+        'writes': [t for r in per_thread for t in r['writes']],
+        'errors': sum(r['errors'] for r in per_thread),
+    })
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_profile(profile):
+    scratch = None
+    url = args.database_url
+    if not url:
+        scratch = tempfile.NamedTemporaryFile(suffix=f'-{profile}.db', delete=False).name
+        url = f'sqlite:///{scratch}'
+    print(f"{profile}: seeding {args.logs:,} activity log rows ...")
+    engine = make_engine(profile, url)
+    seed(engine)
+    engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    start_at = time.time() + 1
+    processes = [context.Process(target=run_process, args=(profile, url, i, start_at, queue))
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    if scratch:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(scratch + suffix):
+                os.remove(scratch + suffix)
+
+    reads = [t for r in results for t in r['reads']]
+    writes = [t for r in results for t in r['writes']]
+    return {
+        'ops/s': (len(reads) + len(writes)) / args.seconds,
+        'reads/s': len(reads) / args.seconds,
+        'writes/s': len(writes) / args.seconds,
+        'read p50 ms': statistics.median(reads) if reads else float('nan'),
+        'read p99 ms': percentile(reads, 0.99),
+        'write p50 ms': statistics.median(writes) if writes else float('nan'),
+        'write p99 ms': percentile(writes, 0.99),
+        'lock errors': sum(r['errors'] for r in results),
+    }
+
+
+def main():
+    print(f"{args.processes} processes x {args.threads} threads, {args.seconds:.0f}s per profile, "
+          f"{args.write_ratio:.0%} writes\n")
+    baseline = run_profile('baseline')
+    tuned = run_profile('tuned')
+
+    print(f"\n{'':<14}  {'baseline':>10}  {'tuned':>10}  {'change':>8}")
+    for label in baseline:
+        before, after = baseline[label], tuned[label]
+        change = f"{after / before:.2f}x" if before else '-'
+        print(f"{label:<14}  {before:>10.1f}  {after:>10.1f}  {change:>8}")
+
+    os.remove(app_scratch)
+
+
+if __name__ == '__main__':
+    main()
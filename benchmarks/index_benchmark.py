@@ -0,0 +1,142 @@
+"""
+Before/after timings for the model indexes at 1M activity log rows.
+
+Seeds a scratch database, times the queries the panel's routes run with the declared
+indexes dropped, builds them with utils.schema.ensure_indexes (timing the migration
+itself), and times the same queries again.
+
+    python benchmarks/index_benchmark.py [--rows 1000000] [--database-url URL]
+
+Without --database-url a temporary SQLite file is used. A PostgreSQL URL must point at
+an empty scratch database: its tables are dropped and refilled.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--rows', type=int, default=1_000_000, help='activity log rows to seed')
+parser.add_argument('--users', type=int, default=2_000)
+parser.add_argument('--containers', type=int, default=10_000)
+parser.add_argument('--repeat', type=int, default=20, help='runs per query; the median is reported')
+parser.add_argument('--database-url')
+args = parser.parse_args()
+
+scratch = None
+if not args.database_url:
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+    args.database_url = f'sqlite:///{scratch}'
+os.environ['DATABASE_URL'] = args.database_url
+# Keep the app's background services out of the measurements.
+os.environ.setdefault('SBPANEL_JOB_WORKERS', '0')
+os.environ.setdefault('SBPANEL_WARM_POOL_SIZE', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, func, insert, text  # noqa: E402
+from app import app, db  # noqa: E402
+from models import User, Container, ActivityLog  # noqa: E402
+from utils.schema import ensure_indexes  # noqa: E402
+
+CHUNK = 50_000
+ACTIONS = ['Login', 'Container Created', 'Container Started', 'Container Stopped', 'Website Created',
+           'Database Created', 'Service Restarted', 'Profile Updated']
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [
+            {'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x'}
+            for i in range(args.users)])
+        conn.execute(insert(Container), [
+            {'name': f'c{i}', 'user_id': i % args.users + 1, 'container_id': f'bench-{i}', 'template': 'nginx',
+             'status': random.choice(['running', 'running', 'stopped', 'paused'])}
+            for i in range(args.containers)])
+    rng = random.Random(42)
+    for start in range(0, args.rows, CHUNK):
+        rows = [{'user_id': rng.randint(1, args.users), 'action': rng.choice(ACTIONS), 'details': 'benchmark',
+                 'ip_address': f'10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}',
+                 'created_at': now - timedelta(seconds=rng.randint(0, 365 * 86400))}
+                for _ in range(min(CHUNK, args.rows - start))]
+        with db.engine.begin() as conn:
+            conn.execute(insert(ActivityLog), rows)
+
+
+def drop_declared_indexes():
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+        if db.engine.dialect.name == 'sqlite':
+            conn.execute(text('ANALYZE'))
+
+
+QUERIES = {
+    "dashboard: user's 10 latest logs": lambda uid: select(ActivityLog.id).where(ActivityLog.user_id == uid)
+        .order_by(ActivityLog.created_at.desc()).limit(10),
+    'admin logs: newest 50': lambda uid: select(ActivityLog.id).order_by(ActivityLog.created_at.desc(),
+                                                                          ActivityLog.id.desc()).limit(50),
+    'admin logs: keyset page in the middle': lambda uid: select(ActivityLog.id)
+        .where(ActivityLog.created_at < datetime.utcnow() - timedelta(days=180))
+        .order_by(ActivityLog.created_at.desc(), ActivityLog.id.desc()).limit(50),
+    "user's log count": lambda uid: select(func.count()).select_from(ActivityLog).where(ActivityLog.user_id == uid),
+    "user's running containers": lambda uid: select(func.count()).select_from(Container)
+        .where(Container.user_id == uid, Container.status == 'running'),
+    'running containers (overview recount)': lambda uid: select(func.count()).select_from(Container)
+        .where(Container.status == 'running'),
+}
+
+
+def time_queries():
+    results = {}
+    rng = random.Random(7)
+    with db.engine.connect() as conn:
+        for label, build in QUERIES.items():
+            timings = []
+            for _ in range(args.repeat):
+                statement = build(rng.randint(1, args.users))
+                started = time.perf_counter()
+                conn.execute(statement).all()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[label] = statistics.median(timings)
+    return results
+
+
+def main():
+    with app.app_context():
+        print(f"Seeding {args.rows:,} activity log rows into {db.engine.url.render_as_string(hide_password=True)} ...")
+        started = time.monotonic()
+        seed()
+        print(f"Seeded in {time.monotonic() - started:.1f}s")
+
+        drop_declared_indexes()
+        before = time_queries()
+
+        started = time.monotonic()
+        created = ensure_indexes(db)
+        migration_seconds = time.monotonic() - started
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.begin() as conn:
+                conn.execute(text('ANALYZE'))
+        after = time_queries()
+
+    print(f"\nensure_indexes built {len(created)} indexes in {migration_seconds:.1f}s\n")
+    width = max(len(label) for label in QUERIES)
+    print(f"{'query':<{width}}  {'before ms':>10}  {'after ms':>10}  {'speedup':>8}")
+    for label in QUERIES:
+        speedup = before[label] / after[label] if after[label] else float('inf')
+        print(f"{label:<{width}}  {before[label]:>10.2f}  {after[label]:>10.2f}  {speedup:>7.0f}x")
+
+    if scratch:
+        os.remove(scratch)
+
+
+if __name__ == '__main__':
+    main()
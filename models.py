@@ -37,6 +37,10 @@ class User(UserMixin, db.Model):
 
 class Container(db.Model):
     __tablename__ = 'containers'
+    __table_args__ = (
+        db.Index('ix_containers_user_id_status', 'user_id', 'status'),
+        db.Index('ix_containers_status', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
@@ -60,6 +64,11 @@ class Container(db.Model):
 
 class Website(db.Model):
     __tablename__ = 'websites'
+    __table_args__ = (
+        db.Index('ix_websites_user_id', 'user_id'),
+        db.Index('ix_websites_container_id', 'container_id'),
+        db.Index('ix_websites_domain', 'domain'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -78,6 +87,10 @@ class Website(db.Model):
 
 class Database(db.Model):
     __tablename__ = 'databases'
+    __table_args__ = (
+        db.Index('ix_databases_user_id_name', 'user_id', 'name'),
+        db.Index('ix_databases_container_id', 'container_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -94,6 +107,10 @@ class Database(db.Model):
 
 class Service(db.Model):
     __tablename__ = 'services'
+    __table_args__ = (
+        db.Index('ix_services_container_id_status', 'container_id', 'status'),
+        db.Index('ix_services_status', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     container_id = db.Column(db.Integer, db.ForeignKey('containers.id'), nullable=False)
@@ -109,6 +126,10 @@ class Service(db.Model):
 
 class CronJob(db.Model):
     __tablename__ = 'cronjobs'
+    __table_args__ = (
+        db.Index('ix_cronjobs_user_id', 'user_id'),
+        db.Index('ix_cronjobs_container_id', 'container_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -126,6 +147,9 @@ class CronJob(db.Model):
 
 class SSHKey(db.Model):
     __tablename__ = 'ssh_keys'
+    __table_args__ = (
+        db.Index('ix_ssh_keys_user_id_name', 'user_id', 'name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -138,6 +162,14 @@ class SSHKey(db.Model):
 
 class ActivityLog(db.Model):
     __tablename__ = 'activity_logs'
+    __table_args__ = (
+        db.Index('ix_activity_logs_user_id_created_at', 'user_id', 'created_at'),
+        # Admin log viewer: newest first, with id as the tiebreaker for keyset pages
+        db.Index('ix_activity_logs_created_at_id', 'created_at', 'id'),
+        # Admin log viewer filters, in the viewer's order within each value
+        db.Index('ix_activity_logs_action_created_at_id', 'action', 'created_at', 'id'),
+        db.Index('ix_activity_logs_ip_address_created_at_id', 'ip_address', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -151,6 +183,9 @@ class ActivityLog(db.Model):
 
 class DNSRecord(db.Model):
     __tablename__ = 'dns_records'
+    __table_args__ = (
+        db.Index('ix_dns_records_website_id', 'website_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     website_id = db.Column(db.Integer, db.ForeignKey('websites.id'), nullable=False)
@@ -169,6 +204,9 @@ class DNSRecord(db.Model):
 
 class Favorite(db.Model):
     __tablename__ = 'favorites'
+    __table_args__ = (
+        db.Index('ix_favorites_user_id_page_url', 'user_id', 'page_url'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -189,3 +227,47 @@ class SystemSetting(db.Model):
     
     def __repr__(self):
         return f'<SystemSetting {self.key}>'
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+        db.Index('ix_jobs_resource', 'resource'),
+        db.Index('ix_jobs_user_id_status', 'user_id', 'status'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)  # container.provision, website.create, etc.
+    resource = db.Column(db.String(128))  # What the job works on, e.g. container:12 or website:example.com
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    payload = db.Column(db.Text)  # JSON arguments
+    state = db.Column(db.Text)  # JSON: completed steps and values passed between them
+    status = db.Column(db.String(20), default='queued')  # queued, running, succeeded, failed
+    step = db.Column(db.String(64))  # Step currently running
+    progress = db.Column(db.String(255))  # Latest line of output from the current step
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_by = db.Column(db.String(128))  # host:pid of the worker running it
+    locked_at = db.Column(db.DateTime)  # Lease heartbeat
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+    
+    def __repr__(self):
+        return f'<Job {self.kind} {self.status}>'
+
+class SystemCounter(db.Model):
+    __tablename__ = 'system_counters'
+    
+    # Maintained by utils.counters from the commits that change these rows
+    key = db.Column(db.String(64), primary_key=True)  # container_count, running_service_count, etc.
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SystemCounter {self.key}={self.value}>'
@@ -1,13 +1,43 @@
+import io
+import os
+import csv
+import json
 import logging
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from datetime import datetime, timedelta
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
+from sqlalchemy import select, tuple_, false
 from app import db
 from models import User, Container, Website, Database, Service, ActivityLog, SystemSetting
+from utils.activity_log import log_activity, flush_activity_log
+from utils.jobs import register_job, enqueue_job
+from utils.settings import SETTINGS, bump_settings_version
+from utils.log_retention import get_archive, delete_logs, RETENTION_DAYS
+from utils.sql_profiler import recent_profiles, N_PLUS_ONE_THRESHOLD
+from utils.monitoring import get_system_stats, get_host_history, HOST_SERIES_METRICS, get_containers_status, \
+                             CONTAINER_STATUS_PAGE_SIZE, get_system_overview
 
 # Create blueprint
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 logger = logging.getLogger(__name__)
 
+LOGS_PER_PAGE = 50
+EXPORT_BATCH_SIZE = 1000
+
+def _clear_logs(ctx):
+    num_deleted = delete_logs(ctx.payload['max_id'])
+    log_activity(
+        user_id=ctx.user_id,
+        action="Admin Cleared Logs",
+        details=f"Cleared {num_deleted} log entries",
+        ip_address=ctx.payload.get('ip_address')
+    )
+    db.session.commit()
+
+register_job('activity_log.clear', [
+    ('delete', _clear_logs),
+])
+
 # Admin access decorator
 def admin_required(f):
     @login_required
@@ -65,13 +95,12 @@ def create_user():
     db.session.add(user)
     
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="Admin Created User",
         details=f"Created new user account for {username}",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     
     db.session.commit()
     
@@ -105,13 +134,12 @@ def edit_user(user_id):
         user.set_password(new_password)
     
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="Admin Updated User",
         details=f"Updated user account for {user.username}",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     
     db.session.commit()
     
@@ -131,21 +159,19 @@ def delete_user(user_id):
             return redirect(url_for('admin.users'))
     
     # Check if the user has active containers
-    containers = Container.query.filter_by(user_id=user.id).all()
-    if containers:
+    if db.session.query(Container.query.filter_by(user_id=user.id).exists()).scalar():
         flash('Cannot delete user with active containers. Delete their containers first.', 'danger')
         return redirect(url_for('admin.users'))
     
     username = user.username
     
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="Admin Deleted User",
         details=f"Deleted user account for {username}",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     
     # Delete the user
     db.session.delete(user)
@@ -157,69 +183,251 @@ def delete_user(user_id):
 @admin_bp.route('/system')
 @admin_required
 def system():
-    settings = SystemSetting.query.all()
-    return render_template('admin/system.html', settings=settings)
+    settings = SystemSetting.query.filter(~SystemSetting.key.startswith('_')).all()
+    return render_template('admin/system.html', settings=settings, system_stats=get_system_stats(),
+                           overview=get_system_overview())
+
+@admin_bp.route('/system/history')
+@admin_required
+def system_history():
+    metric = request.args.get('metric', 'cpu_usage')
+    if metric not in HOST_SERIES_METRICS:
+        return jsonify({'error': f'Unknown metric: {metric}'}), 400
+    seconds = min(max(request.args.get('seconds', 3600, type=int), 60), 30 * 86400)
+    return jsonify(get_host_history(metric, seconds, request.args.get('resolution', type=int)))
+
+@admin_bp.route('/containers/status')
+@admin_required
+def containers_status():
+    # Keyset pagination: pass the returned next_after back as ?after= for the next page.
+    after_id = request.args.get('after', type=int)
+    limit = min(max(request.args.get('limit', CONTAINER_STATUS_PAGE_SIZE, type=int), 1), 5000)
+    fields = request.args.get('fields')
+    fields = [f.strip() for f in fields.split(',')] if fields else None
+    containers = get_containers_status(after_id=after_id, limit=limit, fields=fields)
+    next_after = containers[-1]['id'] if len(containers) == limit else None
+    return jsonify({'containers': containers, 'next_after': next_after})
+
+@admin_bp.route('/debug/sql')
+@admin_required
+def debug_sql():
+    # Recent requests served by this worker, with their SQL counts and repeated statements
+    profiles = recent_profiles(endpoint=request.args.get('endpoint'),
+                               n_plus_one_only=request.args.get('n_plus_one') == '1')
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    return jsonify({
+        'worker': os.getpid(),
+        'n_plus_one_threshold': N_PLUS_ONE_THRESHOLD,
+        'requests': profiles[:limit],
+    })
 
 @admin_bp.route('/system/update', methods=['POST'])
 @admin_required
 def update_system():
-    # Get all form data
-    for key, value in request.form.items():
-        if key.startswith('setting_'):
-            setting_key = key[8:]  # Remove 'setting_' prefix
-            
-            # Find the setting
-            setting = SystemSetting.query.filter_by(key=setting_key).first()
-            
-            # If setting exists, update it
-            if setting:
-                setting.value = value
-            # Otherwise, create it
-            else:
-                setting = SystemSetting(key=setting_key, value=value)
-                db.session.add(setting)
+    values = {key[8:]: value for key, value in request.form.items()  # Remove 'setting_' prefix
+              if key.startswith('setting_') and not key.startswith('setting__')}
+    # Unchecked checkboxes aren't submitted at all
+    for key, setting in SETTINGS.items():
+        if setting.kind is bool:
+            values[key] = 'true' if values.get(key, '').lower() == 'true' else 'false'
+    
+    existing = {setting.key: setting for setting in SystemSetting.query.filter(SystemSetting.key.in_(values)).all()}
+    for setting_key, value in values.items():
+        setting = existing.get(setting_key)
+        
+        # If setting exists, update it
+        if setting:
+            setting.value = value
+        # Otherwise, create it
+        else:
+            db.session.add(SystemSetting(key=setting_key, value=value))
+    
+    # Every worker reloads its settings once this commits
+    bump_settings_version()
     
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="Admin Updated System Settings",
         details="Updated system configuration settings",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     
     db.session.commit()
     
     flash('System settings updated successfully.', 'success')
     return redirect(url_for('admin.system'))
 
+def _log_filters(args):
+    """
+    Conditions for the admin log viewer's filters. Each one matches the leading
+    column of an index that ends in (created_at, id), so filtered pages stay index scans.
+
+    Returns:
+        tuple: (list of conditions, dict of the filters that were applied)
+    """
+    conditions = []
+    applied = {}
+    user = args.get('user', '').strip()
+    if user:
+        # A username is looked up by its unique index; entries of deleted users can
+        # still be found by id.
+        user_id = int(user) if user.isdigit() else \
+            db.session.execute(select(User.id).where(User.username == user)).scalar()
+        conditions.append(ActivityLog.user_id == user_id if user_id is not None else false())
+        applied['user'] = user
+    for name, column in (('action', ActivityLog.action), ('ip', ActivityLog.ip_address)):
+        value = args.get(name, '').strip()
+        if value:
+            conditions.append(column == value)
+            applied[name] = value
+    for name in ('date_from', 'date_to'):
+        try:
+            day = datetime.strptime(args.get(name, ''), '%Y-%m-%d')
+        except ValueError:
+            continue
+        if name == 'date_from':
+            conditions.append(ActivityLog.created_at >= day)
+        else:
+            conditions.append(ActivityLog.created_at < day + timedelta(days=1))
+        applied[name] = day.strftime('%Y-%m-%d')
+    return conditions, applied
+
+def _log_cursor(entry):
+    return f"{entry.created_at.isoformat()},{entry.id}"
+
+def _parse_log_cursor(value):
+    if not value:
+        return None
+    try:
+        created_at, log_id = value.rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(log_id)
+    except ValueError:
+        return None
+
 @admin_bp.route('/logs')
 @admin_required
 def logs():
+    # Keyset pages, newest first: `before` continues to older entries and `after` goes
+    # back to newer ones, both from a (created_at, id) cursor, so a page deep into the
+    # log costs the same as the first and no total count is needed.
+    conditions, filters = _log_filters(request.args)
+    before = _parse_log_cursor(request.args.get('before'))
+    after = _parse_log_cursor(request.args.get('after'))
+    key = tuple_(ActivityLog.created_at, ActivityLog.id)
+    
+    # Show entries this worker has queued but not yet written. Other workers' last
+    # FLUSH_INTERVAL may not be in yet; a page view doesn't wait for them.
+    flush_activity_log()
+    query = db.session.query(ActivityLog, User.username).outerjoin(User, User.id == ActivityLog.user_id) \
+        .filter(*conditions)
+    if after:
+        query = query.filter(key > after).order_by(ActivityLog.created_at, ActivityLog.id)
+    else:
+        if before:
+            query = query.filter(key < before)
+        query = query.order_by(ActivityLog.created_at.desc(), ActivityLog.id.desc())
+    rows = query.limit(LOGS_PER_PAGE + 1).all()
+    more = len(rows) > LOGS_PER_PAGE
+    rows = rows[:LOGS_PER_PAGE]
+    if after:
+        rows.reverse()
+    
+    newer_cursor = older_cursor = None
+    if rows:
+        if before or (after and more):
+            newer_cursor = _log_cursor(rows[0][0])
+        if more or after:
+            older_cursor = _log_cursor(rows[-1][0])
+    
+    return render_template('admin/logs.html', rows=rows, filters=filters,
+                           newer_cursor=newer_cursor, older_cursor=older_cursor,
+                           archived_days=get_archive().days(), retention_days=RETENTION_DAYS)
+
+@admin_bp.route('/logs/export')
+@admin_required
+def export_logs():
+    """Stream every entry matching the viewer's filters as CSV or NDJSON, newest first."""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        flash('Unknown export format.', 'danger')
+        return redirect(url_for('admin.logs'))
+    conditions, _ = _log_filters(request.args)
+    columns = ('id', 'created_at', 'user_id', 'username', 'action', 'details', 'ip_address')
+    query = select(ActivityLog.id, ActivityLog.created_at, ActivityLog.user_id, User.username, ActivityLog.action,
+                   ActivityLog.details, ActivityLog.ip_address) \
+        .outerjoin(User, User.id == ActivityLog.user_id).where(*conditions) \
+        .order_by(ActivityLog.created_at.desc(), ActivityLog.id.desc())
+    # Wait out every worker's writer, so the export has everything logged before it
+    flush_activity_log(all_workers=True)
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            # Sent on its own first, so an export that matches nothing is still a valid CSV.
+            writer.writerow(columns)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # A server-side cursor on PostgreSQL; rows are fetched EXPORT_BATCH_SIZE at a
+        # time and each batch is sent before the next is read, so memory stays flat.
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=EXPORT_BATCH_SIZE).execute(query)
+            for batch in result.partitions(EXPORT_BATCH_SIZE):
+                for row in batch:
+                    values = row._asdict()
+                    values['created_at'] = values['created_at'].isoformat() if values['created_at'] else None
+                    if export_format == 'csv':
+                        writer.writerow([values[column] for column in columns])
+                    else:
+                        buffer.write(json.dumps(values) + "\n")
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    
+    filename = f"activity-logs-{datetime.utcnow():%Y%m%d-%H%M%S}.{export_format}"
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@admin_bp.route('/logs/archive/<day>')
+@admin_required
+def archived_logs(day):
     page = request.args.get('page', 1, type=int)
     per_page = 50
     
-    logs = ActivityLog.query.order_by(ActivityLog.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False)
+    try:
+        entries = get_archive().read_day(datetime.strptime(day, '%Y-%m-%d').date().isoformat())
+    except (ValueError, FileNotFoundError):
+        flash(f'No archived logs for {day}.', 'warning')
+        return redirect(url_for('admin.logs'))
+    
+    pages = max((len(entries) + per_page - 1) // per_page, 1)
+    page = min(max(page, 1), pages)
+    entries = entries[(page - 1) * per_page:page * per_page]
+    user_ids = {entry['user_id'] for entry in entries}
+    usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids)).all()) if user_ids else {}
     
-    return render_template('admin/logs.html', logs=logs)
+    return render_template('admin/archived_logs.html', day=day, entries=entries, usernames=usernames,
+                           page=page, pages=pages)
 
 @admin_bp.route('/logs/clear', methods=['POST'])
 @admin_required
 def clear_logs():
-    # Delete all logs
-    num_deleted = db.session.query(ActivityLog).delete()
+    # Include entries still queued in any worker, so max_id covers everything logged
+    # before the click, then delete in chunks on the job queue so the table is never
+    # locked for the whole delete
+    flush_activity_log(all_workers=True)
+    max_id = db.session.query(db.func.max(ActivityLog.id)).scalar()
+    if max_id is None:
+        flash('There are no activity logs to clear.', 'info')
+        return redirect(url_for('admin.logs'))
     
-    # Create a log for the deletion
-    log = ActivityLog(
-        user_id=current_user.id,
-        action="Admin Cleared Logs",
-        details=f"Cleared {num_deleted} log entries",
-        ip_address=request.remote_addr
-    )
-    db.session.add(log)
-    
-    db.session.commit()
+    enqueue_job('activity_log.clear', {
+        'max_id': max_id,
+        'ip_address': request.remote_addr,
+    }, user_id=current_user.id, resource="activity_logs")
     
-    flash('Activity logs cleared successfully.', 'success')
+    flash('Activity logs are being cleared.', 'info')
     return redirect(url_for('admin.logs'))
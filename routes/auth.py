@@ -5,7 +5,9 @@ from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
 
 from app import db
-from models import User, ActivityLog
+from models import User
+from utils.activity_log import log_activity
+from utils.settings import get_setting
 
 # Create blueprint
 auth_bp = Blueprint('auth', __name__)
@@ -40,14 +42,13 @@ def login():
             user.last_login = datetime.utcnow()
             
             # Log activity
-            log = ActivityLog(
+            log_activity(
                 user_id=user.id,
                 action="User Login",
                 details="User logged in successfully",
                 ip_address=request.remote_addr
             )
             
-            db.session.add(log)
             db.session.commit()
             
             flash('Login successful!', 'success')
@@ -65,13 +66,12 @@ def login():
 @login_required
 def logout():
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="User Logout",
         details="User logged out",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     db.session.commit()
     
     logout_user()
@@ -81,14 +81,7 @@ def logout():
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
     # Check if registration is allowed (system setting)
-    from models import SystemSetting
-    
-    registration_allowed = True
-    setting = SystemSetting.query.filter_by(key='allow_registration').first()
-    if setting and setting.value.lower() == 'false':
-        registration_allowed = False
-    
-    if not registration_allowed:
+    if not get_setting('allow_registration'):
         flash('Registration is currently disabled. Please contact the administrator.', 'warning')
         return redirect(url_for('auth.login'))
     
@@ -140,13 +133,12 @@ def register():
             db.session.commit()
             
             # Now that the user has an ID, log the activity
-            log = ActivityLog(
+            log_activity(
                 user_id=user.id,
                 action="User Registration",
                 details="New user account created",
                 ip_address=request.remote_addr
             )
-            db.session.add(log)
             db.session.commit()
             
             flash('Registration successful! You can now login.', 'success')
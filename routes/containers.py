@@ -2,49 +2,64 @@ import logging
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from app import db # Assuming app.py initializes db
-from models import Container, Service, ActivityLog
+from models import Container, Service
+from utils.activity_log import log_activity
 # Import the two new functions and get_container_ip
-from utils.container import create_base_docker_container, provision_container_software, \
+from utils.container import create_base_docker_container, install_template_packages, start_template_services, \
                             start_container as start_docker_container, \
                             stop_container as stop_docker_container, \
                             restart_container as restart_docker_container, \
                             delete_container as delete_docker_container, \
                             get_container_ip
-import threading # For background tasks
+from utils.images import get_image_for_template
+from utils.warm_pool import claim_warm_container
+from utils.jobs import register_job, enqueue_job, latest_job
+from utils.metrics import container_series
 
 # Create blueprint
 containers_bp = Blueprint('containers', __name__, url_prefix='/containers')
 logger = logging.getLogger(__name__)
 
-def _run_provisioning_in_background(app_context, container_db_id, container_docker_id, template):
-    with app_context: # Need app context for db operations in thread
+def _provision_install_packages(ctx):
+    if not ctx.payload['prebuilt']:
+        install_template_packages(ctx.payload['container_docker_id'], ctx.payload['template'], progress=ctx.progress)
+
+def _provision_start_services(ctx):
+    start_template_services(ctx.payload['container_docker_id'], ctx.payload['template'])
+
+def _provision_finish(ctx):
+    container_db_id = ctx.payload['container_db_id']
+    container_docker_id = ctx.payload['container_docker_id']
+    container_to_update = Container.query.get(container_db_id)
+    if container_to_update:
+        container_to_update.status = 'running'
+        container_to_update.ip_address = get_container_ip(container_docker_id)
+        db.session.commit()
+        logger.info(f"Provisioning SUCCESS for DB ID {container_db_id}, Docker ID {container_docker_id}. Status set to running.")
+    else:
+        logger.error(f"Container DB record {container_db_id} not found after provisioning.")
+
+def _provision_failed(ctx, error):
+    container_db_id = ctx.payload['container_db_id']
+    container_docker_id = ctx.payload['container_docker_id']
+    logger.error(f"Provisioning FAILED for DB ID {container_db_id}, Docker ID {container_docker_id}: {error}")
+    container_to_update = Container.query.get(container_db_id)
+    if container_to_update:
+        container_to_update.status = 'error_provisioning'
+        # Optionally, try to stop/delete the partially created Docker container
         try:
-            logger.info(f"Background provisioning started for DB ID {container_db_id}, Docker ID {container_docker_id}")
-            provision_container_software(container_docker_id, template)
-            
-            # Update DB record on successful provisioning
-            container_to_update = Container.query.get(container_db_id)
-            if container_to_update:
-                container_to_update.status = 'running'
-                container_to_update.ip_address = get_container_ip(container_docker_id)
-                db.session.commit()
-                logger.info(f"Background provisioning SUCCESS for DB ID {container_db_id}, Docker ID {container_docker_id}. Status set to running.")
-            else:
-                logger.error(f"Container DB record {container_db_id} not found after provisioning.")
+            stop_docker_container(container_docker_id) # Stop it
+            # delete_docker_container(container_docker_id) # Or delete it
+            logger.info(f"Partially provisioned Docker container {container_docker_id} stopped.")
+        except Exception as docker_err:
+            logger.error(f"Could not stop/delete partially provisioned Docker container {container_docker_id}: {docker_err}")
+        db.session.commit()
 
-        except Exception as e:
-            logger.error(f"Background provisioning FAILED for DB ID {container_db_id}, Docker ID {container_docker_id}: {str(e)}")
-            container_to_update = Container.query.get(container_db_id)
-            if container_to_update:
-                container_to_update.status = 'error_provisioning'
-                # Optionally, try to stop/delete the partially created Docker container
-                try:
-                    stop_docker_container(container_docker_id) # Stop it
-                    # delete_docker_container(container_docker_id) # Or delete it
-                    logger.info(f"Partially provisioned Docker container {container_docker_id} stopped.")
-                except Exception as docker_err:
-                    logger.error(f"Could not stop/delete partially provisioned Docker container {container_docker_id}: {docker_err}")
-                db.session.commit()
+register_job('container.provision', [
+    ('install_packages', _provision_install_packages),
+    ('start_services', _provision_start_services),
+    ('finish', _provision_finish),
+], on_failure=_provision_failed)
 
 @containers_bp.route('/')
 @login_required
@@ -91,10 +106,30 @@ def create():
     db.session.add(container_db_record)
     db.session.commit() # Commit to get container_db_record.id
 
+    # 2. Take a ready container from the warm pool when one is available
+    try:
+        warm_docker_id = claim_warm_container(template, container_name_docker, cpu_allocated, memory_allocated)
+    except Exception as e:
+        logger.error(f"Could not claim a warm pool container for {name}: {str(e)}")
+        warm_docker_id = None
+
+    if warm_docker_id:
+        container_db_record.container_id = warm_docker_id
+        container_db_record.status = 'running'
+        container_db_record.ip_address = get_container_ip(warm_docker_id)
+        log_activity(
+            user_id=current_user.id, action="Container Created",
+            details=f"Created container: {name} (Docker ID: {warm_docker_id}) from the warm pool",
+            ip_address=request.remote_addr
+        )
+        db.session.commit()
+        flash(f'Container {name} created and running.', 'success')
+        return redirect(url_for('containers.index'))
+
     try:
-        # 2. Create the base Docker container (fast part)
-        # Image name for ubuntu:20.04, could be dynamic based on template
-        image_to_use = "ubuntu:20.04" 
+        # 3. Create the base Docker container (fast part)
+        # Prefer the template's prebuilt image; falls back to plain ubuntu:20.04 while it is being built
+        image_to_use, prebuilt = get_image_for_template(template)
         actual_docker_id = create_base_docker_container(
             container_name_docker, 
             image_to_use, 
@@ -109,21 +144,19 @@ def create():
         container_db_record.ip_address = get_container_ip(actual_docker_id)
         db.session.commit()
 
-        # 3. Start software provisioning in a background thread
-        # Pass current_app.app_context() to use in the thread
-        app_ctx = current_app.app_context()
-        provisioning_thread = threading.Thread(
-            target=_run_provisioning_in_background, 
-            args=(app_ctx, container_db_record.id, actual_docker_id, template)
-        )
-        provisioning_thread.start()
+        # 4. Queue software provisioning; the job queue limits how many run at once
+        enqueue_job('container.provision', {
+            'container_db_id': container_db_record.id,
+            'container_docker_id': actual_docker_id,
+            'template': template,
+            'prebuilt': prebuilt,
+        }, user_id=current_user.id, resource=f"container:{container_db_record.id}")
 
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id, action="Container Creation Initiated",
             details=f"Initiated creation for container: {name} (Docker ID: {actual_docker_id})",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         db.session.commit()
         
         flash(f'Container {name} creation initiated. It will appear as "creating" and will be ready in a few minutes.', 'info')
@@ -137,7 +170,8 @@ def create():
                  existing_rec.status = 'error_creating_base'
                  db.session.commit()
              else: # If somehow it was deleted or not found after rollback, try to delete any partial
-                  Container.query.filter_by(name=name, user_id=current_user.id, status='creating').delete()
+                  for partial in Container.query.filter_by(name=name, user_id=current_user.id, status='creating').all():
+                      db.session.delete(partial)
                   db.session.commit()
 
 
@@ -159,8 +193,7 @@ def start(container_db_id):
         start_docker_container(container.container_id) # container.container_id is the Docker name/ID
         container.status = 'running'
         container.ip_address = get_container_ip(container.container_id) # Refresh IP on start
-        log = ActivityLog(user_id=current_user.id, action="Container Started", details=f"Started container: {container.name}", ip_address=request.remote_addr)
-        db.session.add(log)
+        log_activity(user_id=current_user.id, action="Container Started", details=f"Started container: {container.name}", ip_address=request.remote_addr)
         db.session.commit()
         flash(f'Container {container.name} started successfully.', 'success')
     except Exception as e:
@@ -179,8 +212,7 @@ def stop(container_db_id):
     try:
         stop_docker_container(container.container_id)
         container.status = 'stopped'
-        log = ActivityLog(user_id=current_user.id, action="Container Stopped", details=f"Stopped container: {container.name}", ip_address=request.remote_addr)
-        db.session.add(log)
+        log_activity(user_id=current_user.id, action="Container Stopped", details=f"Stopped container: {container.name}", ip_address=request.remote_addr)
         db.session.commit()
         flash(f'Container {container.name} stopped successfully.', 'success')
     except Exception as e:
@@ -200,8 +232,7 @@ def restart(container_db_id):
         restart_docker_container(container.container_id)
         container.status = 'running' # Assumes restart leads to running
         container.ip_address = get_container_ip(container.container_id) # Refresh IP
-        log = ActivityLog(user_id=current_user.id, action="Container Restarted", details=f"Restarted container: {container.name}", ip_address=request.remote_addr)
-        db.session.add(log)
+        log_activity(user_id=current_user.id, action="Container Restarted", details=f"Restarted container: {container.name}", ip_address=request.remote_addr)
         db.session.commit()
         flash(f'Container {container.name} restarted successfully.', 'success')
     except Exception as e:
@@ -229,16 +260,18 @@ def delete(container_db_id):
         container_display_name = container.name # Store for logging before deleting DB record
 
         # Delete services related to this container from DB first
-        Service.query.filter_by(container_id=container.id).delete()
+        # One by one rather than a bulk delete, so the system counters see them go
+        for service in Service.query.filter_by(container_id=container.id).all():
+            db.session.delete(service)
         
         # Delete the container DB record
         db.session.delete(container)
         
         # Then delete the Docker container
         delete_docker_container(docker_id_to_delete) # This will stop it if running
+        container_series.delete(docker_id_to_delete)
         
-        log = ActivityLog(user_id=current_user.id, action="Container Deleted", details=f"Deleted container: {container_display_name} (Docker ID: {docker_id_to_delete})", ip_address=request.remote_addr)
-        db.session.add(log)
+        log_activity(user_id=current_user.id, action="Container Deleted", details=f"Deleted container: {container_display_name} (Docker ID: {docker_id_to_delete})", ip_address=request.remote_addr)
         db.session.commit()
         flash(f'Container {container_display_name} deleted successfully.', 'success')
     except Exception as e:
@@ -254,9 +287,13 @@ def status_check(container_db_id):
     container = Container.query.get_or_404(container_db_id)
     if container.user_id != current_user.id:
         return jsonify({'error': 'Permission denied'}), 403
+    job = latest_job(f"container:{container.id}") if container.status == 'creating' else None
     return jsonify({
         'id': container.id,
         'name': container.name,
         'status': container.status,
-        'ip_address': container.ip_address
+        'ip_address': container.ip_address,
+        'job_status': job.status if job else None,
+        'step': job.step if job else None,
+        'progress': job.progress if job else None
     })
@@ -2,7 +2,8 @@ import logging
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from app import db
-from models import Container, CronJob, ActivityLog
+from models import Container, CronJob
+from utils.activity_log import log_activity
 
 # Create blueprint
 cronjobs_bp = Blueprint('cronjobs', __name__, url_prefix='/cronjobs')
@@ -51,13 +52,12 @@ def create():
         db.session.add(cronjob)
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="Cron Job Created",
             details=f"Created cron job: {name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         db.session.commit()
         
@@ -93,13 +93,12 @@ def toggle(job_id):
         
         # Log activity
         action = "Cron Job Enabled" if cronjob.active else "Cron Job Disabled"
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action=action,
             details=f"{action}: {cronjob.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         db.session.commit()
         
@@ -134,13 +133,12 @@ def delete(job_id):
         job_name = cronjob.name
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="Cron Job Deleted",
             details=f"Deleted cron job: {job_name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         # Delete cron job from database
         db.session.delete(cronjob)
@@ -1,10 +1,13 @@
 import logging
 import datetime
-from flask import Blueprint, render_template, redirect, url_for, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, request, jsonify, Response, current_app
 from flask_login import login_required, current_user
 from app import db
 from models import Container, Website, Database, Service, CronJob, ActivityLog
-from utils.monitoring import get_system_stats, get_user_resources
+from utils.monitoring import get_user_resources, get_system_stats
+from utils.metrics import get_container_metrics, get_container_history, CONTAINER_SERIES_METRICS
+from utils.live_updates import get_publisher, event_stream, container_stats as build_container_stats, \
+                               STREAM_MAX_SECONDS
 
 # Create blueprint
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
@@ -16,13 +19,11 @@ def index():
     # Get user's containers
     containers = Container.query.filter_by(user_id=current_user.id).all()
     
-    # Get resource usage statistics
-    resources = get_user_resources(current_user.id)
-    
-    # Count websites, databases, and services
-    website_count = Website.query.filter_by(user_id=current_user.id).count()
-    database_count = Database.query.filter_by(user_id=current_user.id).count()
-    service_count = Service.query.join(Container).filter(Container.user_id == current_user.id).count()
+    # Resource usage and all the counts come from one grouped query
+    resources = get_user_resources(current_user.id, containers=containers)
+    website_count = resources['website_count']
+    database_count = resources['database_count']
+    service_count = resources['service_count']
     
     # Recent activity logs
     recent_logs = ActivityLog.query.filter_by(user_id=current_user.id)\
@@ -44,25 +45,58 @@ def stats():
     # Get user's containers
     containers = Container.query.filter_by(user_id=current_user.id).all()
     
-    # For now, we'll use the same system stats for all containers
-    # In a real implementation, we would query each container's actual stats
-    system_stats = get_system_stats()
-    
-    # Get system stats for all containers
-    container_stats = {}
-    for container in containers:
-        # Apply container-specific stats here (in a real implementation)
-        container_stats[container.id] = {
-            'cpu_usage': system_stats['cpu_usage'] / max(len(containers), 1),
-            'memory_used': int(system_stats['memory_used'] / max(len(containers), 1)),
-            'disk_used': int(system_stats['disk_used'] / max(len(containers), 1)),
-            'status': container.status
-        }
+    # Usage comes from the metrics collector's latest samples; no Docker calls here
+    container_stats = {container.id: build_container_stats(container, get_container_metrics(container.container_id))
+                       for container in containers}
     
     # Get resource usage
-    resources = get_user_resources(current_user.id)
+    resources = get_user_resources(current_user.id, containers=containers)
     
-    return jsonify({
+    response = {
         'container_stats': container_stats,
         'resources': resources
-    })
+    }
+    if current_user.role == 'admin':
+        # Host figures come from the background sampler's shared snapshot
+        response['system'] = get_system_stats()
+    return jsonify(response)
+
+@dashboard_bp.route('/events')
+@login_required
+def events():
+    """
+    Server-Sent Events stream of the user's container, service and job status.
+    
+    The first event is a full snapshot (same container shape as /stats); after that only
+    changes are sent. The pages keep one of these open instead of polling /stats, unless
+    this worker is at its stream limit: then the answer is 503 and they poll.
+    """
+    publisher = get_publisher(current_app._get_current_object())
+    subscription = publisher.subscribe(current_user.id, is_admin=current_user.role == 'admin')
+    if subscription is None:
+        response = jsonify({'error': 'Too many live update streams; poll /dashboard/stats'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(STREAM_MAX_SECONDS)
+        return response
+    response = Response(event_stream(publisher, subscription), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@dashboard_bp.route('/containers/<int:container_db_id>/history')
+@login_required
+def container_history(container_db_id):
+    """Return recorded usage of one container over a time range, for history charts"""
+    container = Container.query.get_or_404(container_db_id)
+    if container.user_id != current_user.id and current_user.role != 'admin':
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    metric = request.args.get('metric', 'cpu_cores')
+    if metric not in CONTAINER_SERIES_METRICS:
+        return jsonify({'error': f'Unknown metric: {metric}'}), 400
+    # Up to 30 days, which is what the hourly tier holds
+    seconds = min(max(request.args.get('seconds', 3600, type=int), 60), 30 * 86400)
+    resolution = request.args.get('resolution', type=int)
+    
+    return jsonify(get_container_history(container.container_id, metric, seconds, resolution))
@@ -2,19 +2,69 @@ import logging
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from app import db
-from models import Container, Database, ActivityLog
+from models import Container, Database, Job
+from utils.activity_log import log_activity
 from utils.database import create_database, delete_database, generate_password
+from utils.jobs import register_job, enqueue_job, active_jobs
 
 # Create blueprint
 databases_bp = Blueprint('databases', __name__, url_prefix='/databases')
 logger = logging.getLogger(__name__)
 
+def _database_create(ctx):
+    payload = ctx.payload
+    create_database(
+        payload['container_docker_id'],
+        payload['name'],
+        payload['db_type'],
+        payload['db_user'],
+        payload['db_password'],
+        payload['remote_access']
+    )
+
+def _database_record(ctx):
+    payload = ctx.payload
+    if Database.query.filter_by(user_id=ctx.user_id, name=payload['name']).first():
+        return # Recorded by an earlier attempt that stopped before the step was marked done
+    database = Database(
+        user_id=ctx.user_id,
+        container_id=payload['container_db_id'],
+        name=payload['name'],
+        db_type=payload['db_type'],
+        db_user=payload['db_user'],
+        db_password=payload['db_password'],
+        remote_access=payload['remote_access']
+    )
+    db.session.add(database)
+    log_activity(
+        user_id=ctx.user_id,
+        action="Database Created",
+        details=f"Created database: {payload['name']}",
+        ip_address=payload.get('ip_address')
+    )
+    db.session.commit()
+
+def _database_failed(ctx, error):
+    log_activity(
+        user_id=ctx.user_id,
+        action="Database Creation Failed",
+        details=f"Failed to create database {ctx.payload['name']}: {error}",
+        ip_address=ctx.payload.get('ip_address')
+    )
+    db.session.commit()
+
+register_job('database.create', [
+    ('create', _database_create),
+    ('record', _database_record),
+], on_failure=_database_failed, secret_keys=['db_password'])
+
 @databases_bp.route('/')
 @login_required
 def index():
     databases = Database.query.filter_by(user_id=current_user.id).all()
     containers = Container.query.filter_by(user_id=current_user.id).all()
-    return render_template('dashboard/databases.html', databases=databases, containers=containers)
+    jobs = active_jobs(current_user.id, kinds=['database.create'])
+    return render_template('dashboard/databases.html', databases=databases, containers=containers, jobs=jobs)
 
 @databases_bp.route('/create', methods=['POST'])
 @login_required
@@ -46,41 +96,25 @@ def create():
     if not db_password:
         db_password = generate_password()
     
+    if Job.query.filter(Job.kind == 'database.create', Job.resource == f"database:{current_user.id}:{name}",
+                        Job.status.in_(['queued', 'running'])).first():
+        flash('This database is already being created.', 'warning')
+        return redirect(url_for('databases.index'))
+    
     try:
-        # Create database on the container
-        create_database(
-            container.container_id,
-            name,
-            db_type,
-            db_user,
-            db_password,
-            remote_access
-        )
-        
-        # Create database record in database
-        database = Database(
-            user_id=current_user.id,
-            container_id=container.id,
-            name=name,
-            db_type=db_type,
-            db_user=db_user,
-            db_password=db_password,
-            remote_access=remote_access
-        )
-        db.session.add(database)
-        
-        # Log activity
-        log = ActivityLog(
-            user_id=current_user.id,
-            action="Database Created",
-            details=f"Created database: {name}",
-            ip_address=request.remote_addr
-        )
-        db.session.add(log)
-        
-        db.session.commit()
+        # Installing the database server can take minutes, so it runs on the job queue
+        enqueue_job('database.create', {
+            'container_db_id': container.id,
+            'container_docker_id': container.container_id,
+            'name': name,
+            'db_type': db_type,
+            'db_user': db_user,
+            'db_password': db_password,
+            'remote_access': remote_access,
+            'ip_address': request.remote_addr,
+        }, user_id=current_user.id, resource=f"database:{current_user.id}:{name}")
         
-        flash(f'Database {name} created successfully.', 'success')
+        flash(f'Database {name} is being created. It will appear in the list when ready.', 'info')
     except Exception as e:
         logger.error(f"Error creating database: {str(e)}")
         flash(f'Error creating database: {str(e)}', 'danger')
@@ -114,13 +148,12 @@ def delete(database_id):
         db_name = database.name
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="Database Deleted",
             details=f"Deleted database: {db_name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         # Delete database from database
         db.session.delete(database)
@@ -158,13 +191,12 @@ def toggle_remote(database_id):
         
         # Log activity
         action = "Remote Access Enabled" if database.remote_access else "Remote Access Disabled"
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action=action,
             details=f"{action} for database: {database.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         db.session.commit()
         
@@ -3,7 +3,8 @@ import os
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file
 from flask_login import login_required, current_user
 from app import db
-from models import Container, ActivityLog
+from models import Container
+from utils.activity_log import log_activity
 from werkzeug.utils import secure_filename
 import tempfile
 
@@ -64,13 +65,12 @@ def view():
         content = read_file(container.container_id, file_path)
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="File Viewed",
             details=f"Viewed file: {file_path} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         db.session.commit()
         
         return render_template('dashboard/file_editor.html', 
@@ -103,13 +103,12 @@ def edit():
         write_file(container.container_id, file_path, content)
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="File Edited",
             details=f"Edited file: {file_path} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         db.session.commit()
         
         flash(f'File {file_path} saved successfully.', 'success')
@@ -141,13 +140,12 @@ def mkdir():
         create_directory(container.container_id, dir_path)
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="Directory Created",
             details=f"Created directory: {dir_path} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         db.session.commit()
         
         flash(f'Directory {dir_name} created successfully.', 'success')
@@ -189,13 +187,12 @@ def upload():
         os.unlink(temp.name)
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="File Uploaded",
             details=f"Uploaded file: {file_path} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         db.session.commit()
         
         flash(f'File {filename} uploaded successfully.', 'success')
@@ -225,13 +222,12 @@ def download():
         temp_file = download_file(container.container_id, file_path)
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="File Downloaded",
             details=f"Downloaded file: {file_path} from container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         db.session.commit()
         
         return send_file(temp_file, as_attachment=True, download_name=os.path.basename(file_path))
@@ -260,13 +256,12 @@ def delete():
         delete_file(container.container_id, file_path)
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="File Deleted",
             details=f"Deleted file: {file_path} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         db.session.commit()
         
         flash(f'File {os.path.basename(file_path)} deleted successfully.', 'success')
@@ -297,13 +292,12 @@ def download_url():
         filename = download_url_to_container(container.container_id, url, current_dir)
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="URL Downloaded",
             details=f"Downloaded URL: {url} to {current_dir}/{filename} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         db.session.commit()
         
         flash(f'URL downloaded successfully as {filename}.', 'success')
@@ -0,0 +1,27 @@
+import os
+import hmac
+import ipaddress
+from flask import Blueprint, Response, request, abort
+from utils.openmetrics import registry, CONTENT_TYPE
+
+# Create blueprint
+metrics_bp = Blueprint('metrics', __name__)
+
+# Scrapers send this as a bearer token. Without one, only local requests are answered.
+METRICS_TOKEN = os.environ.get("SBPANEL_METRICS_TOKEN")
+
+def _authorized():
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied.encode(), f"Bearer {METRICS_TOKEN}".encode())
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Panel, Docker and job queue metrics for every worker on this host, in OpenMetrics format"""
+    if not _authorized():
+        abort(403)
+    return Response(registry.render(), content_type=CONTENT_TYPE)
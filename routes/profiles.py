@@ -2,7 +2,8 @@ import logging
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 from app import db
-from models import User, ActivityLog, SSHKey, Favorite
+from models import User, SSHKey, Favorite
+from utils.activity_log import log_activity
 from werkzeug.security import check_password_hash
 
 # Create blueprint
@@ -33,13 +34,12 @@ def update():
             current_user.email = email
             
             # Log activity
-            log = ActivityLog(
+            log_activity(
                 user_id=current_user.id,
                 action="Profile Updated",
                 details="Updated email address",
                 ip_address=request.remote_addr
             )
-            db.session.add(log)
             db.session.commit()
             
             flash('Email updated successfully.', 'success')
@@ -54,13 +54,12 @@ def update():
             current_user.set_password(new_password)
             
             # Log activity
-            log = ActivityLog(
+            log_activity(
                 user_id=current_user.id,
                 action="Password Changed",
                 details="Password was changed",
                 ip_address=request.remote_addr
             )
-            db.session.add(log)
             db.session.commit()
             
             flash('Password updated successfully.', 'success')
@@ -91,13 +90,12 @@ def add_ssh_key():
     db.session.add(ssh_key)
     
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="SSH Key Added",
         details=f"Added SSH key: {name}",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     
     db.session.commit()
     
@@ -117,13 +115,12 @@ def delete_ssh_key(key_id):
     key_name = ssh_key.name
     
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="SSH Key Deleted",
         details=f"Deleted SSH key: {key_name}",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     
     # Delete SSH key
     db.session.delete(ssh_key)
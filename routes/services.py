@@ -1,27 +1,36 @@
 import logging
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy.orm import contains_eager
 from app import db
-from models import Container, Service, ActivityLog
+from models import Container, Service
+from utils.activity_log import log_activity
 from utils.container import start_service, stop_service, restart_service
 
 # Create blueprint
 services_bp = Blueprint('services', __name__, url_prefix='/services')
 logger = logging.getLogger(__name__)
 
+SERVICES_PER_PAGE = 200
+
 @services_bp.route('/')
 @login_required
 def index():
-    # Get all containers belonging to the user
-    containers = Container.query.filter_by(user_id=current_user.id).all()
+    # Keyset pagination on service id: ?after=<last id on the previous page>
+    after_id = request.args.get('after', type=int)
     
-    # Get all services
-    services = []
-    for container in containers:
-        container_services = Service.query.filter_by(container_id=container.id).all()
-        services.extend(container_services)
+    # The user's services with their container, in one joined query
+    query = Service.query.join(Container, Service.container_id == Container.id)\
+        .filter(Container.user_id == current_user.id)\
+        .options(contains_eager(Service.container).load_only(Container.id, Container.name))
+    if after_id is not None:
+        query = query.filter(Service.id > after_id)
+    # One extra row tells whether there is a next page
+    services = query.order_by(Service.id).limit(SERVICES_PER_PAGE + 1).all()
+    next_after = services[SERVICES_PER_PAGE - 1].id if len(services) > SERVICES_PER_PAGE else None
     
-    return render_template('dashboard/services.html', services=services, containers=containers)
+    return render_template('dashboard/services.html', services=services[:SERVICES_PER_PAGE],
+                           after_id=after_id, next_after=next_after)
 
 @services_bp.route('/start/<int:service_id>', methods=['POST'])
 @login_required
@@ -40,13 +49,12 @@ def start(service_id):
         service.status = 'running'
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="Service Started",
             details=f"Started service: {service.name} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         db.session.commit()
         
@@ -74,13 +82,12 @@ def stop(service_id):
         service.status = 'stopped'
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="Service Stopped",
             details=f"Stopped service: {service.name} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         db.session.commit()
         
@@ -108,13 +115,12 @@ def restart(service_id):
         service.status = 'running'
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="Service Restarted",
             details=f"Restarted service: {service.name} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         db.session.commit()
         
@@ -142,13 +148,12 @@ def toggle_autostart(service_id):
         
         # Log activity
         action = "Auto-start Enabled" if service.auto_start else "Auto-start Disabled"
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action=action,
             details=f"{action} for service: {service.name} on container: {container.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         db.session.commit()
         
@@ -2,20 +2,112 @@ import logging
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from app import db
-from models import Container, Website, ActivityLog, DNSRecord
+from models import Container, Website, DNSRecord, Job
+from utils.activity_log import log_activity
 from utils.webserver import create_website_config, delete_website_config
 from utils.ssl import request_ssl_certificate
+from utils.jobs import register_job, enqueue_job, active_jobs
 
 # Create blueprint
 websites_bp = Blueprint('websites', __name__, url_prefix='/websites')
 logger = logging.getLogger(__name__)
 
+def _website_configure(ctx):
+    payload = ctx.payload
+    create_website_config(
+        payload['container_docker_id'],
+        payload['domain'],
+        payload['server_type'],
+        payload['php_version'],
+        payload['document_root'],
+        payload['ssl_enabled']
+    )
+
+def _website_record(ctx):
+    payload = ctx.payload
+    existing = Website.query.filter_by(domain=payload['domain']).first()
+    if existing:
+        if existing.user_id == ctx.user_id and existing.container_id == payload['container_db_id']:
+            return # Recorded by an earlier attempt that stopped before the step was marked done
+        raise Exception(f"A website with domain {payload['domain']} already exists.")
+    website = Website(
+        user_id=ctx.user_id,
+        container_id=payload['container_db_id'],
+        domain=payload['domain'],
+        server_type=payload['server_type'],
+        php_version=payload['php_version'],
+        document_root=payload['document_root'],
+        ssl_enabled=payload['ssl_enabled']
+    )
+    db.session.add(website)
+    log_activity(
+        user_id=ctx.user_id,
+        action="Website Created",
+        details=f"Created website: {payload['domain']}",
+        ip_address=payload.get('ip_address')
+    )
+    db.session.commit()
+
+def _website_request_ssl(ctx):
+    # Its own step, so a restart after the website row is committed still queues it
+    payload = ctx.payload
+    if not payload['ssl_enabled']:
+        return
+    # Jobs queued by this one have later ids; one exists if an earlier attempt got this far
+    if Job.query.filter(Job.kind == 'ssl.issue', Job.resource == f"website:{payload['domain']}",
+                        Job.id > ctx.job_id).first():
+        return
+    _queue_ssl_certificate(payload['container_docker_id'], payload['domain'], ctx.user_id, payload.get('ip_address'))
+
+def _website_failed(ctx, error):
+    log_activity(
+        user_id=ctx.user_id,
+        action="Website Creation Failed",
+        details=f"Failed to create website {ctx.payload['domain']}: {error}",
+        ip_address=ctx.payload.get('ip_address')
+    )
+    db.session.commit()
+
+def _ssl_request(ctx):
+    request_ssl_certificate(ctx.payload['container_docker_id'], ctx.payload['domain'], user_id=ctx.user_id, progress=ctx.progress)
+
+def _ssl_failed(ctx, error):
+    log_activity(
+        user_id=ctx.user_id,
+        action="SSL Certificate Failed",
+        details=f"SSL certificate request failed for {ctx.payload['domain']}: {error}",
+        ip_address=ctx.payload.get('ip_address')
+    )
+    db.session.commit()
+
+def _queue_ssl_certificate(container_docker_id, domain, user_id, ip_address):
+    """Queue a certificate request, unless one for the domain is already queued or running."""
+    pending = Job.query.filter(Job.kind == 'ssl.issue', Job.resource == f"website:{domain}",
+                               Job.status.in_(['queued', 'running'])).first()
+    if pending:
+        return pending
+    return enqueue_job('ssl.issue', {
+        'container_docker_id': container_docker_id,
+        'domain': domain,
+        'ip_address': ip_address,
+    }, user_id=user_id, resource=f"website:{domain}")
+
+register_job('website.create', [
+    ('configure', _website_configure),
+    ('record', _website_record),
+    ('request_ssl', _website_request_ssl),
+], on_failure=_website_failed)
+
+# Let's Encrypt rate-limits failed validations, so don't retry hard
+register_job('ssl.issue', [('request', _ssl_request)], on_failure=_ssl_failed, max_attempts=2)
+
 @websites_bp.route('/')
 @login_required
 def index():
     websites = Website.query.filter_by(user_id=current_user.id).all()
     containers = Container.query.filter_by(user_id=current_user.id).all()
-    return render_template('dashboard/websites.html', websites=websites, containers=containers)
+    jobs = active_jobs(current_user.id, kinds=['website.create', 'ssl.issue'])
+    return render_template('dashboard/websites.html', websites=websites, containers=containers, jobs=jobs)
 
 @websites_bp.route('/create', methods=['POST'])
 @login_required
@@ -43,49 +135,26 @@ def create():
         flash('Invalid container selected.', 'danger')
         return redirect(url_for('websites.index'))
     
+    # A website with this domain may still be waiting in the queue
+    if Job.query.filter(Job.kind == 'website.create', Job.resource == f"website:{domain}",
+                        Job.status.in_(['queued', 'running'])).first():
+        flash('This website is already being created.', 'warning')
+        return redirect(url_for('websites.index'))
+    
     try:
-        # Create website configuration on the container
-        create_website_config(
-            container.container_id,
-            domain,
-            server_type,
-            php_version,
-            document_root,
-            ssl_enabled
-        )
-        
-        # Create website record in database
-        website = Website(
-            user_id=current_user.id,
-            container_id=container.id,
-            domain=domain,
-            server_type=server_type,
-            php_version=php_version,
-            document_root=document_root,
-            ssl_enabled=ssl_enabled
-        )
-        db.session.add(website)
-        
-        # If SSL is enabled, request certificate
-        if ssl_enabled:
-            try:
-                request_ssl_certificate(container.container_id, domain)
-            except Exception as e:
-                logger.error(f"Error requesting SSL certificate: {str(e)}")
-                flash(f'Website created, but SSL certificate request failed: {str(e)}', 'warning')
-        
-        # Log activity
-        log = ActivityLog(
-            user_id=current_user.id,
-            action="Website Created",
-            details=f"Created website: {domain}",
-            ip_address=request.remote_addr
-        )
-        db.session.add(log)
-        
-        db.session.commit()
+        # Configuring the web server can install PHP, so it runs on the job queue
+        enqueue_job('website.create', {
+            'container_db_id': container.id,
+            'container_docker_id': container.container_id,
+            'domain': domain,
+            'server_type': server_type,
+            'php_version': php_version,
+            'document_root': document_root,
+            'ssl_enabled': ssl_enabled,
+            'ip_address': request.remote_addr,
+        }, user_id=current_user.id, resource=f"website:{domain}")
         
-        flash(f'Website {domain} created successfully.', 'success')
+        flash(f'Website {domain} is being created. It will appear in the list when ready.', 'info')
     except Exception as e:
         logger.error(f"Error creating website: {str(e)}")
         flash(f'Error creating website: {str(e)}', 'danger')
@@ -117,13 +186,12 @@ def delete(website_id):
         DNSRecord.query.filter_by(website_id=website.id).delete()
         
         # Log activity
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action="Website Deleted",
             details=f"Deleted website: {domain}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         # Delete website from database
         db.session.delete(website)
@@ -165,28 +233,24 @@ def toggle_ssl(website_id):
             website.ssl_enabled
         )
         
-        # If enabling SSL, request certificate
-        if website.ssl_enabled:
-            try:
-                request_ssl_certificate(container.container_id, website.domain)
-            except Exception as e:
-                logger.error(f"Error requesting SSL certificate: {str(e)}")
-                flash(f'SSL toggled, but certificate request failed: {str(e)}', 'warning')
         
         # Log activity
         action = "SSL Enabled" if website.ssl_enabled else "SSL Disabled"
-        log = ActivityLog(
+        log_activity(
             user_id=current_user.id,
             action=action,
             details=f"{action} for website: {website.domain}",
             ip_address=request.remote_addr
         )
-        db.session.add(log)
         
         db.session.commit()
         
-        message = f'SSL {"enabled" if website.ssl_enabled else "disabled"} for {website.domain}.'
-        flash(message, 'success')
+        # If enabling SSL, request certificate
+        if website.ssl_enabled:
+            _queue_ssl_certificate(container.container_id, website.domain, current_user.id, request.remote_addr)
+            flash(f'SSL enabled for {website.domain}. The certificate is being requested.', 'success')
+        else:
+            flash(f'SSL disabled for {website.domain}.', 'success')
     except Exception as e:
         logger.error(f"Error toggling SSL: {str(e)}")
         flash(f'Error toggling SSL: {str(e)}', 'danger')
@@ -242,13 +306,12 @@ def add_dns(website_id):
     db.session.add(dns_record)
     
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="DNS Record Added",
         details=f"Added {record_type} record for {website.domain}: {name}",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     
     db.session.commit()
     
@@ -270,13 +333,12 @@ def delete_dns(record_id):
     name = dns_record.name
     
     # Log activity
-    log = ActivityLog(
+    log_activity(
         user_id=current_user.id,
         action="DNS Record Deleted",
         details=f"Deleted {record_type} record for {website.domain}: {name}",
         ip_address=request.remote_addr
     )
-    db.session.add(log)
     
     # Delete record
     db.session.delete(dns_record)
@@ -7,10 +7,40 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize form validation
     initFormValidation();
     
-    // Set up status refresh
-    setInterval(refreshContainerStatus, 30000); // Refresh every 30 seconds
+    // Container status and provisioning progress are pushed by the server as they change
+    onLiveUpdate(applyContainerUpdate);
 });
 
+/**
+ * Apply a live update (snapshot or delta) to the container list
+ * @param {Object} update - Changed container stats and jobs
+ */
+function applyContainerUpdate(update) {
+    const containers = update.container_stats || {};
+    for (const [containerId, stats] of Object.entries(containers)) {
+        const row = document.querySelector(`[data-container-id="${containerId}"]`);
+        if (row && row.getAttribute('data-container-status') === 'creating' && stats.status !== 'creating') {
+            // Provisioning finished; reload to pick up the new status, IP and actions
+            window.location.reload();
+            return;
+        }
+        updateContainerRow(containerId, stats);
+    }
+    
+    // Show live provisioning output for containers that are still being created
+    const jobs = update.jobs || {};
+    for (const job of Object.values(jobs)) {
+        if (!job.resource || !job.resource.startsWith('container:')) continue;
+        const containerId = job.resource.slice('container:'.length);
+        const progressElement = document.getElementById(`container-progress-${containerId}`);
+        const progressText = job.progress || (job.status === 'queued' ? 'Waiting in queue...' : job.step);
+        if (progressElement && progressText) {
+            progressElement.textContent = progressText;
+            progressElement.title = progressText;
+        }
+    }
+}
+
 /**
  * Initialize form validation for container creation
  */
@@ -45,32 +75,6 @@ function initFormValidation() {
     }
 }
 
-/**
- * Refresh container status
- */
-function refreshContainerStatus() {
-    // Get all container rows
-    const containerRows = document.querySelectorAll('[data-container-id]');
-    if (containerRows.length === 0) return;
-    
-    // Extract container IDs
-    const containerIds = Array.from(containerRows).map(row => row.getAttribute('data-container-id'));
-    
-    // Fetch container status
-    fetch('/dashboard/stats')
-        .then(response => response.json())
-        .then(data => {
-            // Update container stats
-            const containers = data.container_stats;
-            for (const [containerId, stats] of Object.entries(containers)) {
-                updateContainerRow(containerId, stats);
-            }
-        })
-        .catch(error => {
-            console.error('Error fetching container stats:', error);
-        });
-}
-
 /**
  * Update container row with latest status
  * @param {string} containerId - Container ID
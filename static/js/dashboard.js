@@ -7,9 +7,8 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize resource usage charts
     initResourceCharts();
     
-    // Fetch live stats for containers
-    setInterval(fetchContainerStats, 10000); // Update every 10 seconds
-    fetchContainerStats(); // Initial fetch
+    // Container stats and resource usage are pushed by the server as they change
+    onLiveUpdate(applyDashboardUpdate);
 });
 
 /**
@@ -145,24 +144,20 @@ function initResourceCharts() {
 }
 
 /**
- * Fetch container stats and update the UI
+ * Apply a live update (snapshot or delta) to the UI
+ * @param {Object} update - Changed container stats and resource usage
  */
-function fetchContainerStats() {
-    fetch('/dashboard/stats')
-        .then(response => response.json())
-        .then(data => {
-            // Update container stats
-            const containers = data.container_stats;
-            for (const [containerId, stats] of Object.entries(containers)) {
-                updateContainerStats(containerId, stats);
-            }
-            
-            // Update resource usage
-            updateResourceUsage(data.resources);
-        })
-        .catch(error => {
-            console.error('Error fetching container stats:', error);
-        });
+function applyDashboardUpdate(update) {
+    // Update container stats
+    const containers = update.container_stats || {};
+    for (const [containerId, stats] of Object.entries(containers)) {
+        updateContainerStats(containerId, stats);
+    }
+    
+    // Update resource usage
+    if (update.resources) {
+        updateResourceUsage(update.resources);
+    }
 }
 
 /**
@@ -179,3 +179,91 @@ function loadContent(url, targetId, callback) {
             target.innerHTML = `<div class="alert alert-danger">Error loading content: ${error.message}</div>`;
         });
 }
+
+/**
+ * Live status updates pushed by the server over /dashboard/events
+ *
+ * Pages register handlers with onLiveUpdate; the first registration opens a single
+ * EventSource for the page. Each handler is called with a full snapshot first and
+ * then with only what changed, in the /dashboard/stats shape: container_stats,
+ * services and jobs keyed by id, resources, system (admins) and, in deltas, removed.
+ * If the server refuses the stream, /dashboard/stats is polled and passed on as
+ * snapshots (without services and jobs) until the stream is tried again.
+ */
+const liveUpdateHandlers = [];
+const LIVE_UPDATE_POLL_INTERVAL = 5000;
+const LIVE_UPDATE_STREAM_RETRY = 60000;
+
+/**
+ * Register a handler for live status updates
+ * @param {Function} handler - Called with (update, kind) where kind is 'snapshot' or 'delta'
+ */
+function onLiveUpdate(handler) {
+    liveUpdateHandlers.push(handler);
+    if (liveUpdateHandlers.length === 1) {
+        connectLiveUpdates();
+    }
+}
+
+/**
+ * Open the event stream; the browser reconnects on its own when the server closes it
+ */
+function connectLiveUpdates() {
+    if (!window.EventSource) {
+        pollLiveUpdates();
+        return;
+    }
+    
+    const source = new EventSource('/dashboard/events');
+    ['snapshot', 'delta'].forEach(kind => {
+        source.addEventListener(kind, event => {
+            dispatchLiveUpdate(JSON.parse(event.data), kind);
+        });
+    });
+    source.addEventListener('error', () => {
+        // The browser doesn't retry a refused stream (the worker is at its stream
+        // limit); poll /dashboard/stats for a while, then try the stream again.
+        if (source.readyState === EventSource.CLOSED) {
+            pollLiveUpdates(LIVE_UPDATE_STREAM_RETRY);
+        }
+    });
+}
+
+/**
+ * Fetch /dashboard/stats every LIVE_UPDATE_POLL_INTERVAL and pass it on as a snapshot
+ * @param {number} duration - Milliseconds to poll before reopening the stream; forever if omitted
+ */
+function pollLiveUpdates(duration) {
+    const started = Date.now();
+    const poll = () => {
+        fetch('/dashboard/stats')
+            .then(response => response.ok ? response.json() : null)
+            .then(update => {
+                if (update) dispatchLiveUpdate(update, 'snapshot');
+            })
+            .catch(error => console.error('Error polling status:', error))
+            .finally(() => {
+                if (duration && Date.now() - started >= duration) {
+                    connectLiveUpdates();
+                } else {
+                    setTimeout(poll, LIVE_UPDATE_POLL_INTERVAL);
+                }
+            });
+    };
+    poll();
+}
+
+/**
+ * Call every registered handler with an update
+ * @param {Object} update - Snapshot or delta
+ * @param {string} kind - 'snapshot' or 'delta'
+ */
+function dispatchLiveUpdate(update, kind) {
+    liveUpdateHandlers.forEach(handler => {
+        try {
+            handler(update, kind);
+        } catch (error) {
+            console.error('Error applying live update:', error);
+        }
+    });
+}
@@ -4,8 +4,8 @@
  */
 
 document.addEventListener('DOMContentLoaded', function() {
-    // Set up status refresh
-    setInterval(refreshServiceStatus, 30000); // Refresh every 30 seconds
+    // Service status is pushed by the server as it changes
+    onLiveUpdate(applyServiceUpdate);
     
     // Initialize tooltips
     var tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
@@ -15,36 +15,14 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 /**
- * Refresh service status
+ * Apply a live update (snapshot or delta) to the service list
+ * @param {Object} update - Changed service statuses
  */
-function refreshServiceStatus() {
-    // Get all service rows
-    const serviceRows = document.querySelectorAll('[data-service-id]');
-    if (serviceRows.length === 0) return;
-    
-    // Extract service IDs
-    const serviceIds = Array.from(serviceRows).map(row => row.getAttribute('data-service-id'));
-    
-    // For this demo, we'll just use fetch to get current status from the dashboard stats endpoint
-    fetch('/dashboard/stats')
-        .then(response => response.json())
-        .then(data => {
-            // This endpoint doesn't actually return service status, but in a real implementation
-            // you would use a dedicated endpoint for service status
-            refreshServiceStatusFromServer();
-        })
-        .catch(error => {
-            console.error('Error fetching service stats:', error);
-        });
-}
-
-/**
- * Fetch service status from server and update UI
- * This is a placeholder that would be implemented in a real system
- */
-function refreshServiceStatusFromServer() {
-    // In a real implementation, this would make a dedicated API call to get service status
-    console.log('In a real implementation, service status would be refreshed from the server');
+function applyServiceUpdate(update) {
+    const services = update.services || {};
+    for (const [serviceId, service] of Object.entries(services)) {
+        updateServiceStatus(serviceId, service.status);
+    }
 }
 
 /**
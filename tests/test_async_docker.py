@@ -0,0 +1,208 @@
+"""
+The async Docker client's HTTP framing against a fake daemon on a unix socket:
+multiplexed exec output, archive upload and download, and the container helpers
+that go through them.
+
+    python -m pytest tests/test_async_docker.py
+"""
+import io
+import os
+import json
+import base64
+import asyncio
+import tarfile
+import tempfile
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+from utils import async_docker
+from utils.async_docker import AsyncDockerClient, DockerAPIError, run_sync, exec_stream_sync
+from utils.container import ExecResult, _stream_in_container, _put_archive_creating_parent, STREAM_TAIL_BYTES
+
+API = f"/{async_docker.API_VERSION}"
+
+
+def _frame(stream, data):
+    return bytes([stream, 0, 0, 0]) + len(data).to_bytes(4, 'big') + data
+
+
+class FakeDaemon:
+    """Just enough of the Engine API for one container named 'web'."""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.directories = {'/', '/srv'}
+        self.files = {}  # path -> bytes
+        self.execs = {}  # exec id -> command
+        self.output = {}  # command[0] -> list of (stream, bytes) frames, each written separately
+        self.exit_codes = {}
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        self._ready.wait(5)
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(asyncio.start_unix_server(self._handle, self.socket_path))
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        method, target, _ = (await reader.readline()).decode().split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, _, value = line.decode().partition(':')
+            headers[key.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        url = urlsplit(target)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            await self._route(method, url.path[len(API):], query, body, writer)
+        finally:
+            writer.close()
+
+    def _respond(self, writer, status, payload=b"", headers=None, chunked=False):
+        head = [f"HTTP/1.1 {status} X"] + [f"{key}: {value}" for key, value in (headers or {}).items()]
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode()
+            head.append("Content-Type: application/json")
+        if chunked:
+            head.append("Transfer-Encoding: chunked")
+            # Uneven chunks, so the reader has to stitch the body back together.
+            chunks = [payload[i:i + 700] for i in range(0, len(payload), 700)]
+            payload = b"".join(b"%x\r\n%s\r\n" % (len(chunk), chunk) for chunk in chunks) + b"0\r\n\r\n"
+        else:
+            head.append(f"Content-Length: {len(payload)}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+
+    async def _route(self, method, path, query, body, writer):
+        parts = path.strip('/').split('/')
+        if parts[0] == 'containers' and parts[1] != 'web':
+            return self._respond(writer, 404, {'message': f"No such container: {parts[1]}"})
+        if method == 'POST' and parts[2:] == ['exec']:
+            exec_id = f"exec{len(self.execs) + 1}"
+            self.execs[exec_id] = json.loads(body)['Cmd']
+            return self._respond(writer, 201, {'Id': exec_id})
+        if method == 'POST' and parts[0] == 'exec' and parts[2] == 'start':
+            command = self.execs[parts[1]]
+            if command[:2] == ['mkdir', '-p']:
+                self.directories.add(command[2])
+            # A raw stream runs until the connection closes: no length, no chunking.
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/vnd.docker.raw-stream\r\n\r\n")
+            for stream, data in self.output.get(command[0], []):
+                writer.write(_frame(stream, data)[:5])
+                await writer.drain()
+                writer.write(_frame(stream, data)[5:])
+                await writer.drain()
+            return
+        if method == 'GET' and parts[0] == 'exec' and parts[2] == 'json':
+            command = self.execs[parts[1]]
+            return self._respond(writer, 200, {'Running': False, 'ExitCode': self.exit_codes.get(command[0], 0)})
+        if method == 'PUT' and parts[2:] == ['archive']:
+            if query['path'] not in self.directories:
+                return self._respond(writer, 404, {'message': f"Could not find the file {query['path']} in container web"})
+            with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+                for member in tar.getmembers():
+                    self.files[os.path.join(query['path'], member.name)] = tar.extractfile(member).read()
+            return self._respond(writer, 200)
+        if method == 'GET' and parts[2:] == ['archive']:
+            data = self.files[query['path']]
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w') as tar:
+                info = tarfile.TarInfo(os.path.basename(query['path']))
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            stat = base64.b64encode(json.dumps({'name': os.path.basename(query['path']), 'size': len(data)}).encode())
+            return self._respond(writer, 200, buffer.getvalue(), {'X-Docker-Container-Path-Stat': stat.decode()},
+                                 chunked=True)
+        self._respond(writer, 404, {'message': f"page not found: {method} {path}"})
+
+
+@pytest.fixture
+def daemon(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        fake = FakeDaemon(os.path.join(directory, 'docker.sock'))
+        fake.start()
+        monkeypatch.setattr(async_docker, '_client', AsyncDockerClient(socket_path=fake.socket_path))
+        yield fake
+
+
+def _tar(name, data):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_exec_demultiplexes_split_frames(daemon):
+    daemon.output['apt-get'] = [(1, b"Reading package lists...\nBuilding"), (2, b"W: no key\n"), (1, b" tree\n")]
+    daemon.exit_codes['apt-get'] = 100
+    result = run_sync(async_docker.get_async_client().exec('web', ['apt-get', 'update']), 5)
+    assert isinstance(result, ExecResult)
+    assert result.exit_code == 100
+    assert result.stdout == "Reading package lists...\nBuilding tree\n"
+    assert result.stderr == "W: no key\n"
+
+
+def test_exec_stream_sync_calls_back_in_calling_thread(daemon):
+    daemon.output['certbot'] = [(1, b"a"), (2, b"b"), (1, b"c")]
+    seen = []
+    exit_code = exec_stream_sync('web', ['certbot'], lambda stream, data: seen.append((stream, data, threading.get_ident())))
+    assert exit_code == 0
+    assert [(stream, data) for stream, data, _ in seen] == [(1, b"a"), (2, b"b"), (1, b"c")]
+    assert {thread for _, _, thread in seen} == {threading.get_ident()}
+
+
+def test_stream_in_container_reports_progress_and_tail(daemon):
+    daemon.output['apt-get'] = [(1, b"Get:1 http://deb\nGet:2 "), (1, b"http://deb\n"), (2, b"E: failed\n")]
+    daemon.exit_codes['apt-get'] = 1
+    lines = []
+    result = _stream_in_container('web', ['apt-get', 'install', '-y', 'nginx'], progress=lines.append)
+    assert result.exit_code == 1
+    assert lines == ["Get:1 http://deb", "Get:2 http://deb", "E: failed"]
+    assert result.stderr == "E: failed\n"
+    assert len(result.stdout) <= STREAM_TAIL_BYTES
+
+
+def test_stream_in_missing_container(daemon):
+    result = _stream_in_container('gone', ['true'])
+    assert result.exit_code == 126
+
+
+def test_put_and_get_archive_round_trip(daemon):
+    payload = os.urandom(5000)
+    docker_async = async_docker.get_async_client()
+    assert run_sync(docker_async.put_archive('web', '/srv', _tar('blob.bin', payload)), 5)
+    data, stat = run_sync(docker_async.get_archive('web', '/srv/blob.bin'), 5)
+    assert stat == {'name': 'blob.bin', 'size': len(payload)}
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.extractfile('blob.bin').read() == payload
+
+
+def test_put_archive_errors_carry_status(daemon):
+    with pytest.raises(DockerAPIError) as error:
+        run_sync(async_docker.get_async_client().put_archive('web', '/missing', _tar('a', b"")), 5)
+    assert error.value.status == 404
+    assert 'Could not find the file' in error.value.message
+
+
+def test_put_archive_creates_missing_parent_once(daemon):
+    _put_archive_creating_parent('web', '/srv/new/site', _tar('index.html', b"<h1>hi</h1>"))
+    assert daemon.files['/srv/new/site/index.html'] == b"<h1>hi</h1>"
+    assert list(daemon.execs.values()) == [['mkdir', '-p', '/srv/new/site']]
+
+
+def test_put_archive_into_missing_container_is_not_found(daemon):
+    from docker.errors import NotFound
+    with pytest.raises(NotFound):
+        _put_archive_creating_parent('gone', '/srv', _tar('a', b""))
+    assert daemon.execs == {}
@@ -0,0 +1,288 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import insert, event
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+# Entries waiting to be written, per process. When it is full the caller writes a batch
+# itself, so a slow database slows logging down rather than losing audit entries.
+QUEUE_SIZE = int(os.environ.get("SBPANEL_ACTIVITY_LOG_QUEUE_SIZE", "10000"))
+# A batch is written once it has this many entries or its oldest entry is this old.
+BATCH_SIZE = int(os.environ.get("SBPANEL_ACTIVITY_LOG_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.environ.get("SBPANEL_ACTIVITY_LOG_FLUSH_INTERVAL", "1"))
+# Rows per INSERT statement; keeps 5 columns per row under SQLite's 999 bound parameters.
+ROWS_PER_STATEMENT = 150
+WRITE_ATTEMPTS = 3
+# Allowance on top of FLUSH_INTERVAL for another worker's batch INSERT to commit.
+WRITE_ALLOWANCE = 0.5
+SHUTDOWN_TIMEOUT = 10
+
+# session.info key for entries logged in a transaction that hasn't committed yet.
+PENDING_KEY = '_activity_log_pending'
+
+_STOP = object()
+
+_app = None
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class ActivityLogWriter:
+    """
+    Writes queued activity log entries from a background thread, many rows per INSERT
+    and one transaction per batch, instead of a commit in every request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="sbpanel-activity-log", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def put(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            logger.warning("Activity log queue is full; writing a batch in the request.")
+            batch, flushes = self._drain([entry])
+            self.write(batch)
+            # The writer thread may still hold entries queued before these requests;
+            # hand them back so it is the one to answer them.
+            for request in flushes:
+                try:
+                    self.queue.put_nowait(request)
+                except queue.Full:
+                    request.done.set()
+
+    def _drain(self, batch, limit=BATCH_SIZE):
+        """
+        Returns:
+            tuple: (batch, flush requests taken off the queue)
+        """
+        flushes = []
+        while len(batch) < limit:
+            try:
+                entry = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self.queue.put_nowait(_STOP)
+                break
+            if isinstance(entry, _FlushRequest):
+                flushes.append(entry)
+                continue
+            batch.append(entry)
+        return batch, flushes
+
+    def _write_remaining(self):
+        batch, flushes = self._drain([], limit=QUEUE_SIZE)
+        self.write(batch)
+        for request in flushes:
+            request.done.set()
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is _STOP:
+                self._write_remaining()
+                return
+            if isinstance(entry, _FlushRequest):
+                entry.done.set()
+                continue
+            batch = [entry]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            stopping = False
+            flush = None
+            while len(batch) < BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                if isinstance(entry, _FlushRequest):
+                    flush = entry
+                    break
+                batch.append(entry)
+            self.write(batch)
+            if flush is not None:
+                flush.done.set()
+            if stopping:
+                self._write_remaining()
+                return
+
+    def flush(self):
+        """
+        Write everything queued so far, including the batch the writer thread is
+        collecting, and return once it is in the database.
+        """
+        if not self._thread.is_alive():
+            while True:
+                batch, _ = self._drain([])
+                if not batch:
+                    return
+                self.write(batch)
+        # Queued behind every entry put so far, so the writer reaches it only after
+        # they are all in a written batch.
+        request = _FlushRequest()
+        try:
+            self.queue.put(request, timeout=SHUTDOWN_TIMEOUT)
+        except queue.Full:
+            logger.warning("Activity log queue stayed full; flush gave up waiting.")
+            return
+        if not request.done.wait(SHUTDOWN_TIMEOUT):
+            logger.warning("Activity log writer didn't finish flushing in time.")
+
+    def stop(self):
+        """Write what is still queued before the process exits."""
+        if not self._thread.is_alive():
+            self.flush()
+            return
+        try:
+            self.queue.put(_STOP, timeout=SHUTDOWN_TIMEOUT)
+        except queue.Full:
+            pass
+        self._thread.join(SHUTDOWN_TIMEOUT)
+        self.flush()
+
+    def write(self, batch):
+        if not batch:
+            return
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                with self._write_lock, self.app.app_context():
+                    _insert(batch)
+                return
+            except IntegrityError:
+                # One bad row (say, for a user deleted since it was queued) fails the
+                # whole statement; write the rows one at a time so only it is lost.
+                with self._write_lock, self.app.app_context():
+                    _insert_each(batch)
+                return
+            except Exception as e:
+                if attempt == WRITE_ATTEMPTS:
+                    logger.error(f"Could not write {len(batch)} activity log entries: {e}")
+                    for entry in batch:
+                        logger.error(f"Unwritten activity log entry: {entry}")
+                    return
+                time.sleep(attempt)
+
+
+def _insert(batch):
+    from app import db
+    from models import ActivityLog
+    with db.engine.begin() as conn:
+        for start in range(0, len(batch), ROWS_PER_STATEMENT):
+            conn.execute(insert(ActivityLog).values(batch[start:start + ROWS_PER_STATEMENT]))
+
+
+def _insert_each(batch):
+    from app import db
+    from models import ActivityLog
+    for entry in batch:
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(ActivityLog).values(entry))
+        except Exception as e:
+            logger.error(f"Could not write activity log entry {entry}: {e}")
+
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                from flask import current_app
+                _writer = ActivityLogWriter(_app or current_app._get_current_object())
+                _writer.start()
+    return _writer
+
+
+def _after_fork():
+    # The writer thread doesn't survive a fork; a child starts its own on first use.
+    global _writer, _writer_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def log_activity(user_id, action, details=None, ip_address=None):
+    """
+    Record a user action in the activity log.
+
+    The entry is held in the current session until it commits, then queued and
+    written with others shortly after; if the session rolls back instead, the
+    entry is dropped with the change it describes.
+    """
+    from app import db
+    entry = {
+        'user_id': user_id,
+        'action': action,
+        'details': details,
+        'ip_address': ip_address,
+        'created_at': datetime.utcnow(),
+    }
+    db.session.info.setdefault(PENDING_KEY, []).append(entry)
+
+
+def _after_commit(session):
+    entries = session.info.pop(PENDING_KEY, None)
+    if entries:
+        writer = _get_writer()
+        for entry in entries:
+            writer.put(entry)
+
+
+def _after_rollback(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+def flush_activity_log(all_workers=False):
+    """
+    Write every entry this process has queued, e.g. before reading or clearing the log.
+
+    Other workers' queues can't be flushed from here. Each of them writes an entry at
+    most FLUSH_INTERVAL after it is queued, so with all_workers the call also waits
+    that long (plus WRITE_ALLOWANCE): entries committed in any worker on this host
+    before the call are then in the table, unless a writer is retrying a failing
+    database. Without it, up to FLUSH_INTERVAL of other workers' entries may be missing.
+    """
+    started = time.monotonic()
+    writer = _writer
+    if writer is not None:
+        writer.flush()
+    if all_workers:
+        remaining = FLUSH_INTERVAL + WRITE_ALLOWANCE - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+def init_activity_log(app):
+    """Have log_activity queue entries for this app's background writer as their sessions commit."""
+    global _app
+    from app import db
+    _app = app
+    if not event.contains(db.session, 'after_commit', _after_commit):
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
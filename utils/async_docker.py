@@ -0,0 +1,357 @@
+import os
+import json
+import base64
+import queue
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode, quote
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = os.environ.get("SBPANEL_DOCKER_API_VERSION", "v1.41")
+# Upper bound on Docker operations one worker keeps in flight through the async client.
+MAX_IN_FLIGHT = int(os.environ.get("SBPANEL_DOCKER_ASYNC_CONCURRENCY", "256"))
+
+
+def _default_socket_path():
+    docker_host = os.environ.get("DOCKER_HOST", "")
+    if docker_host.startswith("unix://"):
+        return docker_host[len("unix://"):]
+    return "/var/run/docker.sock"
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class _Response:
+    """An HTTP response whose body is read from the socket on demand."""
+
+    def __init__(self, status, headers, reader, writer):
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+
+    async def iter_chunks(self):
+        reader = self._reader
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size_line = await reader.readline()
+                if not size_line:
+                    return
+                size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    await reader.readline()
+                    return
+                data = await reader.readexactly(size)
+                await reader.readexactly(2)  # trailing CRLF
+                yield data
+        elif 'content-length' in self.headers:
+            remaining = int(self.headers['content-length'])
+            while remaining > 0:
+                data = await reader.read(min(remaining, 65536))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+        else:
+            # Hijacked exec streams and close-delimited bodies run until EOF.
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                yield data
+
+    async def read(self):
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    async def iter_json_lines(self):
+        buffer = b""
+        async for chunk in self.iter_chunks():
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if line.strip():
+                    yield json.loads(line)
+        if buffer.strip():
+            yield json.loads(buffer)
+
+    def close(self):
+        self._writer.close()
+
+
+class AsyncDockerClient:
+    """
+    asyncio-native client for the Docker Engine API over the local unix socket.
+
+    Every request opens its own connection, so any number of operations can be
+    in flight at once; MAX_IN_FLIGHT bounds them so a burst can't exhaust file
+    descriptors or swamp the daemon.
+    """
+
+    def __init__(self, socket_path=None, max_in_flight=MAX_IN_FLIGHT):
+        self.socket_path = socket_path or _default_socket_path()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    @asynccontextmanager
+    async def _slot(self):
+        async with self._semaphore:
+            yield
+
+    async def _request(self, method, path, params=None, body=None, content_type='application/json'):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=2 ** 20)
+        if body is not None and not isinstance(body, (bytes, bytearray)):
+            body = json.dumps(body).encode()
+        query = f"?{urlencode(params, doseq=True)}" if params else ""
+        head = [f"{method} /{API_VERSION}{path}{query} HTTP/1.1", "Host: docker", "Connection: close"]
+        if body is not None:
+            head.append(f"Content-Type: {content_type}")
+            head.append(f"Content-Length: {len(body)}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + (bytes(body) if body is not None else b""))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            writer.close()
+            raise DockerAPIError(0, "Connection closed by Docker daemon")
+        status = int(status_line.split(b" ", 2)[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        response = _Response(status, headers, reader, writer)
+        if status >= 400:
+            raw = await response.read()
+            response.close()
+            try:
+                message = json.loads(raw).get('message', raw.decode('utf-8', errors='replace'))
+            except ValueError:
+                message = raw.decode('utf-8', errors='replace')
+            raise DockerAPIError(status, message)
+        return response
+
+    async def _json(self, method, path, params=None, body=None):
+        response = await self._request(method, path, params=params, body=body)
+        try:
+            raw = await response.read()
+        finally:
+            response.close()
+        return json.loads(raw) if raw.strip() else None
+
+    async def ping(self):
+        async with self._slot():
+            response = await self._request('GET', '/_ping')
+            try:
+                return (await response.read()) == b"OK"
+            finally:
+                response.close()
+
+    async def list_containers(self, all=False, filters=None):
+        params = {'all': 'true' if all else 'false'}
+        if filters:
+            params['filters'] = json.dumps(filters)
+        async with self._slot():
+            return await self._json('GET', '/containers/json', params=params)
+
+    async def exec(self, container, command_list, tty=False):
+        """
+        Run a command in a container and collect its output.
+
+        Returns:
+            ExecResult: Exit code plus decoded stdout/stderr, as from _execute_in_container
+        """
+        from .container import ExecResult  # utils.container routes its exec and archive calls through here
+        stdout, stderr = bytearray(), bytearray()
+        async with self._slot():
+            exit_code = await self._exec(container, command_list, tty,
+                                         lambda stream, data: (stdout if stream != 2 else stderr).extend(data))
+        return ExecResult(exit_code, bytes(stdout), bytes(stderr))
+
+    async def exec_stream(self, container, command_list, on_output, tty=False):
+        """
+        Run a command in a container, passing output to on_output(stream, data) as it
+        arrives; stream is 1 for stdout and 2 for stderr.
+
+        Returns:
+            int: The command's exit code
+        """
+        async with self._slot():
+            return await self._exec(container, command_list, tty, on_output)
+
+    async def _exec(self, container, command_list, tty, on_output):
+        created = await self._json('POST', f'/containers/{quote(container, safe="")}/exec', body={
+            'AttachStdout': True, 'AttachStderr': True, 'Tty': tty, 'Cmd': command_list,
+        })
+        exec_id = created['Id']
+        response = await self._request('POST', f'/exec/{exec_id}/start', body={'Detach': False, 'Tty': tty})
+        try:
+            if tty:
+                async for data in response.iter_chunks():
+                    on_output(1, data)
+            else:
+                await self._demux(response, on_output)
+        finally:
+            response.close()
+        info = await self._json('GET', f'/exec/{exec_id}/json')
+        # The stream can close a moment before the daemon records the exit code.
+        for _ in range(50):
+            if not info.get('Running'):
+                break
+            await asyncio.sleep(0.02)
+            info = await self._json('GET', f'/exec/{exec_id}/json')
+        return info.get('ExitCode')
+
+    async def _demux(self, response, on_output):
+        # Multiplexed stream: 8-byte header (stream type, 3 pad bytes, big-endian size) then payload.
+        buffer = bytearray()
+        async for chunk in response.iter_chunks():
+            buffer.extend(chunk)
+            while len(buffer) >= 8:
+                size = int.from_bytes(buffer[4:8], 'big')
+                if len(buffer) < 8 + size:
+                    break
+                on_output(buffer[0], bytes(buffer[8:8 + size]))
+                del buffer[:8 + size]
+
+    async def put_archive(self, container, path, data):
+        async with self._slot():
+            response = await self._request('PUT', f'/containers/{quote(container, safe="")}/archive',
+                                           params={'path': path}, body=data, content_type='application/x-tar')
+            try:
+                await response.read()
+            finally:
+                response.close()
+        return True
+
+    async def get_archive(self, container, path):
+        """
+        Returns:
+            tuple: (tar bytes, stat dict) like docker-py's Container.get_archive
+        """
+        async with self._slot():
+            response = await self._request('GET', f'/containers/{quote(container, safe="")}/archive', params={'path': path})
+            try:
+                data = await response.read()
+            finally:
+                response.close()
+        stat_header = response.headers.get('x-docker-container-path-stat')
+        stat = json.loads(base64.b64decode(stat_header)) if stat_header else {}
+        return data, stat
+
+    # stats() and events() are long-lived subscriptions, so they don't take an in-flight slot.
+
+    async def stats(self, container, stream=True):
+        """Yield stats samples for a container; one sample when stream=False."""
+        params = {'stream': 'true' if stream else 'false'}
+        response = await self._request('GET', f'/containers/{quote(container, safe="")}/stats', params=params)
+        try:
+            async for sample in response.iter_json_lines():
+                yield sample
+        finally:
+            response.close()
+
+    async def events(self, filters=None, since=None):
+        """Yield decoded events from the daemon's event stream until it closes."""
+        params = {}
+        if filters:
+            params['filters'] = json.dumps(filters)
+        if since is not None:
+            params['since'] = str(since)
+        response = await self._request('GET', '/events', params=params)
+        try:
+            async for event in response.iter_json_lines():
+                yield event
+        finally:
+            response.close()
+
+
+class _AsyncBridge:
+    """Runs one event loop in a daemon thread so synchronous Flask code can drive coroutines."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="sbpanel-docker-async", daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the bridge loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop())
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the bridge loop and block the calling thread for its result."""
+        return self.submit(coro).result(timeout)
+
+
+_bridge = _AsyncBridge()
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_async_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AsyncDockerClient()
+        return _client
+
+
+def submit(coro):
+    return _bridge.submit(coro)
+
+
+def run_sync(coro, timeout=None):
+    return _bridge.run(coro, timeout)
+
+
+def gather_sync(coros, timeout=None):
+    """
+    Run many coroutines concurrently on the bridge loop and wait for all of them.
+
+    Returns:
+        list: Results in input order; failed operations are returned as their exception
+    """
+    async def _gather():
+        return await asyncio.gather(*coros, return_exceptions=True)
+    return run_sync(_gather(), timeout)
+
+
+def exec_stream_sync(container, command_list, on_output):
+    """
+    Run exec_stream on the bridge loop while the calling thread consumes the output.
+
+    on_output(stream, data) is called in the calling thread, not on the loop, so it
+    can use the caller's app context and block without holding up other operations.
+
+    Returns:
+        int: The command's exit code
+
+    Raises:
+        DockerAPIError: If the daemon refuses the exec
+    """
+    chunks = queue.Queue()
+    future = submit(get_async_client().exec_stream(container, command_list,
+                                                   lambda stream, data: chunks.put((stream, data))))
+    future.add_done_callback(lambda _: chunks.put(None))
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return future.result()
+        on_output(*chunk)
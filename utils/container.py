@@ -4,25 +4,21 @@ import tempfile
 import subprocess
 import urllib.request
 import uuid
+import shlex
+import base64
 from urllib.parse import urlparse
-import docker
 from docker.types import Mount 
-from docker.errors import NotFound, APIError, ImageNotFound
+from docker.errors import NotFound, APIError
 from datetime import datetime
 import io
 import tarfile
 import time # For potential sleep/retries
 
-logger = logging.getLogger(__name__)
+from .docker_client import client, invalidate_container, call_with_container, docker_call, ensure_image, DOCKER_TIMEOUT
+from .async_docker import DockerAPIError, get_async_client, run_sync, exec_stream_sync
+from .openmetrics import docker_exec_duration, docker_exec_failures
 
-try:
-    client = docker.from_env()
-    client.ping()
-    logger.info("Successfully connected to Docker daemon.")
-except docker.errors.DockerException as e:
-    logger.error(f"Could not connect to Docker daemon: {e}. SBPanel requires Docker to be running and accessible.")
-    logger.warning("Proceeding without a live Docker client. Container operations will likely fail.")
-    client = None
+logger = logging.getLogger(__name__)
 
 class ExecResult:
     def __init__(self, exit_code, stdout, stderr):
@@ -30,13 +26,37 @@ class ExecResult:
         self.stdout = stdout.decode('utf-8', errors='replace') if stdout else ""
         self.stderr = stderr.decode('utf-8', errors='replace') if stderr else ""
 
-def _execute_in_container(container_id_or_name, command_list, ignore_failure=False, tty_for_exec=False):
+def _exec_metric_name(command_list, metric_name=None):
+    if metric_name:
+        return metric_name
+    return os.path.basename(str(command_list[0])) if command_list else 'unknown'
+
+def _record_exec(metric_name, started, result):
+    docker_exec_duration.observe(time.perf_counter() - started, command=metric_name)
+    if result.exit_code != 0:
+        docker_exec_failures.inc(command=metric_name)
+    return result
+
+def _execute_in_container(container_id_or_name, command_list, ignore_failure=False, tty_for_exec=False, metric_name=None):
+    """
+    Run a command in a container and return its ExecResult.
+
+    Latency and failures are recorded per `metric_name` (default: the program name), so
+    pass one when the command is a shell wrapper around something more telling.
+    """
+    started = time.perf_counter()
+    return _record_exec(_exec_metric_name(command_list, metric_name), started,
+                        _run_exec(container_id_or_name, command_list, ignore_failure, tty_for_exec))
+
+def _run_exec(container_id_or_name, command_list, ignore_failure, tty_for_exec):
     if client is None:
         logger.error("Docker client not initialized. Cannot execute command.")
         return ExecResult(127, b"", b"Docker client not initialized")
     try:
-        container_obj = client.containers.get(container_id_or_name)
-        exec_output = container_obj.exec_run(command_list, tty=tty_for_exec, demux=not tty_for_exec)
+        exec_output = call_with_container(
+            container_id_or_name, 'exec_run',
+            lambda container_obj: container_obj.exec_run(command_list, tty=tty_for_exec, demux=not tty_for_exec)
+        )
         
         exit_code = exec_output.exit_code
         
@@ -67,11 +87,151 @@ def _execute_in_container(container_id_or_name, command_list, ignore_failure=Fal
         raw_output_str = str(exec_output[1]) if isinstance(exec_output, tuple) and len(exec_output) > 1 else str(e)
         return ExecResult(raw_exit_code, b"", raw_output_str.encode())
 
+# How much trailing stdout/stderr a streamed exec keeps for error reporting.
+STREAM_TAIL_BYTES = 64 * 1024
+# A "line" longer than this is forwarded to the progress sink in pieces.
+STREAM_MAX_LINE_BYTES = 4096
+
+class _StreamTail:
+    """Keeps the last `limit` bytes written to it and splits complete lines out for a progress sink."""
+    def __init__(self, limit, on_line=None):
+        self.limit = limit
+        self.on_line = on_line
+        self.buffer = bytearray()
+        self.partial_line = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) > self.limit * 2: # Trim in batches so appends stay amortised O(1)
+            del self.buffer[:-self.limit]
+        if self.on_line is None:
+            return
+        self.partial_line.extend(data)
+        while True:
+            newline_at = self.partial_line.find(b"\n")
+            if newline_at == -1:
+                if len(self.partial_line) > STREAM_MAX_LINE_BYTES:
+                    self._emit(self.partial_line[:STREAM_MAX_LINE_BYTES])
+                    del self.partial_line[:STREAM_MAX_LINE_BYTES]
+                    continue
+                break
+            self._emit(self.partial_line[:newline_at])
+            del self.partial_line[:newline_at + 1]
+
+    def flush(self):
+        if self.on_line is not None and self.partial_line:
+            self._emit(self.partial_line)
+            self.partial_line.clear()
+
+    def tail(self):
+        return bytes(self.buffer[-self.limit:])
+
+    def _emit(self, raw_line):
+        line = raw_line.decode('utf-8', errors='replace').rstrip('\r')
+        if line.strip():
+            try:
+                self.on_line(line)
+            except Exception as e: # A broken sink must not abort the command
+                logger.warning(f"Progress sink raised: {e}")
+                self.on_line = None
+
+def _stream_in_container(container_id_or_name, command_list, progress=None, ignore_failure=False, tail_bytes=STREAM_TAIL_BYTES,
+                         metric_name=None):
+    """
+    Run a long command, consuming its output as it arrives instead of buffering it.
+
+    Only the last `tail_bytes` of stdout and stderr are kept (for error reporting in
+    the returned ExecResult). Complete output lines are passed to `progress(line)` as
+    they are produced, if a progress sink is given.
+    """
+    started = time.perf_counter()
+    return _record_exec(_exec_metric_name(command_list, metric_name), started,
+                        _run_stream(container_id_or_name, command_list, progress, ignore_failure, tail_bytes))
+
+def _run_stream(container_id_or_name, command_list, progress, ignore_failure, tail_bytes):
+    # On the async client: the calling thread only consumes output, so a worker's
+    # long apt-get and certbot runs share one event loop instead of a socket each.
+    stdout_tail = _StreamTail(tail_bytes, progress)
+    stderr_tail = _StreamTail(tail_bytes, progress)
+    try:
+        with docker_call('exec_stream'):
+            exit_code = exec_stream_sync(container_id_or_name, command_list,
+                                         lambda stream, data: (stderr_tail if stream == 2 else stdout_tail).write(data))
+        stdout_tail.flush()
+        stderr_tail.flush()
+        result = ExecResult(exit_code, stdout_tail.tail(), stderr_tail.tail())
+
+        if not ignore_failure and result.exit_code != 0:
+            log_msg = f"Command '{' '.join(command_list)}' in {container_id_or_name} failed with exit code {result.exit_code}"
+            if result.stderr: log_msg += f": STDERR (tail): {result.stderr}"
+            logger.error(log_msg)
+        return result
+    except DockerAPIError as e:
+        if e.status == 404:
+            logger.error(f"Container {container_id_or_name} not found for command execution.")
+            return ExecResult(126, b"", f"Container {container_id_or_name} not found".encode())
+        logger.error(f"Docker API error executing command in {container_id_or_name}: {e}")
+        return ExecResult(125, b"", str(e).encode())
+    except OSError as e:
+        logger.error(f"Could not reach the Docker daemon to execute a command in {container_id_or_name}: {e}")
+        return ExecResult(127, b"", str(e).encode())
+
+def _execute_batch_in_container(container_id_or_name, steps, stop_on_failure=True, log_failures=True):
+    """
+    Run an ordered list of commands in a single exec session.
+
+    Each step is either a command list or a (command_list, ignore_failure) tuple. With
+    stop_on_failure, the first failing step that is not ignore_failure ends the batch.
+    Pass log_failures=False when a failing step is an expected probe result.
+
+    Returns:
+        list: One ExecResult per step that ran, in order
+    """
+    steps = [step if isinstance(step, tuple) else (step, False) for step in steps]
+    marker = uuid.uuid4().hex
+    # Each step's output goes to temp files and is reported as one framed line:
+    # "<marker> <index> <exit code> <base64 stdout> <base64 stderr>"
+    # Only the last STREAM_TAIL_BYTES of each are sent back, so apt-sized output stays bounded.
+    script = ['d=$(mktemp -d) || exit 125', 'trap \'rm -rf "$d"\' EXIT']
+    for index, (command_list, step_ignore_failure) in enumerate(steps):
+        script.append(f'{shlex.join(command_list)} </dev/null >"$d/out" 2>"$d/err"; rc=$?')
+        script.append(f'printf \'%s %s %s %s %s\\n\' {marker} {index} "$rc" "$(tail -c {STREAM_TAIL_BYTES} "$d/out" | base64 -w0)" "$(tail -c {STREAM_TAIL_BYTES} "$d/err" | base64 -w0)"')
+        if stop_on_failure and not step_ignore_failure:
+            script.append('[ "$rc" -eq 0 ] || exit 0')
+
+    batch_result = _execute_in_container(container_id_or_name, ['sh', '-c', '\n'.join(script)], ignore_failure=True,
+                                         metric_name='batch')
+
+    results = []
+    for line in batch_result.stdout.splitlines():
+        parts = line.split(' ')
+        if len(parts) != 5 or parts[0] != marker:
+            continue
+        results.append(ExecResult(int(parts[2]), base64.b64decode(parts[3]), base64.b64decode(parts[4])))
+    if not results:
+        # The session itself failed (container missing, no shell, ...); report it as the first step.
+        logger.error(f"Batch exec in {container_id_or_name} failed before running any step (code {batch_result.exit_code}): {batch_result.stderr}")
+        return [batch_result]
+
+    for (command_list, step_ignore_failure), result in zip(steps, results):
+        if log_failures and result.exit_code != 0 and not step_ignore_failure:
+            log_msg = f"Command '{' '.join(command_list)}' in {container_id_or_name} failed with exit code {result.exit_code}"
+            if result.stderr: log_msg += f": STDERR: {result.stderr}"
+            logger.error(log_msg)
+    return results
+
+def _service_command(service_name, action):
+    """Command list that runs `service <name> <action>`, falling back to systemctl."""
+    name = shlex.quote(service_name)
+    return ['sh', '-c', f'service {name} {action} || systemctl {action} {name}']
+
 def get_container_ip(container_name):
     if client is None: return None
     try:
-        container_obj = client.containers.get(container_name)
-        container_obj.reload() # Refresh container attributes
+        def _reload(c):
+            c.reload() # Refresh container attributes
+            return c
+        container_obj = call_with_container(container_name, 'containers.reload', _reload)
         # This gets complex with multiple networks. Assuming default bridge.
         if container_obj.attrs['NetworkSettings']['Networks']:
             # Get the first network's IP address
@@ -82,29 +242,29 @@ def get_container_ip(container_name):
     return None
 
 
-def create_base_docker_container(container_name_docker, image_name, cpu, memory, disk):
-    """Creates and starts the Docker container structure without software provisioning."""
+def create_base_docker_container(container_name_docker, image_name, cpu, memory, disk, labels=None):
+    """
+    Creates and starts the Docker container structure without software provisioning.
+
+    cpu=None leaves the CPU unlimited, so a limit can be applied later with
+    update_container_limits (Docker can't switch a container from NanoCpus to a CFS quota).
+    """
     if client is None:
         raise Exception("Docker client not initialized. Cannot create container.")
 
     try:
-        client.containers.get(container_name_docker)
+        with docker_call('containers.get'):
+            client.containers.get(container_name_docker)
         raise Exception(f"Docker container {container_name_docker} already exists.")
     except NotFound:
         pass 
 
     try:
-        logger.info(f"Checking for Docker image: {image_name}")
-        client.images.get(image_name) 
-        logger.info(f"Image {image_name} found locally.")
-    except ImageNotFound:
-        logger.info(f"Image {image_name} not found locally. Pulling from Docker Hub...")
-        try:
-            client.images.pull(image_name) 
-            logger.info(f"Successfully pulled image {image_name}.")
-        except APIError as e:
-            logger.error(f"Failed to pull image {image_name}: {e}")
-            raise Exception(f"Failed to pull Docker image {image_name}: {e}")
+        # Concurrent creations from a missing image share one pull
+        ensure_image(image_name)
+    except APIError as e:
+        logger.error(f"Failed to pull image {image_name}: {e}")
+        raise Exception(f"Failed to pull Docker image {image_name}: {e}")
 
     docker_config = {
         'name': container_name_docker,
@@ -113,14 +273,19 @@ def create_base_docker_container(container_name_docker, image_name, cpu, memory,
         'tty': True, 
         'stdin_open': True, 
         'mem_limit': f"{memory}m", 
-        'nano_cpus': int(cpu * 1e9), 
     }
+    if cpu is not None:
+        docker_config['nano_cpus'] = int(cpu * 1e9)
+    if labels:
+        docker_config['labels'] = labels
     
     logger.warning(f"Disk limit of {disk}MB for container {container_name_docker} is advisory and not strictly enforced by Docker in this setup.")
 
     try:
-        container_obj = client.containers.create(**docker_config)
-        container_obj.start()
+        with docker_call('containers.create'):
+            container_obj = client.containers.create(**docker_config)
+        with docker_call('containers.start'):
+            container_obj.start()
         logger.info(f"Base Docker container {container_name_docker} created and started from image {image_name}.")
         return container_name_docker # Return the actual Docker container name/ID
     except APIError as e:
@@ -128,79 +293,128 @@ def create_base_docker_container(container_name_docker, image_name, cpu, memory,
         raise Exception(f"Failed to create base Docker container: {e}")
 
 
-def provision_container_software(container_name_docker, template):
-    """Installs software in an existing, running container based on template."""
-    logger.info(f"Starting software provisioning for {container_name_docker} with template {template}.")
-    
-    # Initial apt update
-    update_result = _execute_in_container(container_name_docker, ['apt-get', 'update', '-y'], tty_for_exec=False)
-    if update_result.exit_code != 0:
-        logger.error(f"apt-get update failed in {container_name_docker}: {update_result.stderr}")
-        raise Exception(f"Provisioning failed: apt-get update error in {container_name_docker}")
+def update_container_limits(container_id, cpu, memory):
+    """Apply CPU and memory limits to a running container without restarting it."""
+    if client is None: raise Exception("Docker client not initialized")
+    cpu_period = 100000
+    try:
+        call_with_container(container_id, 'containers.update', lambda container: container.update(
+            cpu_period=cpu_period,
+            cpu_quota=int(cpu * cpu_period),
+            mem_limit=f"{memory}m",
+            memswap_limit=f"{memory * 2}m", # Same swap allowance Docker gives a new container with mem_limit
+        ))
+        logger.info(f"Container {container_id} limits updated: {cpu} CPU, {memory}MB memory.")
+    except NotFound:
+        raise Exception(f"Container {container_id} not found.")
+    except APIError as e:
+        raise Exception(f"Failed to update limits for container {container_id}: {e}")
 
-    base_packages = ['curl', 'wget', 'cron', 'procps', 'net-tools'] # net-tools for ifconfig if needed for IP
-    
-    if template == 'nginx':
-        # Determine PHP version for nginx template, default or make it a param
-        php_version_nginx = "7.4" # Example, should ideally come from template config
-        template_packages = [
+def rename_container(container_id, new_name):
+    if client is None: raise Exception("Docker client not initialized")
+    try:
+        call_with_container(container_id, 'containers.rename', lambda container: container.rename(new_name))
+        invalidate_container(container_id)
+        logger.info(f"Container {container_id} renamed to {new_name}.")
+    except NotFound:
+        raise Exception(f"Container {container_id} not found.")
+    except APIError as e:
+        raise Exception(f"Failed to rename container {container_id} to {new_name}: {e}")
+
+
+BASE_IMAGE = "ubuntu:20.04"
+BASE_PACKAGES = ['curl', 'wget', 'cron', 'procps', 'net-tools'] # net-tools for ifconfig if needed for IP
+# Determine PHP version per template, default or make it a param
+TEMPLATE_PHP_VERSION = "7.4" # Example, should ideally come from template config
+
+# Software per container template. utils.images bakes these into prebuilt images, and
+# provision_container_software installs them into plain BASE_IMAGE containers.
+# For PHP-FPM, the service name includes the version.
+TEMPLATES = {
+    'nginx': {
+        'packages': [
             'nginx', 
-            f'php{php_version_nginx}-fpm', 
-            f'php{php_version_nginx}-mysql', # Common PHP extensions
-            f'php{php_version_nginx}-curl',
-            f'php{php_version_nginx}-gd',
-            f'php{php_version_nginx}-mbstring',
-            f'php{php_version_nginx}-xml',
+            f'php{TEMPLATE_PHP_VERSION}-fpm', 
+            f'php{TEMPLATE_PHP_VERSION}-mysql', # Common PHP extensions
+            f'php{TEMPLATE_PHP_VERSION}-curl',
+            f'php{TEMPLATE_PHP_VERSION}-gd',
+            f'php{TEMPLATE_PHP_VERSION}-mbstring',
+            f'php{TEMPLATE_PHP_VERSION}-xml',
             'mysql-client'
-        ]
-    elif template == 'apache':
-        php_version_apache = "7.4" # Example
-        template_packages = [
+        ],
+        'services': ['nginx', f'php{TEMPLATE_PHP_VERSION}-fpm'],
+    },
+    'apache': {
+        'packages': [
             'apache2', 
-            f'libapache2-mod-php{php_version_apache}', 
-            f'php{php_version_apache}-mysql',
+            f'libapache2-mod-php{TEMPLATE_PHP_VERSION}', 
+            f'php{TEMPLATE_PHP_VERSION}-mysql',
             'mysql-client'
-        ]
-    elif template == 'mixed': # Example for a mixed template
-        php_version_mixed = "7.4"
-        template_packages = [
+        ],
+        'services': ['apache2'],
+    },
+    'mixed': { # Example for a mixed template
+        'packages': [
             'nginx',
-            f'php{php_version_mixed}-fpm',
-            f'php{php_version_mixed}-mysql',
+            f'php{TEMPLATE_PHP_VERSION}-fpm',
+            f'php{TEMPLATE_PHP_VERSION}-mysql',
             'mariadb-server', # Example: MariaDB in mixed
             'redis-server',   # Example: Redis in mixed
             'mysql-client'
-        ]
-    else:
-        template_packages = []
+        ],
+        'services': ['nginx', f'php{TEMPLATE_PHP_VERSION}-fpm', 'mariadb', 'redis-server'], # or 'mysql' if mysql-server was installed
+    },
+}
+
+def get_template_packages(template):
+    """Template-specific apt packages (without BASE_PACKAGES); empty for unknown templates."""
+    return list(TEMPLATES.get(template, {}).get('packages', []))
+
+def get_template_services(template):
+    return list(TEMPLATES.get(template, {}).get('services', [])) + ['cron']
+
+def provision_container_software(container_name_docker, template, progress=None, prebuilt=False):
+    """
+    Installs software in an existing, running container based on template.
+
+    apt output is streamed rather than buffered; pass `progress` (a callable taking one
+    line of output) to receive it live. With prebuilt=True the container was created from
+    the template's image (see utils.images), so only the services need starting.
+    """
+    logger.info(f"Starting software provisioning for {container_name_docker} with template {template} (prebuilt={prebuilt}).")
+    
+    if not prebuilt:
+        install_template_packages(container_name_docker, template, progress)
+    start_template_services(container_name_docker, template)
+
+def start_template_services(container_name_docker, template):
+    _execute_batch_in_container(
+        container_name_docker,
+        [_service_command(service_name, 'start') for service_name in get_template_services(template)],
+        stop_on_failure=False
+    )
+    logger.info(f"Essential services started for {container_name_docker}.")
+
+def install_template_packages(container_name_docker, template, progress=None):
+    # Initial apt update
+    update_result = _stream_in_container(container_name_docker, ['apt-get', 'update', '-y'], progress=progress)
+    if update_result.exit_code != 0:
+        logger.error(f"apt-get update failed in {container_name_docker}: {update_result.stderr}")
+        raise Exception(f"Provisioning failed: apt-get update error in {container_name_docker}")
+
+    if template not in TEMPLATES:
         logger.warning(f"Unknown template '{template}' for software provisioning in {container_name_docker}. Only base packages will be installed.")
 
-    all_packages_to_install = base_packages + template_packages
+    all_packages_to_install = BASE_PACKAGES + get_template_packages(template)
     if all_packages_to_install:
         cmd = ['apt-get', 'install', '-y'] + all_packages_to_install
-        install_result = _execute_in_container(container_name_docker, cmd, tty_for_exec=False)
+        install_result = _stream_in_container(container_name_docker, cmd, progress=progress)
         if install_result.exit_code != 0:
             logger.error(f"apt-get install failed for packages {' '.join(all_packages_to_install)} in {container_name_docker}: {install_result.stderr} {install_result.stdout}")
             raise Exception(f"Provisioning failed: apt-get install error in {container_name_docker}")
     
     logger.info(f"Core software provisioning completed for {container_name_docker}.")
 
-    # Start essential services
-    # For PHP-FPM, the service name includes the version.
-    if template == 'nginx':
-        start_service(container_name_docker, "nginx")
-        if php_version_nginx: start_service(container_name_docker, f"php{php_version_nginx}-fpm")
-    elif template == 'apache':
-        start_service(container_name_docker, "apache2")
-    elif template == 'mixed':
-        start_service(container_name_docker, "nginx")
-        if php_version_mixed: start_service(container_name_docker, f"php{php_version_mixed}-fpm")
-        start_service(container_name_docker, "mariadb") # or 'mysql' if mysql-server was installed
-        start_service(container_name_docker, "redis-server")
-
-    start_service(container_name_docker, "cron")
-    logger.info(f"Essential services started for {container_name_docker}.")
-
 
 # ... (rest of the functions: start_container, stop_container, etc. remain largely the same)
 # Ensure they use container_id (which is container_name_docker) correctly.
@@ -208,8 +422,7 @@ def provision_container_software(container_name_docker, template):
 def start_container(container_id): # container_id is Docker name/ID
     if client is None: raise Exception("Docker client not initialized")
     try:
-        container = client.containers.get(container_id)
-        container.start()
+        call_with_container(container_id, 'containers.start', lambda container: container.start())
         logger.info(f"Container {container_id} started.")
     except NotFound:
         raise Exception(f"Container {container_id} not found.")
@@ -219,8 +432,7 @@ def start_container(container_id): # container_id is Docker name/ID
 def stop_container(container_id):
     if client is None: raise Exception("Docker client not initialized")
     try:
-        container = client.containers.get(container_id)
-        container.stop()
+        call_with_container(container_id, 'containers.stop', lambda container: container.stop())
         logger.info(f"Container {container_id} stopped.")
     except NotFound:
         raise Exception(f"Container {container_id} not found.")
@@ -230,8 +442,7 @@ def stop_container(container_id):
 def restart_container(container_id):
     if client is None: raise Exception("Docker client not initialized")
     try:
-        container = client.containers.get(container_id)
-        container.restart()
+        call_with_container(container_id, 'containers.restart', lambda container: container.restart())
         logger.info(f"Container {container_id} restarted.")
     except NotFound:
         raise Exception(f"Container {container_id} not found.")
@@ -241,42 +452,37 @@ def restart_container(container_id):
 def delete_container(container_id):
     if client is None: raise Exception("Docker client not initialized")
     try:
-        container = client.containers.get(container_id)
-        container.remove(force=True) 
+        call_with_container(container_id, 'containers.remove', lambda container: container.remove(force=True))
+        invalidate_container(container_id)
         logger.info(f"Container {container_id} deleted.")
     except NotFound:
+        invalidate_container(container_id)
         logger.info(f"Container {container_id} not found, presumed deleted.")
     except APIError as e:
         raise Exception(f"Failed to delete container {container_id}: {e}")
 
 def start_service(container_id, service_name):
     logger.info(f"Attempting to start service {service_name} in container {container_id}")
-    result_service = _execute_in_container(container_id, ['service', service_name, 'start'], ignore_failure=True)
-    if result_service.exit_code != 0:
-        logger.warning(f"'service {service_name} start' failed (code {result_service.exit_code}): {result_service.stderr}. Trying systemctl.")
-        result_systemctl = _execute_in_container(container_id, ['systemctl', 'start', service_name], ignore_failure=True)
-        if result_systemctl.exit_code != 0:
-             logger.error(f"Both service and systemctl start {service_name} failed in {container_id}. systemctl_err: {result_systemctl.stderr}")
+    result = _execute_in_container(container_id, _service_command(service_name, 'start'), ignore_failure=True,
+                                   metric_name='service start')
+    if result.exit_code != 0:
+        logger.error(f"Both service and systemctl start {service_name} failed in {container_id} (code {result.exit_code}): {result.stderr}")
 
 
 def stop_service(container_id, service_name):
     logger.info(f"Attempting to stop service {service_name} in container {container_id}")
-    result_service = _execute_in_container(container_id, ['service', service_name, 'stop'], ignore_failure=True)
-    if result_service.exit_code != 0:
-        logger.warning(f"'service {service_name} stop' failed (code {result_service.exit_code}): {result_service.stderr}. Trying systemctl.")
-        result_systemctl = _execute_in_container(container_id, ['systemctl', 'stop', service_name], ignore_failure=True)
-        if result_systemctl.exit_code != 0:
-             logger.error(f"Both service and systemctl stop {service_name} failed in {container_id}. systemctl_err: {result_systemctl.stderr}")
+    result = _execute_in_container(container_id, _service_command(service_name, 'stop'), ignore_failure=True,
+                                   metric_name='service stop')
+    if result.exit_code != 0:
+        logger.error(f"Both service and systemctl stop {service_name} failed in {container_id} (code {result.exit_code}): {result.stderr}")
 
 
 def restart_service(container_id, service_name):
     logger.info(f"Attempting to restart service {service_name} in container {container_id}")
-    result_service = _execute_in_container(container_id, ['service', service_name, 'restart'], ignore_failure=True)
-    if result_service.exit_code != 0:
-        logger.warning(f"'service {service_name} restart' failed (code {result_service.exit_code}): {result_service.stderr}. Trying systemctl.")
-        result_systemctl = _execute_in_container(container_id, ['systemctl', 'restart', service_name], ignore_failure=True)
-        if result_systemctl.exit_code != 0:
-             logger.error(f"Both service and systemctl restart {service_name} failed in {container_id}. systemctl_err: {result_systemctl.stderr}")
+    result = _execute_in_container(container_id, _service_command(service_name, 'restart'), ignore_failure=True,
+                                   metric_name='service restart')
+    if result.exit_code != 0:
+        logger.error(f"Both service and systemctl restart {service_name} failed in {container_id} (code {result.exit_code}): {result.stderr}")
 
 
 def list_files(container_id, path):
@@ -350,16 +556,42 @@ def read_file(container_id, file_path):
         raise Exception(f"Failed to read file {container_id}:{file_path}: {result.stderr}")
     return result.stdout
 
+def _is_missing_container(error):
+    # The daemon answers 404 both for an unknown container ("No such container: ...")
+    # and for a put_archive target path that doesn't exist ("Could not find the file ...").
+    return 'no such container' in str(error).lower()
+
+def _docker_py_error(error):
+    """The docker-py exception the file helpers' callers expect for an async client error."""
+    return NotFound(error.message) if error.status == 404 else APIError(error.message)
+
+def _put_archive_creating_parent(container_id, parent_dir, tar_bytes):
+    # put_archive extracts relative to 'path'.
+    # If container_path is /a/b/file.txt, parent_dir is /a/b.
+    # We want to put the tar containing 'file.txt' into '/a/b/'.
+    # The parent usually exists already, so only pay for a mkdir exec when the daemon says it doesn't.
+    target_dir = parent_dir if (parent_dir and parent_dir != '.') else '/'
+    docker_async = get_async_client()
+    try:
+        with docker_call('put_archive'):
+            run_sync(docker_async.put_archive(container_id, target_dir, tar_bytes), DOCKER_TIMEOUT)
+        return
+    except DockerAPIError as e:
+        if e.status != 404 or _is_missing_container(e) or target_dir == '/':
+            raise _docker_py_error(e)
+    try:
+        with docker_call('exec'):
+            run_sync(docker_async.exec(container_id, ['mkdir', '-p', target_dir]), DOCKER_TIMEOUT)
+        with docker_call('put_archive'):
+            run_sync(docker_async.put_archive(container_id, target_dir, tar_bytes), DOCKER_TIMEOUT)
+    except DockerAPIError as e:
+        raise _docker_py_error(e)
+
 def write_file(container_id, container_path, content_string):
     if client is None: raise Exception("Docker client not initialized")
     
     try:
-        container_obj = client.containers.get(container_id)
-        
         parent_dir = os.path.dirname(container_path)
-        # Ensure parent_dir is not empty, '/', or '.' before trying to mkdir
-        if parent_dir and parent_dir not in ['/', '.']:
-            _execute_in_container(container_id, ['mkdir', '-p', parent_dir], ignore_failure=True)
 
         tar_stream = io.BytesIO()
         with tarfile.open(fileobj=tar_stream, mode='w') as tar:
@@ -371,10 +603,7 @@ def write_file(container_id, container_path, content_string):
             tar.addfile(tarinfo, io.BytesIO(file_bytes))
         tar_stream.seek(0)
         
-        # put_archive extracts relative to 'path'.
-        # If container_path is /a/b/file.txt, parent_dir is /a/b.
-        # We want to put the tar containing 'file.txt' into '/a/b/'.
-        container_obj.put_archive(path=parent_dir if (parent_dir and parent_dir != '.') else '/', data=tar_stream)
+        _put_archive_creating_parent(container_id, parent_dir, tar_stream.getvalue())
         logger.info(f"File written to {container_id}:{container_path}")
     except NotFound:
         raise Exception(f"Container {container_id} not found for writing file.")
@@ -390,11 +619,7 @@ def create_directory(container_id, dir_path):
 def upload_file(container_id, local_path, container_path):
     if client is None: raise Exception("Docker client not initialized")
     try:
-        container_obj = client.containers.get(container_id)
-
         parent_dir = os.path.dirname(container_path)
-        if parent_dir and parent_dir not in ['/', '.']:
-             _execute_in_container(container_id, ['mkdir', '-p', parent_dir], ignore_failure=True)
 
         tar_stream = io.BytesIO()
         with tarfile.open(fileobj=tar_stream, mode='w') as tar:
@@ -402,7 +627,7 @@ def upload_file(container_id, local_path, container_path):
             tar.add(local_path, arcname=arcname)
         tar_stream.seek(0)
         
-        container_obj.put_archive(path=parent_dir if (parent_dir and parent_dir != '.') else '/', data=tar_stream)
+        _put_archive_creating_parent(container_id, parent_dir, tar_stream.getvalue())
         logger.info(f"File {local_path} uploaded to {container_id}:{container_path}")
     except NotFound:
         raise Exception(f"Container {container_id} not found for uploading file.")
@@ -415,8 +640,6 @@ def upload_file(container_id, local_path, container_path):
 def download_file(container_id, container_path):
     if client is None: raise Exception("Docker client not initialized")
     try:
-        container_obj = client.containers.get(container_id)
-        
         stat_result = _execute_in_container(container_id, ['stat', '-c', '%F', container_path])
         if stat_result.exit_code != 0 or not stat_result.stdout.strip():
              raise Exception(f"Path {container_path} not found or inaccessible in {container_id}: {stat_result.stderr}")
@@ -426,11 +649,15 @@ def download_file(container_id, container_path):
              raise Exception(f"Path {container_path} is a directory. Direct download of directories not yet supported this way, expecting a file.")
 
 
-        bits, stat_info = container_obj.get_archive(container_path) 
+        try:
+            with docker_call('get_archive'):
+                archive, _ = run_sync(get_async_client().get_archive(container_id, container_path), DOCKER_TIMEOUT)
+        except DockerAPIError as e:
+            raise _docker_py_error(e)
 
         temp_file_download = tempfile.NamedTemporaryFile(delete=False)
         
-        with tarfile.open(fileobj=io.BytesIO(b"".join(bits)), mode='r') as tar:
+        with tarfile.open(fileobj=io.BytesIO(archive), mode='r') as tar:
             member_to_extract = None
             # The name of the file inside the tar could be just its basename, or '.' if it's the only item.
             target_filename_in_tar = os.path.basename(container_path) 
@@ -497,9 +724,14 @@ def download_url_to_container(container_id, url, destination_dir):
     safe_filename = "".join(c if c.isalnum() or c in ['.', '_', '-'] else '_' for c in filename)
     destination_path = os.path.join(destination_dir, safe_filename)
     
-    create_directory(container_id, destination_dir)
-
-    result = _execute_in_container(container_id, ['curl', '-fSL', '-o', destination_path, url]) 
+    mkdir_result, *curl_results = _execute_batch_in_container(container_id, [
+        ['mkdir', '-p', destination_dir],
+        (['curl', '-fSL', '-o', destination_path, url], True),
+    ])
+    if mkdir_result.exit_code != 0 or not curl_results:
+        raise Exception(f"Failed to create directory {container_id}:{destination_dir}: {mkdir_result.stderr}")
+
+    result = curl_results[0]
     if result.exit_code != 0:
         logger.warning(f"curl failed for {url} in {container_id} (code: {result.exit_code}), trying wget. Error: {result.stderr}")
         result = _execute_in_container(container_id, ['wget', '-O', destination_path, url])
@@ -515,9 +747,11 @@ def create_cronjob(container_id, name, command, schedule):
     cron_file_path = f"/etc/cron.d/{safe_name}"
     
     write_file(container_id, cron_file_path, cron_content)
-    _execute_in_container(container_id, ['chmod', '0644', cron_file_path]) # More specific chmod
-    _execute_in_container(container_id, ['chown', 'root:root', cron_file_path]) 
-    restart_service(container_id, 'cron')
+    _execute_batch_in_container(container_id, [
+        ['chmod', '0644', cron_file_path], # More specific chmod
+        ['chown', 'root:root', cron_file_path],
+        _service_command('cron', 'restart'),
+    ], stop_on_failure=False)
 
 def toggle_cronjob(container_id, name, active):
     safe_name = "".join(c if c.isalnum() or c in ('_', '-') else '_' for c in name)
@@ -579,5 +813,7 @@ def delete_cronjob(container_id, name):
     safe_name = "".join(c if c.isalnum() or c in ('_', '-') else '_' for c in name)
     cron_file_path = f"/etc/cron.d/{safe_name}"
 
-    _execute_in_container(container_id, ['rm', '-f', cron_file_path], ignore_failure=True)
-    restart_service(container_id, 'cron')
\ No newline at end of file
+    _execute_batch_in_container(container_id, [
+        (['rm', '-f', cron_file_path], True),
+        _service_command('cron', 'restart'),
+    ])
\ No newline at end of file
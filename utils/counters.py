@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import event, inspect, select, update, func
+from .locks import try_become_leader
+
+logger = logging.getLogger(__name__)
+
+# Counts are adjusted in the same transaction as the change, so they only drift if a
+# write bypasses the session (raw SQL, a bulk query delete) or a process dies mid-way.
+# Reconciliation recounts from the tables to correct that.
+COUNTER_RECONCILE_INTERVAL = float(os.environ.get("SBPANEL_COUNTER_RECONCILE_INTERVAL", "600"))
+
+_reconciler_started = False
+
+
+# counter key -> (model name, attribute, value): rows counted, optionally only those
+# whose attribute equals the value
+COUNTERS = {
+    'user_count': ('User', None, None),
+    'active_user_count': ('User', 'active', True),
+    'container_count': ('Container', None, None),
+    'running_container_count': ('Container', 'status', 'running'),
+    'website_count': ('Website', None, None),
+    'database_count': ('Database', None, None),
+    'service_count': ('Service', None, None),
+    'running_service_count': ('Service', 'status', 'running'),
+}
+
+
+def _previous_value(obj, attribute):
+    # Value before the changes this flush wrote. Tracked attributes have active history
+    # (see init_counters), so the old value is loaded even when set on an expired instance.
+    history = inspect(obj).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None if history.added else getattr(obj, attribute)
+
+
+def _track_previous_values(target, value, oldvalue, initiator):
+    return value
+
+
+def _counts(obj, attribute, value, previous=False):
+    if attribute is None:
+        return 1
+    current = _previous_value(obj, attribute) if previous else getattr(obj, attribute)
+    return 1 if current == value else 0
+
+
+def _flush_deltas(session):
+    import models
+    deltas = {}
+    for key, (model_name, attribute, value) in COUNTERS.items():
+        model = getattr(models, model_name)
+        delta = 0
+        for obj in session.new:
+            if isinstance(obj, model):
+                delta += _counts(obj, attribute, value)
+        for obj in session.deleted:
+            if isinstance(obj, model):
+                delta -= _counts(obj, attribute, value, previous=True)
+        if attribute is not None:
+            for obj in session.dirty:
+                if isinstance(obj, model) and obj not in session.deleted:
+                    delta += _counts(obj, attribute, value) - _counts(obj, attribute, value, previous=True)
+        if delta:
+            deltas[key] = delta
+    return deltas
+
+
+def _after_flush(session, flush_context):
+    deltas = _flush_deltas(session)
+    if not deltas:
+        return
+    from models import SystemCounter
+    counters = SystemCounter.__table__
+    connection = session.connection()
+    for key, delta in deltas.items():
+        connection.execute(update(counters).where(counters.c.key == key)
+                           .values(value=counters.c.value + delta, updated_at=datetime.utcnow()))
+
+
+def recount(connection, keys=None):
+    """
+    Set counters to fresh COUNT(*)s on an open connection (inside the caller's transaction).
+
+    Used by reconciliation and by writers that bypass the session, like the Docker
+    events listener's bulk status updates.
+    """
+    from models import SystemCounter
+    counters = SystemCounter.__table__
+    import models
+    keys = list(COUNTERS) if keys is None else keys
+    existing = set(connection.execute(select(counters.c.key)).scalars())
+    now = datetime.utcnow()
+    for key in keys:
+        model_name, attribute, match = COUNTERS[key]
+        model = getattr(models, model_name)
+        query = select(func.count()).select_from(model)
+        if attribute is not None:
+            query = query.where(getattr(model, attribute) == match)
+        value = connection.execute(query).scalar()
+        if key in existing:
+            connection.execute(update(counters).where(counters.c.key == key).values(value=value, updated_at=now))
+        else:
+            connection.execute(counters.insert().values(key=key, value=value, updated_at=now))
+
+
+def reconcile_counters():
+    """Recount every counter from its table. Returns the counters that had drifted."""
+    from app import db
+    from models import SystemCounter
+    with db.engine.begin() as conn:
+        before = dict(conn.execute(select(SystemCounter.key, SystemCounter.value)).all())
+        recount(conn)
+        after = dict(conn.execute(select(SystemCounter.key, SystemCounter.value)).all())
+    drifted = {key: (before.get(key), after[key]) for key in after if before.get(key) != after[key]}
+    if drifted and before:
+        logger.warning(f"Corrected drifted system counters (was, now): {drifted}")
+    return drifted
+
+
+def get_counters():
+    """All counters, from one primary-key scan of a table with a row per counter."""
+    from app import db
+    from models import SystemCounter
+    values = dict(db.session.execute(select(SystemCounter.key, SystemCounter.value)).all())
+    return {key: values.get(key, 0) for key in COUNTERS}
+
+
+def _reconcile_periodically(app):
+    while True:
+        try:
+            with app.app_context():
+                reconcile_counters()
+        except Exception as e:
+            logger.error(f"Counter reconciliation failed: {e}")
+        time.sleep(COUNTER_RECONCILE_INTERVAL)
+
+
+def init_counters(app):
+    """
+    Track counter changes on every session flush, and reconcile them at startup and
+    every COUNTER_RECONCILE_INTERVAL (one worker per host reconciles).
+    """
+    global _reconciler_started
+    import models
+    from app import db
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+        for model_name, attribute, _ in COUNTERS.values():
+            if attribute is not None:
+                event.listen(getattr(getattr(models, model_name), attribute), 'set', _track_previous_values,
+                             active_history=True, retval=True)
+    if _reconciler_started or not try_become_leader("counter-reconcile"):
+        return
+    _reconciler_started = True
+    threading.Thread(target=_reconcile_periodically, args=(app,), name="sbpanel-counter-reconcile",
+                     daemon=True).start()
+    logger.info("System counter reconciliation started.")
@@ -1,7 +1,7 @@
 import logging
 import random
 import string
-from .container import _execute_in_container, start_service, write_file, read_file, restart_service # Adjusted imports
+from .container import _execute_batch_in_container, _service_command, write_file, read_file, restart_service # Adjusted imports
 
 logger = logging.getLogger(__name__)
 
@@ -24,16 +24,6 @@ def create_database(container_id, name, db_type, db_user, db_password, remote_ac
     else:
         raise ValueError(f"Unsupported database type: {db_type}")
 
-    logger.info(f"Ensuring {db_package} is installed in {container_id}...")
-    _execute_in_container(container_id, ['apt-get', 'update', '-y'])
-    install_db_result = _execute_in_container(container_id, ['apt-get', 'install', '-y', db_package])
-    if install_db_result.exit_code != 0:
-        logger.error(f"Failed to install {db_package} in {container_id}: {install_db_result.stderr}")
-        raise Exception(f"Failed to install {db_package} in {container_id}")
-    logger.info(f"Successfully installed/verified {db_package} in {container_id}.")
-    
-    start_service(container_id, service_name)
-    
     # MySQL commands might need a brief moment for the server to be fully ready after start
     # Consider a small sleep or retry mechanism if encountering "can't connect" errors here.
     # For simplicity, not adding it yet.
@@ -59,8 +49,22 @@ def create_database(container_id, name, db_type, db_user, db_password, remote_ac
     # Execute SQL. This requires mysql client and that the server is running without root password prompt or with a known one.
     # The default Ubuntu install of mysql-server often allows root login without password from localhost.
     # If `mysql` command needs password, this will fail.
-    exec_sql_result = _execute_in_container(container_id, ['mysql', '-e', full_sql_command_str])
-    if exec_sql_result.exit_code != 0:
+    logger.info(f"Ensuring {db_package} is installed in {container_id}...")
+    # Install, start and run the SQL in one exec session; the batch stops at the first failing step.
+    create_results = _execute_batch_in_container(container_id, [
+        (['apt-get', 'update', '-y'], True),
+        ['apt-get', 'install', '-y', db_package],
+        (_service_command(service_name, 'start'), True),
+        ['mysql', '-e', full_sql_command_str],
+    ])
+    install_db_result = create_results[1] if len(create_results) > 1 else create_results[-1]
+    if install_db_result.exit_code != 0:
+        logger.error(f"Failed to install {db_package} in {container_id}: {install_db_result.stderr}")
+        raise Exception(f"Failed to install {db_package} in {container_id}")
+    logger.info(f"Successfully installed/verified {db_package} in {container_id}.")
+
+    exec_sql_result = create_results[-1]
+    if len(create_results) < 4 or exec_sql_result.exit_code != 0:
         logger.error(f"Failed to execute SQL commands for database {name} in {container_id}: {exec_sql_result.stderr} {exec_sql_result.stdout}")
         # It's possible the user already exists with a different password, or other SQL error.
         # More granular error handling would be good here.
@@ -76,7 +80,6 @@ def delete_database(container_id, name, db_type, db_user):
     Delete a database from a container
     """
     service_name = 'mysql' if db_type == 'mysql' else 'mariadb'
-    start_service(container_id, service_name)
     
     sql_commands = [
         f"DROP DATABASE IF EXISTS `{name}`;",
@@ -86,7 +89,10 @@ def delete_database(container_id, name, db_type, db_user):
     ]
     full_sql_command_str = " ".join(sql_commands)
     
-    exec_sql_result = _execute_in_container(container_id, ['mysql', '-e', full_sql_command_str])
+    exec_sql_result = _execute_batch_in_container(container_id, [
+        (_service_command(service_name, 'start'), True),
+        (['mysql', '-e', full_sql_command_str], True),
+    ])[-1]
     if exec_sql_result.exit_code != 0:
         logger.warning(f"Failed to delete database/user {name}/{db_user} in {container_id} (may not exist or other SQL issue): {exec_sql_result.stderr}")
         # Not raising exception, as it might be a "user/db doesn't exist" error which is fine for delete.
@@ -94,6 +100,14 @@ def delete_database(container_id, name, db_type, db_user):
         logger.info(f"Database {name} and user {db_user} (if existed) deleted from {container_id}.")
 
 
+def _first_existing_path(container_id, paths):
+    """Return the first of `paths` that is a regular file in the container, probing all in one exec."""
+    results = _execute_batch_in_container(container_id, [(['test', '-f', p], True) for p in paths])
+    for path, res in zip(paths, results):
+        if res.exit_code == 0:
+            return path
+    return None
+
 def configure_remote_access(container_id, db_type, service_name_for_restart):
     """
     Configure database server for remote access by changing bind-address.
@@ -105,27 +119,17 @@ def configure_remote_access(container_id, db_type, service_name_for_restart):
         # MySQL 8.0 might use /etc/mysql/my.cnf or similar, or also the above.
         # Check common paths.
         possible_paths = ['/etc/mysql/mysql.conf.d/mysqld.cnf', '/etc/mysql/my.cnf']
-        for p in possible_paths:
-             res = _execute_in_container(container_id, ['test', '-f', p], ignore_failure=True)
-             if res.exit_code == 0:
-                  config_file_path = p
-                  break
+        config_file_path = _first_existing_path(container_id, possible_paths)
         if not config_file_path:
              logger.error(f"MySQL config file not found in {container_id} at expected paths.")
              return False # Cannot configure
     elif db_type == 'mariadb':
         # MariaDB often uses /etc/mysql/mariadb.conf.d/50-server.cnf
-        config_file_path = '/etc/mysql/mariadb.conf.d/50-server.cnf'
-        res = _execute_in_container(container_id, ['test', '-f', config_file_path], ignore_failure=True)
-        if res.exit_code != 0:
-            # Try alternative path if 50-server.cnf doesn't exist
-            alt_path = '/etc/mysql/my.cnf' # Some MariaDB setups might use this
-            res_alt = _execute_in_container(container_id, ['test', '-f', alt_path], ignore_failure=True)
-            if res_alt.exit_code == 0:
-                config_file_path = alt_path
-            else:
-                logger.error(f"MariaDB config file not found in {container_id} at expected paths.")
-                return False
+        # Try alternative path if 50-server.cnf doesn't exist; some MariaDB setups use /etc/mysql/my.cnf
+        config_file_path = _first_existing_path(container_id, ['/etc/mysql/mariadb.conf.d/50-server.cnf', '/etc/mysql/my.cnf'])
+        if not config_file_path:
+            logger.error(f"MariaDB config file not found in {container_id} at expected paths.")
+            return False
     else:
         raise ValueError(f"Unsupported database type for remote access config: {db_type}")
 
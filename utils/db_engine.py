@@ -0,0 +1,102 @@
+import os
+import logging
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# Connections kept per worker process, and extra ones opened under load. gunicorn runs
+# 32 threads per worker, plus the background services' threads.
+POOL_SIZE = int(os.environ.get("SBPANEL_DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.environ.get("SBPANEL_DB_MAX_OVERFLOW", "20"))
+# Seconds a request waits for a free connection before failing.
+POOL_TIMEOUT = int(os.environ.get("SBPANEL_DB_POOL_TIMEOUT", "10"))
+# Compiled SQL kept per engine; the panel's queries (with their IN-list and
+# load_only variants) are far more than the default 500.
+QUERY_CACHE_SIZE = int(os.environ.get("SBPANEL_DB_QUERY_CACHE_SIZE", "1500"))
+
+# PostgreSQL: no statement runs longer than this, and a connection left idle inside
+# a transaction (holding its locks) is closed after IDLE_IN_TRANSACTION_TIMEOUT.
+STATEMENT_TIMEOUT_MS = int(os.environ.get("SBPANEL_DB_STATEMENT_TIMEOUT_MS", "30000"))
+IDLE_IN_TRANSACTION_TIMEOUT_MS = int(os.environ.get("SBPANEL_DB_IDLE_IN_TRANSACTION_TIMEOUT_MS", "60000"))
+# psycopg 3 prepares a statement server-side once it has run this many times on a
+# connection. Only for postgresql+psycopg:// URLs; the psycopg2 driver the project
+# depends on (and plain postgresql:// URLs) has no server-side statement caching.
+PREPARE_THRESHOLD = int(os.environ.get("SBPANEL_DB_PREPARE_THRESHOLD", "2"))
+
+# SQLite: how long a writer waits for another process's write lock instead of failing
+# with "database is locked", and how much of the file is read through mmap.
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SBPANEL_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SBPANEL_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SBPANEL_SQLITE_CACHE_SIZE_KB", "20000"))
+
+
+def _sqlite_in_memory(url):
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def engine_options(database_url):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS suited to the database the URL points at.
+
+    SQLite gets a pool sized for gunicorn's threads and no pre-ping (a local file
+    can't drop the connection); its pragmas are set per connection by configure_engine.
+    PostgreSQL gets a bounded LIFO pool and server-side timeouts, plus prepared
+    statements when the URL selects psycopg 3 (postgresql+psycopg://). The default
+    psycopg2 driver sends every statement unprepared; only SQLAlchemy's compiled
+    query cache applies there.
+    """
+    url = make_url(database_url)
+    options = {'query_cache_size': QUERY_CACHE_SIZE}
+    if url.get_backend_name() == 'sqlite':
+        if not _sqlite_in_memory(url):
+            options.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+        # The sqlite3 module's own lock wait; busy_timeout below sets the same.
+        options['connect_args'] = {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+        return options
+
+    options.update(
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=1800,
+        pool_pre_ping=True,
+        # Reuse the most recently returned connection, so the ones beyond what the
+        # load needs sit idle long enough for the recycle to close them.
+        pool_use_lifo=True,
+    )
+    if url.get_backend_name() == 'postgresql':
+        connect_args = {
+            'options': f"-c statement_timeout={STATEMENT_TIMEOUT_MS} "
+                       f"-c idle_in_transaction_session_timeout={IDLE_IN_TRANSACTION_TIMEOUT_MS}",
+            'application_name': 'sbpanel',
+        }
+        if url.get_driver_name() == 'psycopg':
+            connect_args['prepare_threshold'] = PREPARE_THRESHOLD
+        options['connect_args'] = connect_args
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        # WAL lets readers in every worker run while one writes, where the default
+        # rollback journal locks the whole file for each write. NORMAL syncs at
+        # checkpoints rather than every commit, which is still safe in WAL mode.
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine):
+    """Apply per-connection settings the engine options can't express; call before first use."""
+    if engine.dialect.name != 'sqlite' or _sqlite_in_memory(engine.url):
+        return
+    if not event.contains(engine, 'connect', _set_sqlite_pragmas):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+        logger.info("SQLite connections use WAL journaling.")
@@ -0,0 +1,312 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import docker
+from docker.errors import NotFound, APIError, ImageNotFound
+from .locks import host_lock
+from .openmetrics import docker_api_duration, docker_api_errors
+
+logger = logging.getLogger(__name__)
+
+# Connection pool size for the Docker HTTP adapter. docker-py defaults to 10, which
+# a busy gunicorn worker with provisioning threads exhausts quickly.
+DOCKER_POOL_SIZE = int(os.environ.get("SBPANEL_DOCKER_POOL_SIZE", "32"))
+DOCKER_TIMEOUT = int(os.environ.get("SBPANEL_DOCKER_TIMEOUT", "120"))
+# How long a looked-up container object is reused before it is inspected again.
+CONTAINER_CACHE_TTL = float(os.environ.get("SBPANEL_CONTAINER_CACHE_TTL", "30"))
+# One stamp file per container name and ID, rewritten when the container is invalidated
+# (by a Docker event in the listener's worker, or an error or rename in any worker).
+# A cached handle is only used while its key's stamp is the one seen when it was cached,
+# so an invalidation reaches every worker on the host, not just the one that saw it.
+CONTAINER_STAMP_DIR = os.environ.get("SBPANEL_CONTAINER_CACHE_STAMP_DIR",
+                                     os.path.join(tempfile.gettempdir(), "sbpanel-cache", "containers"))
+CONTAINER_CACHE_MAX = 2048
+# How long an image seen locally is trusted to still be there.
+IMAGE_CACHE_TTL = float(os.environ.get("SBPANEL_IMAGE_CACHE_TTL", "300"))
+
+try:
+    client = docker.from_env(max_pool_size=DOCKER_POOL_SIZE, timeout=DOCKER_TIMEOUT)
+    client.ping()
+    logger.info(f"Successfully connected to Docker daemon (pool size {DOCKER_POOL_SIZE}).")
+except docker.errors.DockerException as e:
+    logger.error(f"Could not connect to Docker daemon: {e}. SBPanel requires Docker to be running and accessible.")
+    logger.warning("Proceeding without a live Docker client. Container operations will likely fail.")
+    client = None
+
+_cache_lock = threading.Lock()
+_container_cache = {}  # name or ID -> (container object, fetched_at, stamp of that key when cached)
+
+_image_lock = threading.Lock()
+_present_images = {}  # normalized image name -> (image ID, checked_at)
+_pulls_in_flight = {}  # normalized image name -> _ImagePull
+
+_stats_lock = threading.Lock()
+_call_stats = {}  # operation -> {'count', 'errors', 'total_seconds', 'max_seconds'}
+
+
+@contextmanager
+def docker_call(operation):
+    """Time a Docker API call and record it under `operation` in the latency counters."""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        docker_api_duration.observe(elapsed, operation=operation)
+        if failed:
+            docker_api_errors.inc(operation=operation)
+        with _stats_lock:
+            entry = _call_stats.setdefault(operation, {'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            entry['count'] += 1
+            entry['total_seconds'] += elapsed
+            if elapsed > entry['max_seconds']:
+                entry['max_seconds'] = elapsed
+            if failed:
+                entry['errors'] += 1
+
+
+def get_call_stats():
+    """
+    Get per-operation Docker call counters for this worker
+
+    Returns:
+        dict: operation -> count, errors, total/avg/max latency in milliseconds
+    """
+    with _stats_lock:
+        snapshot = {op: dict(entry) for op, entry in _call_stats.items()}
+    return {
+        op: {
+            'count': entry['count'],
+            'errors': entry['errors'],
+            'total_ms': round(entry['total_seconds'] * 1000, 3),
+            'avg_ms': round(entry['total_seconds'] * 1000 / entry['count'], 3) if entry['count'] else 0,
+            'max_ms': round(entry['max_seconds'] * 1000, 3),
+        }
+        for op, entry in snapshot.items()
+    }
+
+
+def _stamp_path(key):
+    # Container names and IDs are [a-zA-Z0-9_.-]; anything else isn't stamped.
+    if not key or '/' in key or key.startswith('.'):
+        return None
+    return os.path.join(CONTAINER_STAMP_DIR, key)
+
+
+def _stamp(key):
+    path = _stamp_path(key)
+    try:
+        return os.stat(path).st_mtime_ns if path else None
+    except OSError:
+        return None
+
+
+def _publish_invalidation(keys):
+    os.makedirs(CONTAINER_STAMP_DIR, exist_ok=True)
+    for key in keys:
+        path = _stamp_path(key)
+        if path:
+            with open(path, 'w') as f:
+                f.write(str(time.time_ns()))
+
+
+def get_container(container_id_or_name, refresh=False):
+    """
+    Get a docker-py container object, reusing a recent lookup when possible.
+
+    The object is only used as a handle (its ID) for exec/archive calls, so a cached
+    copy is safe until the container is removed or recreated; callers that need fresh
+    attributes should call reload() on it themselves.
+    """
+    if client is None:
+        raise Exception("Docker client not initialized")
+
+    now = time.monotonic()
+    # Read before the inspect, so an invalidation that lands during it leaves a newer
+    # stamp behind and the next lookup inspects again.
+    stamp = _stamp(container_id_or_name)
+    if not refresh:
+        with _cache_lock:
+            cached = _container_cache.get(container_id_or_name)
+        if cached and now - cached[1] < CONTAINER_CACHE_TTL and cached[2] == stamp:
+            return cached[0]
+
+    with docker_call('containers.get'):
+        container_obj = client.containers.get(container_id_or_name)
+
+    aliases = {key for key in (container_obj.id, container_obj.name) if key and key != container_id_or_name}
+    alias_stamps = {key: _stamp(key) for key in aliases}
+    with _cache_lock:
+        if len(_container_cache) >= CONTAINER_CACHE_MAX:
+            _container_cache.clear()
+        _container_cache[container_id_or_name] = (container_obj, now, stamp)
+        for key in aliases:
+            _container_cache[key] = (container_obj, now, alias_stamps[key])
+    return container_obj
+
+
+def invalidate_container(container_id_or_name=None):
+    """
+    Drop cached lookups for one container (by name or ID) in every worker on this host,
+    or for all containers in this worker.
+    """
+    with _cache_lock:
+        if container_id_or_name is None:
+            _container_cache.clear()
+            return
+        stale_keys = {container_id_or_name}
+        cached = _container_cache.pop(container_id_or_name, None)
+        if cached:
+            stale_id = cached[0].id
+            stale_keys.update(k for k, v in _container_cache.items() if v[0].id == stale_id)
+            for key in stale_keys:
+                _container_cache.pop(key, None)
+    try:
+        _publish_invalidation(stale_keys)
+    except OSError as e:
+        logger.warning(f"Could not tell other workers to drop container {container_id_or_name}: {e}")
+
+
+def call_with_container(container_id_or_name, operation, fn):
+    """
+    Run fn(container_obj) against a cached container handle.
+
+    If the daemon reports the handle as gone (container recreated under the same name)
+    the cache entry is dropped and the call is retried once with a fresh lookup.
+    Errors invalidate the cache entry so the next call starts from a clean inspect.
+    """
+    container_obj = get_container(container_id_or_name)
+    try:
+        with docker_call(operation):
+            return fn(container_obj)
+    except NotFound:
+        invalidate_container(container_id_or_name)
+        container_obj = get_container(container_id_or_name, refresh=True)
+        with docker_call(operation):
+            return fn(container_obj)
+    except APIError:
+        invalidate_container(container_id_or_name)
+        raise
+
+
+class _ImagePull:
+    def __init__(self):
+        self.done = threading.Event()
+        self.image_id = None
+        self.error = None
+
+
+def _normalize_image_name(image_name):
+    # 'ubuntu' and 'ubuntu:latest' are the same image; keep one cache entry for both.
+    if '@' not in image_name and ':' not in image_name.rsplit('/', 1)[-1]:
+        return f"{image_name}:latest"
+    return image_name
+
+
+def _cached_image_id(key):
+    with _image_lock:
+        cached = _present_images.get(key)
+    if cached and time.monotonic() - cached[1] < IMAGE_CACHE_TTL:
+        return cached[0]
+    return None
+
+
+def _remember_image(key, image_id):
+    with _image_lock:
+        _present_images[key] = (image_id, time.monotonic())
+
+
+def image_present(image_name):
+    """Whether an image is available locally; positive answers are cached for IMAGE_CACHE_TTL."""
+    if client is None:
+        return False
+    key = _normalize_image_name(image_name)
+    if _cached_image_id(key):
+        return True
+    try:
+        with docker_call('images.get'):
+            image = client.images.get(key)
+    except ImageNotFound:
+        return False
+    _remember_image(key, image.id)
+    return True
+
+
+def ensure_image(image_name):
+    """
+    Make sure an image is available locally, pulling it if needed.
+
+    Concurrent callers for the same image wait on a single pull: threads in this worker
+    share one in-flight pull, and worker processes serialise on a host lock and find
+    the image already present once the first pull finishes.
+
+    Returns:
+        str: The image ID
+    """
+    if client is None:
+        raise Exception("Docker client not initialized")
+    key = _normalize_image_name(image_name)
+    image_id = _cached_image_id(key)
+    if image_id:
+        return image_id
+
+    with _image_lock:
+        pull = _pulls_in_flight.get(key)
+        owner = pull is None
+        if owner:
+            pull = _pulls_in_flight[key] = _ImagePull()
+    if not owner:
+        pull.done.wait()
+        if pull.error is not None:
+            raise pull.error
+        return pull.image_id
+
+    try:
+        pull.image_id = _get_or_pull_image(key)
+        _remember_image(key, pull.image_id)
+        return pull.image_id
+    except Exception as e:
+        pull.error = e
+        raise
+    finally:
+        with _image_lock:
+            _pulls_in_flight.pop(key, None)
+        pull.done.set()
+
+
+def _get_or_pull_image(image_name):
+    try:
+        with docker_call('images.get'):
+            return client.images.get(image_name).id
+    except ImageNotFound:
+        pass
+    lock_name = f"image-pull-{hashlib.sha1(image_name.encode()).hexdigest()[:16]}"
+    with host_lock(lock_name):
+        # Another worker may have pulled it while this one waited for the lock.
+        try:
+            with docker_call('images.get'):
+                return client.images.get(image_name).id
+        except ImageNotFound:
+            pass
+        logger.info(f"Image {image_name} not found locally. Pulling...")
+        with docker_call('images.pull'):
+            image = client.images.pull(image_name)
+        logger.info(f"Successfully pulled image {image_name}.")
+        return image.id
+
+
+def invalidate_image(image_name=None):
+    """Forget that an image is present (after removing it), or forget all images."""
+    with _image_lock:
+        if image_name is None:
+            _present_images.clear()
+        else:
+            _present_images.pop(_normalize_image_name(image_name), None)
@@ -0,0 +1,191 @@
+import os
+import time
+import asyncio
+import logging
+from sqlalchemy import update, select
+from .docker_client import client as docker_client, invalidate_container
+from .async_docker import get_async_client, submit
+from .locks import try_become_leader
+from .counters import recount
+
+logger = logging.getLogger(__name__)
+
+# Status changes are collected and written to the database at most this often.
+EVENT_FLUSH_INTERVAL = float(os.environ.get("SBPANEL_EVENT_FLUSH_INTERVAL", "1"))
+RECONNECT_DELAY = 5
+
+EVENT_FILTERS = {
+    'type': ['container'],
+    'event': ['start', 'unpause', 'pause', 'die', 'stop', 'oom', 'destroy', 'rename', 'health_status'],
+}
+
+# Statuses owned by the provisioning flow; Docker events must not overwrite them (a
+# container being provisioned is already started, and a failed one gets stopped).
+PROTECTED_STATUSES = ('creating', 'error_provisioning', 'error_creating_base')
+
+# Container statuses after which the services inside it are no longer running.
+SERVICES_DOWN_STATUSES = ('stopped', 'error', 'removed')
+
+
+def _status_from_state(state, status_text=''):
+    """Map a Docker container State (from a container listing) to our status."""
+    if state == 'running':
+        return 'unhealthy' if '(unhealthy)' in status_text else 'running'
+    if state == 'paused':
+        return 'paused'
+    return 'stopped'
+
+
+class DockerEventListener:
+    """
+    Follows the Docker events stream and keeps Container.status (and Service.status
+    when a container goes down) in line with what the daemon reports.
+
+    Every (re)connect starts with a full listing so changes missed while disconnected
+    are picked up; after that only events are applied.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._pending = {}  # container name -> status, latest event wins
+        self._oom_killed = set()
+
+    def record_event(self, event):
+        action = event.get('Action') or event.get('status') or ''
+        actor = event.get('Actor') or {}
+        name = actor.get('Attributes', {}).get('name')
+        if not action.startswith('health_status'):
+            # Cached handles keep the state they were inspected with, and a destroyed or
+            # renamed container's handle is no longer valid at all. The listener runs in
+            # one worker; invalidate_container's stamp files reach the others.
+            for key in (actor.get('ID') or event.get('id'), name):
+                if key:
+                    invalidate_container(key)
+            old_name = actor.get('Attributes', {}).get('oldName')
+            if old_name:
+                invalidate_container(old_name.lstrip('/'))
+        if not name:
+            return
+        if action in ('start', 'unpause'):
+            self._oom_killed.discard(name)
+            status = 'running'
+        elif action == 'pause':
+            status = 'paused'
+        elif action == 'oom':
+            # The kernel kill is followed by a die event; remember why it died.
+            self._oom_killed.add(name)
+            return
+        elif action in ('die', 'stop'):
+            status = 'error' if name in self._oom_killed else 'stopped'
+        elif action == 'destroy':
+            self._oom_killed.discard(name)
+            status = 'removed'
+        elif action.startswith('health_status'):
+            status = 'unhealthy' if action.endswith('unhealthy') else 'running'
+        else:
+            return  # rename: the handle is dropped above, the status is unchanged
+        self._pending[name] = status
+
+    def take_pending(self):
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def write_statuses(self, statuses):
+        """Apply {container name: status} to the database in one transaction."""
+        if not statuses:
+            return
+        from app import db
+        from models import Container, Service
+        containers = Container.__table__
+        services = Service.__table__
+        by_status = {}
+        for name, status in statuses.items():
+            by_status.setdefault(status, []).append(name)
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                for status, names in by_status.items():
+                    conn.execute(
+                        update(containers)
+                        .where(containers.c.container_id.in_(names),
+                               containers.c.status.notin_(PROTECTED_STATUSES),
+                               containers.c.status != status)
+                        .values(status=status)
+                    )
+                    if status in SERVICES_DOWN_STATUSES:
+                        container_ids = select(containers.c.id).where(containers.c.container_id.in_(names))
+                        conn.execute(
+                            update(services)
+                            .where(services.c.container_id.in_(container_ids), services.c.status != 'stopped')
+                            .values(status='stopped')
+                        )
+                # These bulk updates bypass the session, so refresh the counters they affect here.
+                recount(conn, ['running_container_count', 'running_service_count'])
+        logger.debug(f"Synced status for {len(statuses)} container(s) from Docker events.")
+
+    def write_snapshot(self, listing):
+        """Bring every container row in line with a full listing from the daemon."""
+        from app import db
+        from models import Container
+        statuses = {}
+        for entry in listing:
+            for name in entry.get('Names') or []:
+                statuses[name.lstrip('/')] = _status_from_state(entry.get('State'), entry.get('Status') or '')
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                known = conn.execute(select(Container.__table__.c.container_id)).scalars().all()
+        # Containers in the database that Docker no longer has were removed behind our back.
+        for name in known:
+            statuses.setdefault(name, 'removed')
+        self.write_statuses({name: statuses[name] for name in known})
+
+    async def run(self):
+        client = get_async_client()
+        loop = asyncio.get_running_loop()
+        while True:
+            flusher = None
+            try:
+                # Subscribe from before the listing so nothing between the two is lost.
+                since = int(time.time())
+                listing = await client.list_containers(all=True)
+                await loop.run_in_executor(None, self.write_snapshot, listing)
+                flusher = asyncio.ensure_future(self._flush_periodically(loop))
+                async for event in client.events(filters=EVENT_FILTERS, since=since):
+                    self.record_event(event)
+                logger.warning("Docker events stream closed; reconnecting.")
+            except Exception as e:
+                logger.error(f"Docker events listener error: {e}")
+            finally:
+                if flusher is not None:
+                    flusher.cancel()
+                await self._flush(loop)
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _flush_periodically(self, loop):
+        while True:
+            await asyncio.sleep(EVENT_FLUSH_INTERVAL)
+            await self._flush(loop)
+
+    async def _flush(self, loop):
+        pending = self.take_pending()
+        if not pending:
+            return
+        try:
+            await loop.run_in_executor(None, self.write_statuses, pending)
+        except Exception as e:
+            logger.error(f"Could not write container status changes: {e}")
+            # Keep them for the next flush unless newer events have superseded them.
+            for name, status in pending.items():
+                self._pending.setdefault(name, status)
+
+
+_listener = None
+
+
+def start_docker_events(app):
+    """Start the events listener on the async Docker bridge; only one worker per host runs it."""
+    global _listener
+    if _listener is not None or docker_client is None or not try_become_leader("docker-events"):
+        return
+    _listener = DockerEventListener(app)
+    submit(_listener.run())
+    logger.info("Docker events listener started.")
@@ -0,0 +1,169 @@
+import io
+import os
+import json
+import hashlib
+import logging
+import threading
+from docker.errors import APIError, BuildError
+from .docker_client import client, docker_call, image_present, ensure_image, invalidate_image
+from .locks import host_lock, try_become_leader
+from .container import BASE_IMAGE, BASE_PACKAGES, TEMPLATES, get_template_packages
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_IMAGE_REPOSITORY = os.environ.get("SBPANEL_TEMPLATE_IMAGE_REPOSITORY", "sbpanel/template")
+# Extra images (comma-separated) to pull at startup alongside the template images.
+PREPULL_IMAGES = [name.strip() for name in os.environ.get("SBPANEL_PREPULL_IMAGES", "").split(',') if name.strip()]
+
+_build_lock = threading.Lock()
+_builds_in_progress = set()
+
+
+def template_image_hash(template):
+    """Hash of everything that goes into a template image; changes only when the definition does."""
+    definition = {
+        'base_image': BASE_IMAGE,
+        'base_packages': BASE_PACKAGES,
+        'packages': get_template_packages(template),
+    }
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def template_image_tag(template):
+    return f"{TEMPLATE_IMAGE_REPOSITORY}-{template}:{template_image_hash(template)}"
+
+
+def _template_dockerfile(template):
+    # Base packages get their own layer, which the build cache shares between all templates.
+    return "\n".join([
+        f"FROM {BASE_IMAGE}",
+        "ENV DEBIAN_FRONTEND=noninteractive",
+        f"RUN apt-get update -y && apt-get install -y {' '.join(BASE_PACKAGES)} && rm -rf /var/lib/apt/lists/*",
+        f"RUN apt-get update -y && apt-get install -y {' '.join(get_template_packages(template))} && rm -rf /var/lib/apt/lists/*",
+        f"LABEL sbpanel.template={template} sbpanel.template_hash={template_image_hash(template)}",
+        "",
+    ])
+
+
+def template_image_exists(template):
+    return image_present(template_image_tag(template))
+
+
+def build_template_image(template, progress=None):
+    """
+    Build the image for a template, tagged by its definition hash.
+
+    Args:
+        template: Template name (a key of utils.container.TEMPLATES)
+        progress: Optional callable taking one line of build output
+
+    Returns:
+        str: The image tag
+    """
+    if client is None:
+        raise Exception("Docker client not initialized. Cannot build template image.")
+    if template not in TEMPLATES:
+        raise ValueError(f"Unknown template: {template}")
+
+    tag = template_image_tag(template)
+    # One build per template on this host; workers that lose the race find the image built.
+    with host_lock(f"template-build-{template}"):
+        if template_image_exists(template):
+            return tag
+        ensure_image(BASE_IMAGE)
+        logger.info(f"Building template image {tag}...")
+        dockerfile = io.BytesIO(_template_dockerfile(template).encode())
+        try:
+            with docker_call('images.build'):
+                for chunk in client.api.build(fileobj=dockerfile, tag=tag, rm=True, forcerm=True, decode=True):
+                    if 'error' in chunk:
+                        raise BuildError(chunk['error'], [])
+                    line = chunk.get('stream', '').strip()
+                    if line and progress:
+                        progress(line)
+        except (APIError, BuildError) as e:
+            logger.error(f"Failed to build template image {tag}: {e}")
+            raise Exception(f"Failed to build template image for {template}: {e}")
+
+    logger.info(f"Template image {tag} built.")
+    _remove_stale_template_images(template, tag)
+    return tag
+
+
+def _remove_stale_template_images(template, current_tag):
+    """Drop tags from earlier template definitions; images still used by containers are kept."""
+    repository = current_tag.rsplit(':', 1)[0]
+    try:
+        for image in client.images.list(name=repository):
+            for tag in image.tags:
+                if tag != current_tag:
+                    try:
+                        client.images.remove(tag, noprune=False)
+                        invalidate_image(tag)
+                        logger.info(f"Removed stale template image {tag}.")
+                    except APIError as e:
+                        logger.info(f"Keeping stale template image {tag}: {e}")
+    except APIError as e:
+        logger.warning(f"Could not list template images for {template}: {e}")
+
+
+def ensure_template_image_async(template):
+    """Start a background build of a template image unless one is already running in this worker."""
+    with _build_lock:
+        if template in _builds_in_progress:
+            return
+        _builds_in_progress.add(template)
+
+    def _build():
+        try:
+            build_template_image(template)
+        except Exception as e:
+            logger.error(f"Background build of template image for {template} failed: {e}")
+        finally:
+            with _build_lock:
+                _builds_in_progress.discard(template)
+
+    threading.Thread(target=_build, name=f"sbpanel-build-{template}", daemon=True).start()
+
+
+def get_image_for_template(template):
+    """
+    Pick the image to create a container from.
+
+    Returns:
+        tuple: (image name, prebuilt). If the template image isn't built yet, a build
+        is started in the background and the plain base image is returned, so the
+        caller falls back to installing packages at provisioning time.
+    """
+    if template not in TEMPLATES:
+        return BASE_IMAGE, False
+    try:
+        if template_image_exists(template):
+            return template_image_tag(template), True
+    except APIError as e:
+        logger.warning(f"Could not check template image for {template}: {e}")
+        return BASE_IMAGE, False
+
+    ensure_template_image_async(template)
+    return BASE_IMAGE, False
+
+
+def prepull_images():
+    """Pull the base image and any PREPULL_IMAGES, then build missing template images."""
+    for image_name in [BASE_IMAGE] + PREPULL_IMAGES:
+        try:
+            ensure_image(image_name)
+        except Exception as e:
+            logger.error(f"Pre-pull of {image_name} failed: {e}")
+    for template in TEMPLATES:
+        try:
+            build_template_image(template)
+        except Exception as e:
+            logger.error(f"Pre-build of template image for {template} failed: {e}")
+
+
+def start_image_prepull():
+    """Warm the local image store in the background; only one worker per host does this."""
+    if client is None or not try_become_leader("image-prepull"):
+        return
+    threading.Thread(target=prepull_images, name="sbpanel-image-prepull", daemon=True).start()
@@ -0,0 +1,353 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func
+from .locks import try_become_leader
+from .openmetrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Jobs run at once on this host. Only the worker process holding the job-queue
+# leadership runs them, so this is a host-wide limit, not a per-gunicorn-worker one.
+JOB_WORKERS = int(os.environ.get("SBPANEL_JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.environ.get("SBPANEL_JOB_POLL_INTERVAL", "2"))
+# A running job whose lease isn't renewed for this long is assumed lost and requeued.
+JOB_LEASE_SECONDS = int(os.environ.get("SBPANEL_JOB_LEASE_SECONDS", "300"))
+JOB_RETRY_DELAY = int(os.environ.get("SBPANEL_JOB_RETRY_DELAY", "30"))
+# Progress lines arrive far faster than they are worth writing to the database.
+PROGRESS_WRITE_INTERVAL = 1.0
+LEADER_RETRY_INTERVAL = 15
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_handlers = {}
+_dispatcher = None
+
+jobs_finished = registry.counter('sbpanel_job_runs', 'Job runs finished, by kind and outcome', ('kind', 'outcome'))
+
+
+class JobHandler:
+    def __init__(self, kind, steps, on_failure=None, max_attempts=3, secret_keys=()):
+        self.kind = kind
+        self.steps = steps
+        self.on_failure = on_failure
+        self.max_attempts = max_attempts
+        self.secret_keys = tuple(secret_keys)
+
+
+class JobContext:
+    """
+    What a job step gets to work with.
+
+    `state` is saved after every completed step, so values a later step needs (and
+    that would be lost if the process restarted between steps) belong there.
+    """
+
+    def __init__(self, job_id, user_id, payload, state, record_progress):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.payload = payload
+        self.state = state
+        self._record_progress = record_progress
+
+    def progress(self, line):
+        self._record_progress(line)
+
+
+def register_job(kind, steps, on_failure=None, max_attempts=3, secret_keys=()):
+    """
+    Register the steps for a kind of job.
+
+    Args:
+        kind: Job kind, e.g. 'container.provision'
+        steps: List of (name, fn) run in order; fn takes a JobContext. A step that
+            completed is skipped when a retried or resumed job runs again.
+        on_failure: Optional fn(JobContext, error message) called once the job has
+            used up its attempts
+        max_attempts: Runs before the job is marked failed
+        secret_keys: Payload keys (e.g. passwords) removed from the stored payload
+            once the job has succeeded or failed for good
+    """
+    _handlers[kind] = JobHandler(kind, steps, on_failure, max_attempts, secret_keys)
+
+
+def enqueue_job(kind, payload, user_id=None, resource=None):
+    """
+    Add a job to the queue. Commits the current session.
+
+    Returns:
+        Job: The queued job
+    """
+    from app import db
+    from models import Job
+    handler = _handlers.get(kind)
+    if handler is None:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job(
+        kind=kind,
+        resource=resource,
+        user_id=user_id,
+        payload=json.dumps(payload),
+        state=json.dumps({}),
+        status='queued',
+        max_attempts=handler.max_attempts,
+        run_after=datetime.utcnow(),
+    )
+    db.session.add(job)
+    db.session.commit()
+    if _dispatcher is not None:
+        _dispatcher.wake()
+    logger.info(f"Queued job {job.id} ({kind}) for {resource or 'no resource'}.")
+    return job
+
+
+def latest_job(resource):
+    """Most recent job for a resource, or None."""
+    from models import Job
+    return Job.query.filter_by(resource=resource).order_by(Job.id.desc()).first()
+
+
+def active_jobs(user_id, kinds=None):
+    """Queued and running jobs for a user, plus failures from the last day."""
+    from models import Job
+    query = Job.query.filter(Job.user_id == user_id)
+    if kinds:
+        query = query.filter(Job.kind.in_(kinds))
+    recent_failure = (Job.status == 'failed') & (Job.finished_at >= datetime.utcnow() - timedelta(days=1))
+    return query.filter(Job.status.in_(['queued', 'running']) | recent_failure).order_by(Job.id).all()
+
+
+def job_queue_metrics():
+    """Queued and running jobs by kind, as an OpenMetrics gauge family (one grouped query)."""
+    from app import db
+    from models import Job
+    rows = db.session.execute(
+        select(Job.kind, Job.status, func.count()).where(Job.status.in_(['queued', 'running']))
+        .group_by(Job.kind, Job.status)
+    ).all()
+    counts = {(kind, status): count for kind, status, count in rows}
+    # Report zero for every known kind so the series don't vanish when the queue drains.
+    for kind in _handlers:
+        for status in ('queued', 'running'):
+            counts.setdefault((kind, status), 0)
+    samples = [({'kind': kind, 'status': status}, count) for (kind, status), count in sorted(counts.items())]
+    return [('sbpanel_jobs', 'gauge', 'Jobs queued or running, by kind and status', samples)]
+
+
+def _update_job(job_id, **values):
+    # Job bookkeeping goes through its own connection so it never commits (or is rolled
+    # back with) whatever the step has pending in db.session.
+    from app import db
+    from models import Job
+    with db.engine.begin() as conn:
+        conn.execute(update(Job.__table__).where(Job.__table__.c.id == job_id).values(**values))
+
+
+def _scrub_secrets(job_id, handler, payload):
+    if not any(key in payload for key in handler.secret_keys):
+        return
+    scrubbed = {key: value for key, value in payload.items() if key not in handler.secret_keys}
+    try:
+        _update_job(job_id, payload=json.dumps(scrubbed))
+    except Exception as e:
+        logger.error(f"Could not remove secrets from the payload of job {job_id}: {e}")
+
+
+class _ProgressRecorder:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._last_write = 0.0
+
+    def __call__(self, line):
+        now = time.monotonic()
+        if now - self._last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        self._last_write = now
+        try:
+            _update_job(self.job_id, progress=line[:255], locked_at=datetime.utcnow())
+        except Exception as e:
+            logger.warning(f"Could not record progress for job {self.job_id}: {e}")
+
+
+def _run_job(app, job_id):
+    from app import db
+    from models import Job
+    with app.app_context():
+        with db.engine.connect() as conn:
+            row = conn.execute(select(Job.__table__).where(Job.__table__.c.id == job_id)).mappings().first()
+        if row is None:
+            return
+        handler = _handlers.get(row['kind'])
+        if handler is None:
+            logger.error(f"Job {job_id} has unknown kind {row['kind']}.")
+            _update_job(job_id, status='failed', error=f"Unknown job kind: {row['kind']}",
+                        finished_at=datetime.utcnow(), locked_by=None)
+            return
+
+        state = json.loads(row['state'] or '{}')
+        completed = state.setdefault('completed_steps', [])
+        ctx = JobContext(job_id, row['user_id'], json.loads(row['payload'] or '{}'), state, _ProgressRecorder(job_id))
+        attempts = (row['attempts'] or 0) + 1
+        _update_job(job_id, attempts=attempts)
+        logger.info(f"Running job {job_id} ({row['kind']}), attempt {attempts}/{row['max_attempts']}.")
+
+        try:
+            for name, fn in handler.steps:
+                if name in completed:
+                    continue
+                _update_job(job_id, step=name, progress=None, locked_at=datetime.utcnow())
+                fn(ctx)
+                completed.append(name)
+                _update_job(job_id, state=json.dumps(state))
+            _update_job(job_id, status='succeeded', step=None, progress=None, error=None,
+                        finished_at=datetime.utcnow(), locked_by=None)
+            jobs_finished.inc(kind=row['kind'], outcome='succeeded')
+            logger.info(f"Job {job_id} ({row['kind']}) succeeded.")
+            _scrub_secrets(job_id, handler, ctx.payload)
+        except Exception as e:
+            db.session.rollback()
+            error = str(e)
+            if attempts < (row['max_attempts'] or 1):
+                retry_at = datetime.utcnow() + timedelta(seconds=JOB_RETRY_DELAY * 2 ** (attempts - 1))
+                logger.warning(f"Job {job_id} ({row['kind']}) failed, retrying at {retry_at}: {error}")
+                _update_job(job_id, status='queued', error=error, run_after=retry_at, locked_by=None)
+                jobs_finished.inc(kind=row['kind'], outcome='retried')
+            else:
+                logger.error(f"Job {job_id} ({row['kind']}) failed after {attempts} attempts: {error}")
+                _update_job(job_id, status='failed', error=error, finished_at=datetime.utcnow(), locked_by=None)
+                jobs_finished.inc(kind=row['kind'], outcome='failed')
+                if handler.on_failure:
+                    try:
+                        handler.on_failure(ctx, error)
+                    except Exception as hook_error:
+                        db.session.rollback()
+                        logger.error(f"Failure handler for job {job_id} raised: {hook_error}")
+                _scrub_secrets(job_id, handler, ctx.payload)
+
+
+class _JobDispatcher:
+    """Claims queued jobs and runs them on a bounded thread pool while this process is the leader."""
+
+    def __init__(self, app):
+        self.app = app
+        self._wake = threading.Event()
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._executor = None
+        self._last_heartbeat = 0.0
+
+    def start(self):
+        threading.Thread(target=self._loop, name="sbpanel-job-dispatcher", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            if self._executor is None and try_become_leader("job-queue"):
+                self._executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="sbpanel-job")
+                logger.info(f"Job queue running in {WORKER_ID} with {JOB_WORKERS} workers.")
+                try:
+                    with self.app.app_context():
+                        self._recover_local()
+                except Exception as e:
+                    logger.error(f"Could not recover jobs from the previous job queue leader: {e}")
+            if self._executor is not None:
+                try:
+                    with self.app.app_context():
+                        self._heartbeat()
+                        self._requeue_expired()
+                        self._dispatch()
+                except Exception as e:
+                    logger.error(f"Job dispatcher error: {e}")
+            self._wake.wait(JOB_POLL_INTERVAL if self._executor is not None else LEADER_RETRY_INTERVAL)
+            self._wake.clear()
+
+    def _heartbeat(self):
+        now = time.monotonic()
+        if now - self._last_heartbeat < JOB_LEASE_SECONDS / 3:
+            return
+        self._last_heartbeat = now
+        from app import db
+        from models import Job
+        jobs = Job.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(jobs).where(jobs.c.status == 'running', jobs.c.locked_by == WORKER_ID)
+                         .values(locked_at=datetime.utcnow()))
+
+    def _recover_local(self):
+        # Only the leader runs jobs, so running jobs locked by another process on this
+        # host were orphaned when it exited; no need to wait for their lease to expire.
+        from app import db
+        from models import Job
+        jobs = Job.__table__
+        host_prefix = f"{socket.gethostname()}:"
+        with db.engine.begin() as conn:
+            result = conn.execute(update(jobs).where(jobs.c.status == 'running', jobs.c.locked_by.startswith(host_prefix),
+                                                     jobs.c.locked_by != WORKER_ID)
+                                  .values(status='queued', locked_by=None, run_after=datetime.utcnow()))
+        if result.rowcount:
+            logger.info(f"Resuming {result.rowcount} job(s) interrupted by a restart.")
+
+    def _requeue_expired(self):
+        # Jobs whose worker died (restart, crash) stop renewing their lease; they
+        # resume from their first unfinished step.
+        from app import db
+        from models import Job
+        jobs = Job.__table__
+        expired = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS)
+        with db.engine.begin() as conn:
+            result = conn.execute(update(jobs).where(jobs.c.status == 'running', jobs.c.locked_at < expired)
+                                  .values(status='queued', locked_by=None, run_after=datetime.utcnow()))
+        if result.rowcount:
+            logger.warning(f"Requeued {result.rowcount} job(s) whose worker stopped responding.")
+
+    def _dispatch(self):
+        from app import db
+        from models import Job
+        jobs = Job.__table__
+        with self._running_lock:
+            free_slots = JOB_WORKERS - len(self._running)
+        if free_slots <= 0:
+            return
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            candidates = conn.execute(
+                select(jobs.c.id).where(jobs.c.status == 'queued', jobs.c.run_after <= now)
+                .order_by(jobs.c.id).limit(free_slots)
+            ).scalars().all()
+        for job_id in candidates:
+            # Compare-and-set so a job is claimed once even with several hosts polling.
+            with db.engine.begin() as conn:
+                claimed = conn.execute(
+                    update(jobs).where(jobs.c.id == job_id, jobs.c.status == 'queued')
+                    .values(status='running', locked_by=WORKER_ID, locked_at=datetime.utcnow())
+                ).rowcount
+            if claimed:
+                with self._running_lock:
+                    self._running.add(job_id)
+                self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        try:
+            _run_job(self.app, job_id)
+        except Exception as e:
+            logger.error(f"Job {job_id} crashed the runner: {e}")
+        finally:
+            with self._running_lock:
+                self._running.discard(job_id)
+            self.wake()
+
+
+def start_job_workers(app):
+    """Start this process's dispatcher; it runs jobs only while holding the host's job-queue leadership."""
+    global _dispatcher
+    if _dispatcher is not None or JOB_WORKERS <= 0:
+        return
+    _dispatcher = _JobDispatcher(app)
+    _dispatcher.start()
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from sqlalchemy import select
+from .metrics import get_container_metrics
+
+logger = logging.getLogger(__name__)
+
+# How often connected users' state is rebuilt and changes are pushed.
+PUSH_INTERVAL = float(os.environ.get("SBPANEL_PUSH_INTERVAL", "2"))
+# Every open stream holds one of the worker's gthread threads (32 per worker, see
+# .replit) for its whole life. At most MAX_STREAMS are open per worker, which leaves
+# the rest for ordinary requests; past that /dashboard/events answers 503 and the
+# page polls /dashboard/stats instead. Streams are closed after STREAM_MAX_SECONDS
+# and the browser reconnects (EventSource does so on its own), so threads turn over
+# and no tab holds one for long.
+MAX_STREAMS = int(os.environ.get("SBPANEL_PUSH_MAX_STREAMS", "12"))
+STREAM_MAX_SECONDS = int(os.environ.get("SBPANEL_PUSH_STREAM_SECONDS", "60"))
+KEEPALIVE_INTERVAL = 15
+# Messages buffered for a client that isn't reading; past this it is disconnected.
+SUBSCRIBER_QUEUE_SIZE = 50
+RECONNECT_DELAY_MS = 2000
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+class Subscription:
+    def __init__(self, user_id, is_admin):
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.needs_snapshot = True
+        self.closed = False
+
+    def send(self, event, data):
+        try:
+            self.queue.put_nowait((event, data))
+        except queue.Full:
+            logger.info(f"Dropping live update stream for user {self.user_id}: client isn't keeping up.")
+            self.closed = True
+
+
+def _diff(previous, current):
+    """Entries of `current` that are new or changed, and keys that are gone."""
+    changed = {key: value for key, value in current.items() if previous.get(key) != value}
+    removed = [key for key in previous if key not in current]
+    return changed, removed
+
+
+class StatusPublisher:
+    """
+    Builds every connected user's container, service and job state once per
+    PUSH_INTERVAL and pushes what changed to each of their streams.
+
+    One publisher runs per worker process. Its queries cover all connected users at
+    once, so the database work per tick is the same for one tab or a thousand.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._last_state = {}  # user id -> state last pushed
+
+    def start(self):
+        threading.Thread(target=self._loop, name="sbpanel-live-updates", daemon=True).start()
+
+    def subscribe(self, user_id, is_admin=False):
+        """
+        Returns:
+            Subscription: Or None if this worker already has MAX_STREAMS open
+        """
+        subscription = Subscription(user_id, is_admin)
+        with self._lock:
+            if len(self._subscriptions) >= MAX_STREAMS:
+                return None
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _loop(self):
+        while True:
+            time.sleep(PUSH_INTERVAL)
+            with self._lock:
+                subscriptions = [s for s in self._subscriptions if not s.closed]
+            if not subscriptions:
+                continue
+            try:
+                with self.app.app_context():
+                    self.publish(subscriptions)
+            except Exception as e:
+                logger.error(f"Live update publisher error: {e}")
+
+    def publish(self, subscriptions):
+        user_ids = {s.user_id for s in subscriptions}
+        states = build_user_states(user_ids)
+        if any(s.is_admin for s in subscriptions):
+            from .monitoring import get_system_stats
+            system = get_system_stats()
+            for s in subscriptions:
+                if s.is_admin:
+                    states[s.user_id]['system'] = system
+
+        for user_id in set(self._last_state) - user_ids:
+            del self._last_state[user_id]
+        deltas = {}
+        for user_id, state in states.items():
+            previous = self._last_state.get(user_id)
+            if previous is not None:
+                deltas[user_id] = _state_delta(previous, state)
+            self._last_state[user_id] = state
+
+        for s in subscriptions:
+            state = states.get(s.user_id)
+            if state is None:
+                continue
+            if s.needs_snapshot:
+                s.needs_snapshot = False
+                s.send('snapshot', state)
+            elif deltas.get(s.user_id):
+                s.send('delta', deltas[s.user_id])
+
+
+def _state_delta(previous, current):
+    delta = {}
+    removed = {}
+    for section in ('container_stats', 'services', 'jobs'):
+        changed, gone = _diff(previous.get(section, {}), current.get(section, {}))
+        if changed:
+            delta[section] = changed
+        if gone:
+            removed[section] = gone
+    if removed:
+        delta['removed'] = removed
+    for section in ('resources', 'system'):
+        if section in current and previous.get(section) != current[section]:
+            delta[section] = current[section]
+    return delta
+
+
+def container_stats(container, metrics):
+    """
+    Usage and status figures for one container as the dashboard shows them.
+
+    Args:
+        container: A Container, or a row with its status, cpu_allocated and memory_allocated
+        metrics: From get_container_metrics(), or None if there's no recent sample
+    """
+    cpu_cores = metrics['cpu_cores'] if metrics else 0.0
+    return {
+        'cpu_cores': cpu_cores,
+        # Percent of the container's own CPU allocation
+        'cpu_percent': min(cpu_cores / container.cpu_allocated * 100, 100) if container.cpu_allocated else 0,
+        'memory_used': metrics['memory_used'] if metrics else 0,
+        'memory_limit': metrics['memory_limit'] if metrics else container.memory_allocated * 1024 * 1024,
+        'net_rx_rate': metrics['net_rx_rate'] if metrics else 0,
+        'net_tx_rate': metrics['net_tx_rate'] if metrics else 0,
+        'block_read_rate': metrics['block_read_rate'] if metrics else 0,
+        'block_write_rate': metrics['block_write_rate'] if metrics else 0,
+        'status': container.status,
+    }
+
+
+def build_user_states(user_ids):
+    """
+    Current state for several users, with one query per table for all of them.
+
+    Container figures have the same shape as /dashboard/stats; the metrics themselves
+    come from the collector's shared snapshot.
+
+    Returns:
+        dict: user id -> {container_stats, services, jobs, resources}
+    """
+    from app import db
+    from models import User, Container, Service, Job
+    user_ids = list(user_ids)
+    states = {}
+    users = db.session.execute(
+        select(User.id, User.cpu_limit, User.memory_limit, User.disk_limit).where(User.id.in_(user_ids))).all()
+    for user in users:
+        states[user.id] = {
+            'container_stats': {}, 'services': {}, 'jobs': {},
+            'resources': {
+                'cpu': {'used': 0.0, 'limit': user.cpu_limit},
+                'memory': {'used': 0, 'limit': user.memory_limit * 1024 * 1024},
+                'disk': {'used': 0, 'limit': user.disk_limit * 1024 * 1024},
+            },
+        }
+
+    containers = db.session.execute(
+        select(Container.id, Container.user_id, Container.container_id, Container.status,
+               Container.cpu_allocated, Container.memory_allocated, Container.disk_allocated)
+        .where(Container.user_id.in_(user_ids))).all()
+    for container in containers:
+        state = states.get(container.user_id)
+        if state is None:
+            continue
+        metrics = get_container_metrics(container.container_id)
+        state['container_stats'][str(container.id)] = container_stats(container, metrics)
+        resources = state['resources']
+        resources['cpu']['used'] = round(resources['cpu']['used'] + (metrics['cpu_cores'] if metrics else 0.0), 2)
+        resources['memory']['used'] += metrics['memory_used'] if metrics else 0
+        resources['disk']['used'] += container.disk_allocated * 1024 * 1024
+
+    services = db.session.execute(
+        select(Service.id, Service.status, Container.user_id)
+        .join(Container, Service.container_id == Container.id)
+        .where(Container.user_id.in_(user_ids))).all()
+    for service in services:
+        if service.user_id in states:
+            states[service.user_id]['services'][str(service.id)] = {'status': service.status}
+
+    jobs = db.session.execute(
+        select(Job.id, Job.user_id, Job.kind, Job.resource, Job.status, Job.step, Job.progress)
+        .where(Job.user_id.in_(user_ids), Job.status.in_(['queued', 'running']))).all()
+    for job in jobs:
+        if job.user_id in states:
+            states[job.user_id]['jobs'][str(job.id)] = {
+                'kind': job.kind, 'resource': job.resource, 'status': job.status,
+                'step': job.step, 'progress': job.progress,
+            }
+    return states
+
+
+def get_publisher(app):
+    """This process's publisher, started on first use."""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = StatusPublisher(app)
+            _publisher.start()
+        return _publisher
+
+
+def event_stream(publisher, subscription):
+    """Yield a subscription's updates as Server-Sent Events until STREAM_MAX_SECONDS pass."""
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    try:
+        yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+        while not subscription.closed and time.monotonic() < deadline:
+            try:
+                event, data = subscription.queue.get(timeout=KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    finally:
+        publisher.unsubscribe(subscription)
@@ -0,0 +1,55 @@
+import os
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Lock files live on the local filesystem, so these locks coordinate the gunicorn
+# workers of one host; they don't span multiple panel hosts.
+LOCK_DIR = os.environ.get("SBPANEL_LOCK_DIR", os.path.join(tempfile.gettempdir(), "sbpanel-locks"))
+
+_leader_lock = threading.Lock()
+_leader_files = {}  # name -> open file holding the flock for this process's lifetime
+
+
+def _lock_path(name):
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    return os.path.join(LOCK_DIR, f"{name}.lock")
+
+
+@contextmanager
+def host_lock(name):
+    """Exclusive lock held across all worker processes (and threads) on this host."""
+    with open(_lock_path(name), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def try_become_leader(name):
+    """
+    Try to become the one process on this host that runs a background task.
+
+    The lock is never released explicitly; the OS drops it when the process exits, so
+    another worker can take over on its next attempt.
+
+    Returns:
+        bool: True if this process holds (or already held) the leadership
+    """
+    with _leader_lock:
+        if name in _leader_files:
+            return True
+        lock_file = open(_lock_path(f"leader-{name}"), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        _leader_files[name] = lock_file
+        logger.info(f"Process {os.getpid()} is now the leader for '{name}'.")
+        return True
@@ -0,0 +1,242 @@
+import os
+import gzip
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, text, and_, or_
+from .locks import host_lock, try_become_leader
+
+logger = logging.getLogger(__name__)
+
+# Activity log entries older than this move from the database to the archive; 0 keeps
+# everything in the database.
+RETENTION_DAYS = int(os.environ.get("SBPANEL_ACTIVITY_LOG_RETENTION_DAYS", "90"))
+RETENTION_INTERVAL = float(os.environ.get("SBPANEL_ACTIVITY_LOG_RETENTION_INTERVAL", "3600"))
+# Rows archived and deleted per transaction, with a pause between chunks so request
+# writes (and SQLite's single writer lock) are never held up for long.
+CHUNK_SIZE = int(os.environ.get("SBPANEL_ACTIVITY_LOG_CHUNK_SIZE", "2000"))
+CHUNK_PAUSE = 0.05
+# Defaults to activity_log_archive in the Flask instance folder.
+ARCHIVE_DIR = os.environ.get("SBPANEL_ACTIVITY_LOG_ARCHIVE_DIR")
+SEGMENT_SUFFIX = ".ndjson.gz"
+STATE_FILE = "state.json"
+
+_retention_started = False
+
+
+def _encode(row):
+    return {
+        'id': row.id,
+        'user_id': row.user_id,
+        'action': row.action,
+        'details': row.details,
+        'ip_address': row.ip_address,
+        'created_at': row.created_at.isoformat(),
+    }
+
+
+class LogArchive:
+    """
+    Archived activity log entries, as one gzipped NDJSON segment per day.
+
+    Segments are only ever appended to: each write adds a gzip member to the end of
+    the day's file, and gzip readers see the members as one stream. Entries are
+    written oldest first, and state.json records the newest (created_at, id) written
+    so far; entries up to it are skipped if a chunk is archived a second time (when
+    the delete after the write didn't commit).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"{day}{SEGMENT_SUFFIX}")
+
+    def watermark(self):
+        try:
+            with open(os.path.join(self.directory, STATE_FILE)) as f:
+                state = json.load(f)
+            return datetime.fromisoformat(state['created_at']), state['id']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _set_watermark(self, created_at, log_id):
+        path = os.path.join(self.directory, STATE_FILE)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump({'created_at': created_at.isoformat(), 'id': log_id}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def append(self, rows):
+        """Add rows (oldest first) to their days' segments, durably, before they are deleted."""
+        watermark = self.watermark()
+        if watermark is not None:
+            rows = [row for row in rows if (row.created_at, row.id) > watermark]
+        if not rows:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row.created_at.date().isoformat(), []).append(row)
+        for day, day_rows in by_day.items():
+            with open(self._path(day), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as segment:
+                    for row in day_rows:
+                        segment.write((json.dumps(_encode(row)) + "\n").encode())
+                raw.flush()
+                os.fsync(raw.fileno())
+        self._set_watermark(rows[-1].created_at, rows[-1].id)
+        return len(rows)
+
+    def days(self):
+        """
+        Returns:
+            list: (day as YYYY-MM-DD, compressed size in bytes), newest first
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        days = []
+        for name in names:
+            if name.endswith(SEGMENT_SUFFIX):
+                days.append((name[:-len(SEGMENT_SUFFIX)], os.path.getsize(os.path.join(self.directory, name))))
+        return sorted(days, reverse=True)
+
+    def read_day(self, day):
+        """
+        A day's archived entries, newest first, with created_at as a datetime.
+
+        Raises:
+            FileNotFoundError: If nothing was archived for that day
+        """
+        entries = []
+        with gzip.open(self._path(day), 'rt') as segment:
+            for line in segment:
+                entry = json.loads(line)
+                entry['created_at'] = datetime.fromisoformat(entry['created_at'])
+                entries.append(entry)
+        entries.sort(key=lambda e: (e['created_at'], e['id']), reverse=True)
+        return entries
+
+
+def get_archive():
+    from flask import current_app
+    return LogArchive(ARCHIVE_DIR or os.path.join(current_app.instance_path, "activity_log_archive"))
+
+
+def _archive_older_than(conn_factory, before, archive, delete_rows=True):
+    """Archive rows created before `before` oldest first, a chunk per transaction."""
+    from models import ActivityLog
+    columns = (ActivityLog.id, ActivityLog.user_id, ActivityLog.action, ActivityLog.details,
+               ActivityLog.ip_address, ActivityLog.created_at)
+    after = None
+    total = 0
+    while True:
+        with conn_factory() as conn:
+            query = select(*columns).where(ActivityLog.created_at < before)
+            if after is not None:
+                query = query.where(or_(ActivityLog.created_at > after[0],
+                                        and_(ActivityLog.created_at == after[0], ActivityLog.id > after[1])))
+            rows = conn.execute(query.order_by(ActivityLog.created_at, ActivityLog.id).limit(CHUNK_SIZE)).all()
+            if not rows:
+                return total
+            archive.append(rows)
+            if delete_rows:
+                conn.execute(delete(ActivityLog).where(ActivityLog.id.in_([row.id for row in rows]),
+                                                       ActivityLog.created_at < before))
+        total += len(rows)
+        after = (rows[-1].created_at, rows[-1].id)
+        time.sleep(CHUNK_PAUSE)
+
+
+def _drop_expired_partitions(engine, cutoff, archive):
+    # Whole months past retention are archived, then detached and dropped, which
+    # frees their space at once without deleting rows.
+    from .schema import activity_log_partitions, create_activity_log_partitions, month_start
+    with engine.begin() as conn:
+        partitions = activity_log_partitions(conn)
+        create_activity_log_partitions(conn, datetime.utcnow())
+    dropped = 0
+    for name, month in partitions:
+        month_end = month_start(month, 1)
+        if month_end > cutoff:
+            break
+        _archive_older_than(engine.begin, month_end, archive, delete_rows=False)
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE activity_logs DETACH PARTITION "{name}"'))
+            conn.execute(text(f'DROP TABLE "{name}"'))
+        logger.info(f"Archived and dropped activity log partition {name}.")
+        dropped += 1
+    return dropped
+
+
+def apply_retention(now=None):
+    """
+    Move activity log entries older than RETENTION_DAYS to the archive.
+
+    On a partitioned PostgreSQL table whole expired months are dropped; what is left
+    (and everything on SQLite) is deleted in chunks of CHUNK_SIZE rows.
+
+    Returns:
+        int: Entries archived
+    """
+    from app import db
+    if RETENTION_DAYS <= 0:
+        return 0
+    # Entries still queued in some worker's activity log writer are seconds old, far
+    # newer than the cutoff, so the archive can't miss them and no flush is needed.
+    cutoff = (now or datetime.utcnow()) - timedelta(days=RETENTION_DAYS)
+    archive = get_archive()
+    engine = db.engine
+    with host_lock("activity-log-archive"):
+        if engine.dialect.name == 'postgresql':
+            _drop_expired_partitions(engine, cutoff, archive)
+        archived = _archive_older_than(engine.begin, cutoff, archive)
+    if archived:
+        logger.info(f"Archived {archived} activity log entries older than {cutoff:%Y-%m-%d %H:%M}.")
+    return archived
+
+
+def delete_logs(max_id):
+    """
+    Delete activity log entries with ids up to max_id, CHUNK_SIZE rows per transaction.
+
+    Returns:
+        int: Entries deleted
+    """
+    from app import db
+    from models import ActivityLog
+    total = 0
+    while True:
+        with db.engine.begin() as conn:
+            ids = conn.execute(select(ActivityLog.id).where(ActivityLog.id <= max_id).limit(CHUNK_SIZE)).scalars().all()
+            if not ids:
+                return total
+            conn.execute(delete(ActivityLog).where(ActivityLog.id.in_(ids)))
+        total += len(ids)
+        time.sleep(CHUNK_PAUSE)
+
+
+def _apply_retention_periodically(app):
+    while True:
+        try:
+            with app.app_context():
+                apply_retention()
+        except Exception as e:
+            logger.error(f"Activity log retention failed: {e}")
+        time.sleep(RETENTION_INTERVAL)
+
+
+def start_log_retention(app):
+    """Archive expired activity log entries every RETENTION_INTERVAL (one worker per host does it)."""
+    global _retention_started
+    if _retention_started or RETENTION_DAYS <= 0 or not try_become_leader("activity-log-retention"):
+        return
+    _retention_started = True
+    threading.Thread(target=_apply_retention_periodically, args=(app,), name="sbpanel-log-retention",
+                     daemon=True).start()
+    logger.info(f"Activity log retention started ({RETENTION_DAYS} days).")
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from .docker_client import client as docker_client
+from .async_docker import get_async_client, submit
+from .locks import try_become_leader
+from .timeseries import TimeSeriesStore
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.environ.get("SBPANEL_METRICS_DIR", os.path.join(tempfile.gettempdir(), "sbpanel-metrics"))
+CONTAINER_SNAPSHOT_PATH = os.path.join(METRICS_DIR, "containers.json")
+# How often the running-container list is re-read to open and close stats streams.
+CONTAINER_SYNC_INTERVAL = float(os.environ.get("SBPANEL_METRICS_SYNC_INTERVAL", "5"))
+PUBLISH_INTERVAL = float(os.environ.get("SBPANEL_METRICS_PUBLISH_INTERVAL", "2"))
+# A sample older than this is from a stream that died; report no data rather than stale data.
+SAMPLE_MAX_AGE = 30
+SNAPSHOT_RECHECK_INTERVAL = 1.0
+
+CONTAINER_SERIES_METRICS = ['cpu_cores', 'memory_used', 'memory_percent', 'net_rx_rate', 'net_tx_rate',
+                            'block_read_rate', 'block_write_rate', 'pids']
+# History for charts, keyed by Docker container name
+container_series = TimeSeriesStore(os.path.join(METRICS_DIR, "series", "containers"), CONTAINER_SERIES_METRICS)
+
+
+def compute_container_metrics(sample, previous=None):
+    """
+    Turn one Docker stats sample into usage figures.
+
+    CPU comes from the sample's own cpu/precpu pair. Network and block I/O are
+    cumulative counters, so their rates need the previous result from the same stream.
+
+    Returns:
+        dict: cpu_cores (cores busy), memory, network and block I/O totals and per-second rates
+    """
+    cpu = sample.get('cpu_stats') or {}
+    precpu = sample.get('precpu_stats') or {}
+    cpu_delta = (cpu.get('cpu_usage') or {}).get('total_usage', 0) - (precpu.get('cpu_usage') or {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    online_cpus = cpu.get('online_cpus') or len((cpu.get('cpu_usage') or {}).get('percpu_usage') or []) or 1
+    cpu_cores = cpu_delta / system_delta * online_cpus if cpu_delta > 0 and system_delta > 0 else 0.0
+
+    memory = sample.get('memory_stats') or {}
+    memory_stats = memory.get('stats') or {}
+    # Same as `docker stats`: page cache the kernel can drop doesn't count as used.
+    reclaimable = memory_stats.get('inactive_file', memory_stats.get('total_inactive_file', memory_stats.get('cache', 0)))
+    memory_used = max(memory.get('usage', 0) - reclaimable, 0)
+    memory_limit = memory.get('limit', 0)
+
+    networks = (sample.get('networks') or {}).values()
+    block_io = (sample.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []
+
+    now = time.time()
+    metrics = {
+        'timestamp': now,
+        'cpu_cores': round(cpu_cores, 4),
+        'memory_used': memory_used,
+        'memory_limit': memory_limit,
+        'memory_percent': round(memory_used / memory_limit * 100, 2) if memory_limit else 0.0,
+        'net_rx_bytes': sum(n.get('rx_bytes', 0) for n in networks),
+        'net_tx_bytes': sum(n.get('tx_bytes', 0) for n in networks),
+        'block_read_bytes': sum(e.get('value', 0) for e in block_io if (e.get('op') or '').lower() == 'read'),
+        'block_write_bytes': sum(e.get('value', 0) for e in block_io if (e.get('op') or '').lower() == 'write'),
+        'pids': (sample.get('pids_stats') or {}).get('current', 0),
+    }
+    elapsed = now - previous['timestamp'] if previous else 0
+    for counter in ('net_rx', 'net_tx', 'block_read', 'block_write'):
+        if elapsed > 0:
+            delta = metrics[f'{counter}_bytes'] - previous[f'{counter}_bytes']
+            # Counters reset when a container restarts.
+            metrics[f'{counter}_rate'] = round(max(delta, 0) / elapsed, 1)
+        else:
+            metrics[f'{counter}_rate'] = 0.0
+    return metrics
+
+
+class ContainerMetricsCollector:
+    """Keeps one Docker stats stream open per running container and the latest figures for each."""
+
+    def __init__(self):
+        self.latest = {}  # container name -> metrics dict
+        self._streams = {}  # container name -> asyncio.Task
+        self._recorded = {}  # container name -> timestamp of the last sample written to history
+
+    async def run(self):
+        client = get_async_client()
+        publisher = asyncio.ensure_future(self._publish_periodically())
+        try:
+            while True:
+                try:
+                    running = await client.list_containers(filters={'status': ['running']})
+                    names = {name.lstrip('/') for entry in running for name in (entry.get('Names') or [])[:1]}
+                    for name in names - set(self._streams):
+                        self._streams[name] = asyncio.ensure_future(self._follow(client, name))
+                    for name in set(self._streams) - names:
+                        self._streams.pop(name).cancel()
+                        self.latest.pop(name, None)
+                except Exception as e:
+                    logger.error(f"Could not list running containers for metrics: {e}")
+                await asyncio.sleep(CONTAINER_SYNC_INTERVAL)
+        finally:
+            publisher.cancel()
+
+    async def _follow(self, client, name):
+        previous = None
+        try:
+            async for sample in client.stats(name, stream=True):
+                previous = compute_container_metrics(sample, previous)
+                self.latest[name] = previous
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Stats stream for {name} ended: {e}")
+        # The next sync reopens the stream if the container is still running.
+        self._streams.pop(name, None)
+
+    async def _publish_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(PUBLISH_INTERVAL)
+            try:
+                latest = dict(self.latest)
+                await loop.run_in_executor(None, _write_snapshot, latest)
+                await loop.run_in_executor(None, self._record_history, latest)
+            except Exception as e:
+                logger.error(f"Could not publish container metrics: {e}")
+
+    def _record_history(self, latest):
+        for name, metrics in latest.items():
+            if self._recorded.get(name) == metrics['timestamp']:
+                continue  # Stream stalled; don't count the same sample twice
+            self._recorded[name] = metrics['timestamp']
+            container_series.record(name, metrics['timestamp'], metrics)
+        for name in set(self._recorded) - set(latest):
+            del self._recorded[name]
+
+
+def _write_snapshot(latest):
+    # Other gunicorn workers read this file; replace it atomically so they never see half a write.
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    tmp_path = f"{CONTAINER_SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(latest, f)
+    os.replace(tmp_path, CONTAINER_SNAPSHOT_PATH)
+
+
+_collector = None
+_snapshot_lock = threading.Lock()
+_snapshot = {'checked_at': 0.0, 'mtime': None, 'data': {}}
+
+
+def _load_snapshot():
+    if _collector is not None:
+        return _collector.latest
+    now = time.monotonic()
+    with _snapshot_lock:
+        if now - _snapshot['checked_at'] < SNAPSHOT_RECHECK_INTERVAL:
+            return _snapshot['data']
+        _snapshot['checked_at'] = now
+        try:
+            mtime = os.stat(CONTAINER_SNAPSHOT_PATH).st_mtime_ns
+        except OSError:
+            _snapshot['data'] = {}
+            return _snapshot['data']
+        if mtime != _snapshot['mtime']:
+            try:
+                with open(CONTAINER_SNAPSHOT_PATH) as f:
+                    _snapshot['data'] = json.load(f)
+                _snapshot['mtime'] = mtime
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read container metrics snapshot: {e}")
+        return _snapshot['data']
+
+
+def get_container_metrics(container_name):
+    """
+    Latest usage figures for a container, from memory; never calls the Docker daemon.
+
+    Returns:
+        dict or None: See compute_container_metrics; None if there's no recent sample
+    """
+    metrics = _load_snapshot().get(container_name)
+    if metrics is None or time.time() - metrics['timestamp'] > SAMPLE_MAX_AGE:
+        return None
+    return metrics
+
+
+def get_container_history(container_name, metric, seconds, resolution=None):
+    """
+    Recorded history of one metric for a container, for charts.
+
+    Returns:
+        dict: resolution (seconds per point) and points as [timestamp, average, maximum]
+    """
+    end = time.time()
+    used_resolution, points = container_series.query(container_name, metric, end - seconds, end, resolution)
+    return {'metric': metric, 'resolution': used_resolution, 'points': [list(point) for point in points]}
+
+
+def start_metrics_collector():
+    """Start collecting on the async Docker bridge; only one worker per host runs it, the others read its snapshot."""
+    global _collector
+    if _collector is not None or docker_client is None or not try_become_leader("container-metrics"):
+        return
+    _collector = ContainerMetricsCollector()
+    submit(_collector.run())
+    logger.info("Container metrics collector started.")
@@ -1,33 +1,151 @@
 import logging
 import os
+import mmap
+import time
+import struct
 import platform
+import threading
 import psutil
 from datetime import datetime
+from flask import g, has_request_context
+from sqlalchemy import select, func, case, true
+from sqlalchemy.orm import joinedload, selectinload, load_only
+from app import db
 from models import User, Container, Website, Database, Service
+from .metrics import get_container_metrics, METRICS_DIR
+from .timeseries import TimeSeriesStore
+from .locks import try_become_leader
+from .counters import get_counters
 
 logger = logging.getLogger(__name__)
 
+HOST_SAMPLE_INTERVAL = float(os.environ.get("SBPANEL_HOST_SAMPLE_INTERVAL", "5"))
+HOST_SNAPSHOT_PATH = os.path.join(METRICS_DIR, "host.snapshot")
+
+# Sequence counter, then the sampled values. The sampler bumps the counter to odd
+# before writing and back to even after, so a reader that sees an odd or changed
+# counter knows it raced a write and reads again (a seqlock).
+_HOST_FIELDS = ('timestamp', 'cpu_usage', 'memory_total', 'memory_used', 'memory_percent',
+                'disk_total', 'disk_used', 'disk_percent', 'boot_time', 'load_1', 'load_5', 'load_15')
+_HOST_STRUCT = struct.Struct('<Q' + 'd' * len(_HOST_FIELDS))
+# Past this age the sampler has stopped; sample directly rather than serve stale figures.
+HOST_SNAPSHOT_MAX_AGE = HOST_SAMPLE_INTERVAL * 3
+
+HOST_SERIES_METRICS = ['cpu_usage', 'memory_used', 'memory_percent', 'disk_used', 'disk_percent', 'load_1']
+host_series = TimeSeriesStore(os.path.join(METRICS_DIR, "series", "host"), HOST_SERIES_METRICS)
+
+_OS_INFO = f"{platform.system()} {platform.release()}"
+
+
+def _sample_host():
+    # cpu_percent(interval=None) compares against the previous call instead of sleeping.
+    memory = psutil.virtual_memory()
+    disk = psutil.disk_usage('/')
+    load = os.getloadavg() if hasattr(os, 'getloadavg') else (0, 0, 0)
+    return {
+        'timestamp': time.time(),
+        'cpu_usage': psutil.cpu_percent(interval=None),
+        'memory_total': memory.total,
+        'memory_used': memory.used,
+        'memory_percent': memory.percent,
+        'disk_total': disk.total,
+        'disk_used': disk.used,
+        'disk_percent': disk.percent,
+        'boot_time': psutil.boot_time(),
+        'load_1': load[0],
+        'load_5': load[1],
+        'load_15': load[2],
+    }
+
+
+class HostStatsSampler:
+    """Samples the host every HOST_SAMPLE_INTERVAL and publishes it to an mmap file all workers read."""
+
+    def __init__(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        fd = os.open(HOST_SNAPSHOT_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != _HOST_STRUCT.size:
+                os.ftruncate(fd, _HOST_STRUCT.size)
+            self._mm = mmap.mmap(fd, _HOST_STRUCT.size, access=mmap.ACCESS_WRITE)
+        finally:
+            os.close(fd)
+        self._sequence = struct.unpack_from('<Q', self._mm, 0)[0] & ~1
+
+    def publish(self, sample):
+        self._sequence += 1
+        struct.pack_into('<Q', self._mm, 0, self._sequence)
+        _HOST_STRUCT.pack_into(self._mm, 0, self._sequence, *(float(sample[f]) for f in _HOST_FIELDS))
+        self._sequence += 1
+        struct.pack_into('<Q', self._mm, 0, self._sequence)
+
+    def run(self):
+        psutil.cpu_percent(interval=None)  # Prime the CPU counters; the first reading is meaningless
+        while True:
+            time.sleep(HOST_SAMPLE_INTERVAL)
+            try:
+                sample = _sample_host()
+                self.publish(sample)
+                host_series.record('host', sample['timestamp'], sample)
+            except Exception as e:
+                logger.error(f"Host stats sampling failed: {e}")
+
+
+_reader_lock = threading.Lock()
+_reader = {'mm': None, 'inode': None}
+
+
+def _read_host_snapshot():
+    with _reader_lock:
+        try:
+            inode = os.stat(HOST_SNAPSHOT_PATH).st_ino
+            if _reader['mm'] is None or _reader['inode'] != inode:
+                with open(HOST_SNAPSHOT_PATH, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size != _HOST_STRUCT.size:
+                        return None
+                    _reader['mm'] = mmap.mmap(f.fileno(), _HOST_STRUCT.size, access=mmap.ACCESS_READ)
+                _reader['inode'] = inode
+        except OSError:
+            return None
+        mm = _reader['mm']
+    for _ in range(10):
+        values = _HOST_STRUCT.unpack_from(mm, 0)
+        if values[0] % 2 == 0 and struct.unpack_from('<Q', mm, 0)[0] == values[0]:
+            return dict(zip(_HOST_FIELDS, values[1:]))
+    return None
+
+
+def _format_system_stats(sample):
+    return {
+        'cpu_usage': sample['cpu_usage'],
+        'memory_total': int(sample['memory_total']),
+        'memory_used': int(sample['memory_used']),
+        'memory_percent': sample['memory_percent'],
+        'disk_total': int(sample['disk_total']),
+        'disk_used': int(sample['disk_used']),
+        'disk_percent': sample['disk_percent'],
+        'uptime': int(time.time() - sample['boot_time']),
+        'os_info': _OS_INFO,
+        'load_avg': [sample['load_1'], sample['load_5'], sample['load_15']],
+        'sampled_at': sample['timestamp'],
+    }
+
+
 def get_system_stats():
     """
     Get system resource usage statistics
     
+    Reads the host sampler's shared snapshot, so it returns in microseconds and never
+    blocks; if no sampler is publishing, the host is sampled directly (without waiting).
+    
     Returns:
         dict: System stats including CPU, memory, and disk usage
     """
     try:
-        stats = {
-            'cpu_usage': psutil.cpu_percent(interval=0.1),
-            'memory_total': psutil.virtual_memory().total,
-            'memory_used': psutil.virtual_memory().used,
-            'memory_percent': psutil.virtual_memory().percent,
-            'disk_total': psutil.disk_usage('/').total,
-            'disk_used': psutil.disk_usage('/').used,
-            'disk_percent': psutil.disk_usage('/').percent,
-            'uptime': int((datetime.now() - datetime.fromtimestamp(psutil.boot_time())).total_seconds()),
-            'os_info': f"{platform.system()} {platform.release()}",
-            'load_avg': os.getloadavg() if hasattr(os, 'getloadavg') else [0, 0, 0]
-        }
-        return stats
+        sample = _read_host_snapshot()
+        if sample is None or time.time() - sample['timestamp'] > HOST_SNAPSHOT_MAX_AGE:
+            sample = _sample_host()
+        return _format_system_stats(sample)
     except Exception as e:
         logger.error(f"Error getting system stats: {str(e)}")
         # Return defaults if there's an error
@@ -44,61 +162,129 @@ def get_system_stats():
             'load_avg': [0, 0, 0]
         }
 
-def get_user_resources(user_id):
+
+def get_host_history(metric, seconds, resolution=None):
+    """Recorded host history for one metric; same shape as metrics.get_container_history."""
+    end = time.time()
+    used_resolution, points = host_series.query('host', metric, end - seconds, end, resolution)
+    return {'metric': metric, 'resolution': used_resolution, 'points': [list(point) for point in points]}
+
+
+def start_host_sampler():
+    """Start sampling in a background thread; only one worker per host samples, the others read its snapshot."""
+    if not try_become_leader("host-sampler"):
+        return
+    sampler = HostStatsSampler()
+    threading.Thread(target=sampler.run, name="sbpanel-host-sampler", daemon=True).start()
+    logger.info("Host stats sampler started.")
+
+def _query_resource_summary(user_id):
+    containers = Container.__table__
+    container_totals = select(
+        func.count(containers.c.id).label('container_count'),
+        func.coalesce(func.sum(case((containers.c.status == 'running', 1), else_=0)), 0).label('active_containers'),
+        func.coalesce(func.sum(containers.c.cpu_allocated), 0).label('total_cpu_allocated'),
+        func.coalesce(func.sum(containers.c.memory_allocated), 0).label('total_memory_allocated'),
+        func.coalesce(func.sum(containers.c.disk_allocated), 0).label('total_disk_allocated'),
+    ).where(containers.c.user_id == user_id).subquery()
+
+    website_count = select(func.count(Website.id)).where(Website.user_id == user_id).scalar_subquery()
+    database_count = select(func.count(Database.id)).where(Database.user_id == user_id).scalar_subquery()
+    service_count = select(func.count(Service.id)).join(Container, Service.container_id == Container.id)\
+        .where(Container.user_id == user_id).scalar_subquery()
+
+    statement = select(
+        User.cpu_limit, User.memory_limit, User.disk_limit,
+        container_totals,
+        website_count.label('website_count'),
+        database_count.label('database_count'),
+        service_count.label('service_count'),
+    ).select_from(User).join(container_totals, true()).where(User.id == user_id)
+    row = db.session.execute(statement).mappings().first()
+    return dict(row) if row else None
+
+
+def get_resource_summary(user_id):
+    """
+    All of a user's resource counts, allocation sums and limits, from one SQL statement.
+
+    The result is memoized for the rest of the request, so the several callers a page
+    has (dashboard counts, get_user_resources) share one round trip.
+
+    Returns:
+        dict or None: cpu/memory/disk limits, container_count, active_containers,
+        total_*_allocated, website_count, database_count and service_count; None for
+        an unknown user
+    """
+    if not has_request_context():
+        return _query_resource_summary(user_id)
+    memo = g.setdefault('_resource_summaries', {})
+    if user_id not in memo:
+        memo[user_id] = _query_resource_summary(user_id)
+    return memo[user_id]
+
+
+def get_user_resources(user_id, containers=None):
     """
     Get resource usage statistics for a specific user
     
     Args:
         user_id: User ID
+        containers: The user's Container rows, if the caller has already loaded them
         
     Returns:
         dict: User resource stats including containers, websites, etc.
     """
     try:
-        # Get counts of user resources
-        container_count = Container.query.filter_by(user_id=user_id).count()
-        website_count = Website.query.filter_by(user_id=user_id).count()
-        database_count = Database.query.filter_by(user_id=user_id).count()
-        
-        # Get container resource allocation and usage
-        containers = Container.query.filter_by(user_id=user_id).all()
-        
-        total_cpu_allocated = sum(c.cpu_allocated for c in containers)
-        total_memory_allocated = sum(c.memory_allocated for c in containers)
-        total_disk_allocated = sum(c.disk_allocated for c in containers)
+        summary = get_resource_summary(user_id)
         
-        # Since we don't have real-time container metrics, we'll estimate usage based on allocation
-        # In a real system, this would query the actual container resource usage
+        # Live usage from the metrics collector; disk isn't in Docker stats, so it stays allocation-based
+        if containers is None:
+            container_names = db.session.execute(
+                select(Container.container_id).where(Container.user_id == user_id)).scalars().all()
+        else:
+            container_names = [c.container_id for c in containers]
+        cpu_used = 0.0
+        memory_used = 0
+        for container_name in container_names:
+            metrics = get_container_metrics(container_name)
+            if metrics:
+                cpu_used += metrics['cpu_cores']
+                memory_used += metrics['memory_used']
         
         # Calculate resource percentages
-        user = User.query.get(user_id)
-        cpu_percent = (total_cpu_allocated / user.cpu_limit) * 100 if user.cpu_limit > 0 else 0
-        memory_percent = (total_memory_allocated / user.memory_limit) * 100 if user.memory_limit > 0 else 0
-        disk_percent = (total_disk_allocated / user.disk_limit) * 100 if user.disk_limit > 0 else 0
+        cpu_limit = summary['cpu_limit']
+        memory_limit = summary['memory_limit']
+        disk_limit = summary['disk_limit']
+        total_disk_allocated = summary['total_disk_allocated']
+        cpu_percent = (cpu_used / cpu_limit) * 100 if cpu_limit > 0 else 0
+        memory_percent = (memory_used / (memory_limit * 1024 * 1024)) * 100 if memory_limit > 0 else 0
+        disk_percent = (total_disk_allocated / disk_limit) * 100 if disk_limit > 0 else 0
         
         stats = {
-            'container_count': container_count,
-            'website_count': website_count,
-            'database_count': database_count,
-            'total_cpu_allocated': total_cpu_allocated,
-            'total_memory_allocated': total_memory_allocated,
+            'container_count': summary['container_count'],
+            'website_count': summary['website_count'],
+            'database_count': summary['database_count'],
+            'service_count': summary['service_count'],
+            'total_cpu_allocated': summary['total_cpu_allocated'],
+            'total_memory_allocated': summary['total_memory_allocated'],
             'total_disk_allocated': total_disk_allocated,
-            'active_containers': Container.query.filter_by(user_id=user_id, status='running').count(),
+            'active_containers': summary['active_containers'],
             
             # Format the resources to match the template's expected structure
             'cpu': {
-                'used': total_cpu_allocated,
-                'limit': user.cpu_limit,
+                'used': round(cpu_used, 2),
+                'limit': cpu_limit,
                 'percent': min(cpu_percent, 100)
             },
             'memory': {
-                'used': total_memory_allocated * 1024 * 1024,  # Convert MB to bytes for filesizeformat filter
-                'limit': user.memory_limit * 1024 * 1024,      # Convert MB to bytes for filesizeformat filter
+                'used': memory_used,  # Bytes, for the filesizeformat filter
+                'limit': memory_limit * 1024 * 1024,      # Convert MB to bytes for filesizeformat filter
                 'percent': min(memory_percent, 100)
             },
             'disk': {
                 'used': total_disk_allocated * 1024 * 1024,    # Convert MB to bytes for filesizeformat filter
-                'limit': user.disk_limit * 1024 * 1024,        # Convert MB to bytes for filesizeformat filter
+                'limit': disk_limit * 1024 * 1024,        # Convert MB to bytes for filesizeformat filter
                 'percent': min(disk_percent, 100)
             }
         }
@@ -110,6 +296,7 @@ def get_user_resources(user_id):
             'container_count': 0,
             'website_count': 0,
             'database_count': 0,
+            'service_count': 0,
             'total_cpu_allocated': 0,
             'total_memory_allocated': 0,
             'total_disk_allocated': 0,
@@ -131,39 +318,55 @@ def get_user_resources(user_id):
             }
         }
 
-def get_containers_status():
+# Fields get_containers_status() can return; 'username' and 'services' come from related rows.
+CONTAINER_STATUS_FIELDS = ('name', 'status', 'ip_address', 'template', 'created_at', 'username', 'services',
+                           'cpu_allocated', 'memory_allocated', 'disk_allocated')
+CONTAINER_STATUS_PAGE_SIZE = 500
+
+
+def get_containers_status(after_id=None, limit=CONTAINER_STATUS_PAGE_SIZE, fields=None):
     """
-    Get status of all containers in the system
+    Get status of containers in the system, a page at a time
     
+    Owners are joined into the container query and services are loaded with one
+    extra IN query per page, so the cost doesn't grow with the number of containers.
+    
+    Args:
+        after_id: Return containers with an id greater than this (keyset pagination;
+            pass the last id of the previous page)
+        limit: Page size, or None for every container
+        fields: Subset of CONTAINER_STATUS_FIELDS to load and return; all by default
+        
     Returns:
-        list: Container status information
+        list: Container status information, ordered by id; every entry has 'id'
     """
+    fields = CONTAINER_STATUS_FIELDS if fields is None else [f for f in CONTAINER_STATUS_FIELDS if f in fields]
+    columns = [getattr(Container, f) for f in fields if f not in ('username', 'services')]
     try:
-        containers = Container.query.all()
-        container_statuses = []
+        query = select(Container).options(load_only(Container.id, *columns)).order_by(Container.id)
+        if 'username' in fields:
+            query = query.options(joinedload(Container.user).load_only(User.username))
+        if 'services' in fields:
+            query = query.options(selectinload(Container.services).load_only(Service.name, Service.status))
+        if after_id is not None:
+            query = query.where(Container.id > after_id)
+        if limit is not None:
+            query = query.limit(limit)
+        containers = db.session.execute(query).scalars().all()
         
+        container_statuses = []
         for container in containers:
-            # Get services in this container
-            services = Service.query.filter_by(container_id=container.id).all()
-            service_statuses = [{'name': s.name, 'status': s.status} for s in services]
-            
-            # Get user information
-            user = User.query.get(container.user_id)
-            username = user.username if user else 'Unknown'
-            
-            container_statuses.append({
-                'id': container.id,
-                'name': container.name,
-                'status': container.status,
-                'ip_address': container.ip_address,
-                'template': container.template,
-                'created_at': container.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'username': username,
-                'services': service_statuses,
-                'cpu_allocated': container.cpu_allocated,
-                'memory_allocated': container.memory_allocated,
-                'disk_allocated': container.disk_allocated
-            })
+            status = {'id': container.id}
+            for field in fields:
+                if field == 'username':
+                    status['username'] = container.user.username if container.user else 'Unknown'
+                elif field == 'services':
+                    status['services'] = [{'name': s.name, 'status': s.status} for s in container.services]
+                elif field == 'created_at':
+                    status['created_at'] = container.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                else:
+                    status[field] = getattr(container, field)
+            container_statuses.append(status)
         
         return container_statuses
     except Exception as e:
@@ -178,16 +381,8 @@ def get_system_overview():
         dict: System overview statistics
     """
     try:
-        stats = {
-            'user_count': User.query.count(),
-            'active_user_count': User.query.filter_by(active=True).count(),
-            'container_count': Container.query.count(),
-            'running_container_count': Container.query.filter_by(status='running').count(),
-            'website_count': Website.query.count(),
-            'database_count': Database.query.count(),
-            'service_count': Service.query.count(),
-            'running_service_count': Service.query.filter_by(status='running').count()
-        }
+        # Kept current by utils.counters, so this doesn't scan the tables
+        stats = get_counters()
         return stats
     except Exception as e:
         logger.error(f"Error getting system overview: {str(e)}")
@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import atexit
+import logging
+import tempfile
+import threading
+from .locks import host_lock
+
+logger = logging.getLogger(__name__)
+
+# Every process keeps its own counters in memory and writes them here; a scrape, served
+# by whichever gunicorn worker gets it, adds up all the files. Files left by exited
+# processes are folded into one so the directory doesn't grow with worker restarts.
+OPENMETRICS_DIR = os.environ.get("SBPANEL_OPENMETRICS_DIR",
+                                 os.path.join(tempfile.gettempdir(), "sbpanel-metrics", "openmetrics"))
+FLUSH_INTERVAL = float(os.environ.get("SBPANEL_OPENMETRICS_FLUSH_INTERVAL", "5"))
+EXITED_FILE = "exited.json"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+
+def _process_file():
+    # The start time tells a reused pid's file apart from the one a dead process left.
+    return f"{os.getpid()}-{_process_started}.json"
+
+
+_process_started = time.time_ns()
+
+
+class _Metric:
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.registry._add(self.name, self._key(labels), amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        self.registry._observe(self.name, self._key(labels), self.buckets, value)
+
+
+class Registry:
+    """
+    Counters and histograms for one process, plus OpenMetrics rendering of the
+    values summed over every process on the host.
+    """
+
+    def __init__(self, directory=OPENMETRICS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> Counter or Histogram
+        self._values = {}  # name -> {label values: number, or [bucket counts..., sum, count]}
+        self._collectors = []  # fns returning [(name, kind, help, [(labels dict, value)])] at scrape time
+        self._flusher_started = False
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """Add a fn called at scrape time for values read fresh, like gauges from the database."""
+        self._collectors.append(collector)
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+            self._values.setdefault(metric.name, {})
+        return metric
+
+    def _add(self, name, key, amount):
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + amount
+        self._start_flusher()
+
+    def _observe(self, name, key, buckets, value):
+        with self._lock:
+            entry = self._values[name].get(key)
+            if entry is None:
+                entry = self._values[name][key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+        self._start_flusher()
+
+    def _reset_after_fork(self):
+        # A forked child starts counting from zero; its parent's values are the parent's.
+        self._lock = threading.Lock()
+        self._values = {name: {} for name in self._metrics}
+        self._flusher_started = False
+
+    # Sharing between processes
+
+    def _start_flusher(self):
+        if self._flusher_started:
+            return
+        with self._lock:
+            if self._flusher_started:
+                return
+            self._flusher_started = True
+        threading.Thread(target=self._flush_periodically, name="sbpanel-openmetrics-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Could not write OpenMetrics values: {e}")
+
+    def _snapshot(self):
+        with self._lock:
+            return {name: {json.dumps(list(key)): (list(value) if isinstance(value, list) else value)
+                           for key, value in values.items()}
+                    for name, values in self._values.items()}
+
+    def flush(self):
+        """Write this process's values to its file (atomically) for other workers' scrapes."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, _process_file())
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def _read_other_processes(self):
+        merged = {}
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return merged
+        exited = []
+        for filename in names:
+            if not filename.endswith('.json') or filename == _process_file():
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path) as f:
+                    _merge(merged, json.load(f))
+            except (OSError, ValueError):
+                continue
+            if filename != EXITED_FILE and not _process_alive(filename):
+                exited.append(filename)
+        if exited:
+            self._fold_exited(exited)
+        return merged
+
+    def _fold_exited(self, filenames):
+        # Counters from exited workers stay in the totals, as Prometheus expects counters
+        # to only go up, but move into one file.
+        with host_lock("openmetrics-exited"):
+            exited_path = os.path.join(self.directory, EXITED_FILE)
+            try:
+                with open(exited_path) as f:
+                    folded = json.load(f)
+            except (OSError, ValueError):
+                folded = {}
+            present = []
+            for filename in filenames:
+                path = os.path.join(self.directory, filename)
+                try:
+                    with open(path) as f:
+                        _merge(folded, json.load(f))
+                    present.append(path)
+                except (OSError, ValueError):
+                    continue  # Already folded by another worker's scrape
+            with open(f"{exited_path}.tmp", 'w') as f:
+                json.dump(folded, f)
+            os.replace(f"{exited_path}.tmp", exited_path)
+            for path in present:
+                os.remove(path)
+
+    # Rendering
+
+    def render(self):
+        """All metrics, summed over this host's processes, in OpenMetrics text format."""
+        totals = self._read_other_processes()
+        _merge(totals, self._snapshot())
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            for key, value in sorted(totals.get(metric.name, {}).items()):
+                labels = dict(zip(metric.labelnames, json.loads(key)))
+                if metric.kind == 'counter':
+                    lines.append(f"{metric.name}_total{_labels(labels)} {_number(value)}")
+                    continue
+                for bound, count in zip(metric.buckets, value):
+                    lines.append(f"{metric.name}_bucket{_labels({**labels, 'le': _number(bound)})} {count}")
+                lines.append(f"{metric.name}_bucket{_labels({**labels, 'le': '+Inf'})} {value[-1]}")
+                lines.append(f"{metric.name}_sum{_labels(labels)} {_number(value[-2])}")
+                lines.append(f"{metric.name}_count{_labels(labels)} {value[-1]}")
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning(f"OpenMetrics collector {collector.__name__} failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"# HELP {name} {_escape_help(documentation)}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(into, values):
+    for name, series in values.items():
+        target = into.setdefault(name, {})
+        for key, value in series.items():
+            current = target.get(key)
+            if current is None:
+                target[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                if len(current) == len(value):
+                    target[key] = [a + b for a, b in zip(current, value)]
+            else:
+                target[key] = current + value
+
+
+def _process_alive(filename):
+    try:
+        pid = int(filename.split('-', 1)[0])
+        os.kill(pid, 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6)) if value != int(value) else f"{value:.1f}"
+    return str(value)
+
+
+registry = Registry()
+
+
+def _after_fork():
+    global _process_started
+    _process_started = time.time_ns()
+    registry._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+http_request_duration = registry.histogram(
+    'sbpanel_http_request_duration_seconds', 'Time to handle a request, by Flask endpoint', ('endpoint', 'method'))
+http_requests = registry.counter(
+    'sbpanel_http_requests', 'Requests handled, by Flask endpoint and status code', ('endpoint', 'method', 'status'))
+db_queries = registry.counter(
+    'sbpanel_db_queries', 'SQL statements executed, by the Flask endpoint that ran them', ('endpoint',))
+db_query_seconds = registry.counter(
+    'sbpanel_db_query_seconds', 'Time spent executing SQL statements, by Flask endpoint', ('endpoint',))
+docker_exec_duration = registry.histogram(
+    'sbpanel_docker_exec_duration_seconds', 'Time for a command run with docker exec, by command name', ('command',))
+docker_exec_failures = registry.counter(
+    'sbpanel_docker_exec_failures', 'docker exec commands that exited non-zero or could not run', ('command',))
+docker_api_duration = registry.histogram(
+    'sbpanel_docker_api_duration_seconds', 'Time for a Docker API call, by operation', ('operation',))
+docker_api_errors = registry.counter(
+    'sbpanel_docker_api_errors', 'Docker API calls that raised, by operation', ('operation',))
+
+
+def instrument_app(app):
+    """Time every request by endpoint. SQL counts are recorded by utils.sql_profiler."""
+    from flask import request, g
+
+    @app.before_request
+    def _start_request_timer():
+        g._openmetrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('_openmetrics_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'none'
+            http_request_duration.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+            http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
@@ -0,0 +1,170 @@
+import os
+import time
+import logging
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from .locks import host_lock
+
+logger = logging.getLogger(__name__)
+
+# Monthly activity_logs partitions created ahead of time on PostgreSQL.
+PARTITION_MONTHS_AHEAD = 2
+# An existing unpartitioned activity_logs is only converted at startup if it is smaller
+# than this; the copy holds an exclusive lock on the table while it runs.
+PARTITION_MIGRATE_MAX_ROWS = int(os.environ.get("SBPANEL_ACTIVITY_LOG_PARTITION_MAX_ROWS", "1000000"))
+ACTIVITY_LOG_PARTITION_PREFIX = "activity_logs_p"
+
+
+def _existing_indexes(engine):
+    inspector = inspect(engine)
+    names = set()
+    for table_name in inspector.get_table_names():
+        names.update(index['name'] for index in inspector.get_indexes(table_name) if index.get('name'))
+    return names
+
+
+def _invalid_postgres_indexes(conn):
+    # A CREATE INDEX CONCURRENTLY that was interrupted leaves an index marked invalid;
+    # it exists, so IF NOT EXISTS would skip it, but the planner never uses it.
+    return set(conn.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE NOT i.indisvalid"
+    )).scalars())
+
+
+def _partitioned_tables(conn):
+    return set(conn.execute(text(
+        "SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid"
+    )).scalars())
+
+
+def ensure_indexes(db):
+    """
+    Create indexes declared on the models that an existing database doesn't have yet.
+
+    db.create_all() only creates missing tables, so indexes added to a table that
+    already exists need this. On PostgreSQL they are built CONCURRENTLY, so the tables
+    stay writable while a large index builds; SQLite locks the table for the build.
+
+    Returns:
+        list: Names of the indexes created
+    """
+    engine = db.engine
+    postgres = engine.dialect.name == 'postgresql'
+    created = []
+    with host_lock("schema-indexes"):
+        existing = _existing_indexes(engine)
+        invalid = set()
+        partitioned = set()
+        if postgres:
+            with engine.connect() as conn:
+                invalid = _invalid_postgres_indexes(conn)
+                partitioned = _partitioned_tables(conn)
+
+        # CONCURRENTLY can't run inside a transaction block.
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table in db.metadata.sorted_tables:
+                for index in sorted(table.indexes, key=lambda i: i.name):
+                    if index.name in existing and index.name not in invalid:
+                        continue
+                    started = time.monotonic()
+                    if postgres and table.name not in partitioned:
+                        if index.name in invalid:
+                            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+                        ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+                        conn.execute(text(ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)))
+                    else:
+                        conn.execute(CreateIndex(index, if_not_exists=True))
+                    created.append(index.name)
+                    logger.info(f"Created index {index.name} on {table.name} in {time.monotonic() - started:.1f}s.")
+    return created
+
+
+def month_start(value, months=0):
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def activity_log_partitions(conn):
+    """
+    The monthly partitions of activity_logs on PostgreSQL.
+
+    Returns:
+        list: (partition name, first day of its month), oldest first; empty if the
+            table isn't partitioned
+    """
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'activity_logs'"
+    )).scalars()
+    partitions = []
+    for name in names:
+        if name.startswith(ACTIVITY_LOG_PARTITION_PREFIX):
+            suffix = name[len(ACTIVITY_LOG_PARTITION_PREFIX):]
+            partitions.append((name, datetime(int(suffix[:4]), int(suffix[4:6]), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def create_activity_log_partitions(conn, start, now=None):
+    """Create the monthly partitions from `start`'s month to PARTITION_MONTHS_AHEAD past now."""
+    now = now or datetime.utcnow()
+    existing = {name for name, _ in activity_log_partitions(conn)}
+    month = month_start(start)
+    last = month_start(now, PARTITION_MONTHS_AHEAD)
+    while month <= last:
+        name = f"{ACTIVITY_LOG_PARTITION_PREFIX}{month:%Y%m}"
+        if name not in existing:
+            conn.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF activity_logs '
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{month_start(month, 1):%Y-%m-%d}')"))
+            logger.info(f"Created activity log partition {name}.")
+        month = month_start(month, 1)
+
+
+def partition_activity_logs(db):
+    """
+    On PostgreSQL, turn activity_logs into a table partitioned by month of created_at,
+    so retention drops whole old months instead of deleting their rows one by one.
+
+    The existing rows are copied over in one transaction. Tables larger than
+    PARTITION_MIGRATE_MAX_ROWS are left as they are (with a warning); retention
+    deletes from them in chunks instead.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return
+    from models import ActivityLog
+    with host_lock("schema-activity-log-partitions"), engine.begin() as conn:
+        if 'activity_logs' in _partitioned_tables(conn):
+            create_activity_log_partitions(conn, datetime.utcnow())
+            return
+        rows = conn.execute(text(
+            "SELECT reltuples::bigint FROM pg_class WHERE relname = 'activity_logs'")).scalar() or 0
+        if rows > PARTITION_MIGRATE_MAX_ROWS:
+            logger.warning(f"activity_logs has about {rows} rows, more than SBPANEL_ACTIVITY_LOG_PARTITION_MAX_ROWS; "
+                           "leaving it unpartitioned.")
+            return
+
+        started = time.monotonic()
+        conn.execute(text("LOCK TABLE activity_logs IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text("ALTER TABLE activity_logs RENAME TO activity_logs_unpartitioned"))
+        # The partition key has to be part of the primary key.
+        conn.execute(text(
+            "CREATE TABLE activity_logs (LIKE activity_logs_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created_at)"))
+        conn.execute(text("CREATE TABLE activity_logs_default PARTITION OF activity_logs DEFAULT"))
+        oldest = conn.execute(text("SELECT min(created_at) FROM activity_logs_unpartitioned")).scalar()
+        create_activity_log_partitions(conn, oldest or datetime.utcnow())
+        conn.execute(text(
+            "INSERT INTO activity_logs (id, user_id, action, details, ip_address, created_at) "
+            "SELECT id, user_id, action, details, ip_address, coalesce(created_at, 'epoch') "
+            "FROM activity_logs_unpartitioned"))
+        conn.execute(text("ALTER SEQUENCE activity_logs_id_seq OWNED BY activity_logs.id"))
+        conn.execute(text("DROP TABLE activity_logs_unpartitioned"))
+        conn.execute(text("ALTER TABLE activity_logs ALTER COLUMN created_at SET NOT NULL"))
+        conn.execute(text("ALTER TABLE activity_logs ADD PRIMARY KEY (id, created_at)"))
+        conn.execute(text("ALTER TABLE activity_logs ADD FOREIGN KEY (user_id) REFERENCES users (id)"))
+        for index in ActivityLog.__table__.indexes:
+            conn.execute(CreateIndex(index))
+        logger.info(f"Partitioned activity_logs by month in {time.monotonic() - started:.1f}s.")
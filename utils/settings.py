@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+import threading
+from sqlalchemy import select, update, cast, Integer, Text
+
+logger = logging.getLogger(__name__)
+
+# Bumped in the same transaction as any change to the other settings. Keys starting
+# with '_' are internal and not shown on the admin system page.
+VERSION_KEY = '_version'
+# Outside a request (job steps, background threads) the version is checked at most
+# this often; in a request it is checked once per request.
+RECHECK_INTERVAL = float(os.environ.get("SBPANEL_SETTINGS_RECHECK_INTERVAL", "5"))
+
+
+class Setting:
+    def __init__(self, key, kind, default, description=''):
+        self.key = key
+        self.kind = kind  # str, bool or int
+        self.default = default
+        self.description = description
+
+    def parse(self, raw):
+        if raw is None:
+            return self.default
+        if self.kind is bool:
+            return raw.strip().lower() == 'true'
+        if self.kind is int:
+            try:
+                return int(raw)
+            except ValueError:
+                logger.warning(f"Setting {self.key} has a non-integer value {raw!r}; using {self.default}.")
+                return self.default
+        return raw
+
+
+# The settings on the admin system page, with the defaults it shows when unset.
+SETTINGS = {setting.key: setting for setting in (
+    Setting('system_name', str, 'SBPanel'),
+    Setting('allow_registration', bool, True, 'Let visitors create accounts'),
+    Setting('maintenance_mode', bool, False),
+    Setting('admin_email', str, ''),
+    Setting('default_cpu_limit', int, 1, 'CPU cores for new users'),
+    Setting('default_memory_limit', int, 1024, 'Memory in MB for new users'),
+    Setting('default_disk_limit', int, 10240, 'Disk in MB for new users'),
+    Setting('max_containers', int, 5, 'Containers per user'),
+    Setting('ssl_auto_renew', bool, True),
+    Setting('ssl_email', str, '', 'Contact address for Let\'s Encrypt certificates'),
+    Setting('auto_backup', bool, False),
+    Setting('backup_frequency', str, 'weekly'),
+    Setting('backup_retention', int, 30, 'Days backups are kept'),
+    Setting('login_message', str, ''),
+    Setting('dashboard_message', str, ''),
+)}
+
+_lock = threading.Lock()
+_values = None  # key -> raw value string, for every row
+_version = None
+_checked_at = 0.0
+
+
+def _read_version(conn):
+    from models import SystemSetting
+    value = conn.execute(select(SystemSetting.value).where(SystemSetting.key == VERSION_KEY)).scalar()
+    return int(value) if value else 0
+
+
+def _refresh():
+    global _values, _version, _checked_at
+    from flask import g, has_request_context
+    from app import db
+    from models import SystemSetting
+    if has_request_context():
+        if g.get('_settings_checked'):
+            return
+        g._settings_checked = True
+    elif _values is not None and time.monotonic() - _checked_at < RECHECK_INTERVAL:
+        return
+    _checked_at = time.monotonic()
+
+    # Its own connection, so the check never leaves the caller's session in a transaction.
+    with db.engine.connect() as conn:
+        version = _read_version(conn)
+        if _values is not None and version == _version:
+            return
+        rows = conn.execute(select(SystemSetting.key, SystemSetting.value)).all()
+    with _lock:
+        _values = {key: value for key, value in rows}
+        _version = version
+    logger.debug(f"Loaded system settings at version {version}.")
+
+
+def get_setting(key):
+    """
+    A setting's typed value, from memory; the rows are reloaded only when their
+    version has changed.
+
+    Raises:
+        KeyError: If the key isn't in SETTINGS
+    """
+    setting = SETTINGS[key]
+    _refresh()
+    return setting.parse(_values.get(key))
+
+
+def get_raw_settings():
+    """All non-internal settings as stored, including ones not in SETTINGS."""
+    _refresh()
+    return {key: value for key, value in _values.items() if not key.startswith('_')}
+
+
+def bump_settings_version():
+    """
+    Mark the settings as changed, in the current session's transaction; every worker
+    reloads them on its next check after the commit.
+    """
+    from app import db
+    from models import SystemSetting
+    result = db.session.execute(
+        update(SystemSetting).where(SystemSetting.key == VERSION_KEY)
+        .values(value=cast(cast(SystemSetting.value, Integer) + 1, Text)))
+    if result.rowcount == 0:
+        db.session.add(SystemSetting(key=VERSION_KEY, value='1', description='Settings version, bumped on change'))
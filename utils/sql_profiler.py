@@ -0,0 +1,140 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import Counter, deque
+from functools import lru_cache
+from .openmetrics import db_queries, db_query_seconds
+
+logger = logging.getLogger(__name__)
+
+# A request that runs one statement shape more often than this is logged as a likely N+1.
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("SBPANEL_N_PLUS_ONE_THRESHOLD", "10"))
+# Set to 0 to leave the Server-Timing header off responses.
+SERVER_TIMING = os.environ.get("SBPANEL_SERVER_TIMING", "1") != "0"
+# Profiles kept per worker for the admin debug endpoint.
+RECENT_PROFILES = int(os.environ.get("SBPANEL_SQL_PROFILES_KEPT", "200"))
+# Repeated shapes listed per profile.
+TOP_SHAPES = 5
+
+_recent_lock = threading.Lock()
+_recent = deque(maxlen=RECENT_PROFILES)
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:\?|%\(\w+\)s|%s)"
+_PLACEHOLDER_LISTS = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+
+
+@lru_cache(maxsize=4096)
+def statement_shape(statement):
+    """A statement with literals and IN lists collapsed, so repeats of one query compare equal."""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _LITERALS.sub('?', shape)
+    return _PLACEHOLDER_LISTS.sub('(?)', shape)
+
+
+class RequestProfile:
+    """The SQL one request ran: statement count, time, and how often each shape repeated."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, minimum=2):
+        return [(shape, count) for shape, count in self.shapes.most_common(TOP_SHAPES) if count >= minimum]
+
+
+def _current_endpoint():
+    from flask import request, has_request_context
+    return (request.endpoint or 'none') if has_request_context() else 'background'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._sbpanel_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    from flask import g, has_request_context
+    started = getattr(context, '_sbpanel_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    endpoint = _current_endpoint()
+    db_queries.inc(endpoint=endpoint)
+    db_query_seconds.inc(elapsed, endpoint=endpoint)
+    if has_request_context():
+        profile = g.get('_sql_profile')
+        if profile is None:
+            profile = g._sql_profile = RequestProfile()
+        profile.record(statement, elapsed)
+
+
+def recent_profiles(endpoint=None, n_plus_one_only=False):
+    """This worker's latest request profiles, newest first."""
+    with _recent_lock:
+        profiles = list(_recent)
+    profiles.reverse()
+    if endpoint:
+        profiles = [p for p in profiles if p['endpoint'] == endpoint]
+    if n_plus_one_only:
+        profiles = [p for p in profiles if p['n_plus_one']]
+    return profiles
+
+
+def init_sql_profiler(app):
+    """
+    Count the SQL every request runs, warn about likely N+1 patterns, and report the
+    figures in a Server-Timing header and to the admin debug endpoint.
+    """
+    from flask import g, request
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if not event.contains(Engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def _start_sql_profile():
+        g._sql_profile = RequestProfile()
+        g._sql_profile_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_sql_profile(response):
+        profile = g.pop('_sql_profile', None)
+        started = g.pop('_sql_profile_started', None)
+        if profile is None or started is None:
+            return response
+        total = time.perf_counter() - started
+        endpoint = request.endpoint or 'none'
+
+        suspects = [(shape, count) for shape, count in profile.shapes.items() if count > N_PLUS_ONE_THRESHOLD]
+        for shape, count in suspects:
+            logger.warning(f"Possible N+1 in {endpoint}: {count} runs of {shape[:300]}")
+
+        if SERVER_TIMING:
+            response.headers.add('Server-Timing', f'db;dur={profile.seconds * 1000:.1f};desc="{profile.queries} queries"')
+            response.headers.add('Server-Timing', f'app;dur={total * 1000:.1f}')
+
+        with _recent_lock:
+            _recent.append({
+                'at': time.time(),
+                'endpoint': endpoint,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(total * 1000, 2),
+                'queries': profile.queries,
+                'db_ms': round(profile.seconds * 1000, 2),
+                'n_plus_one': bool(suspects),
+                'repeated': [{'shape': shape, 'count': count} for shape, count in profile.repeated()],
+            })
+        return response
@@ -2,17 +2,19 @@ import logging
 import subprocess
 import os
 from datetime import datetime, timedelta
-from .container import _execute_in_container, start_service, stop_service # Use specific function imports
+from .container import _execute_in_container, _execute_batch_in_container, _stream_in_container, _service_command, start_service, stop_service # Use specific function imports
 
 logger = logging.getLogger(__name__)
 
-def request_ssl_certificate(container_id, domain):
+def request_ssl_certificate(container_id, domain, user_id=None, progress=None):
     """
     Request an SSL certificate for a domain using Let's Encrypt
     
     Args:
         container_id: Docker Container Name/ID
         domain: Domain name for the certificate
+        user_id: Owner of the website whose expiry date is updated
+        progress: Optional callable taking one line of certbot output
     
     Returns:
         bool: Whether the certificate was successfully issued
@@ -22,17 +24,18 @@ def request_ssl_certificate(container_id, domain):
         result = _execute_in_container(container_id, ['which', 'certbot'])
         if result.exit_code != 0:
             logger.info(f"Certbot not found in {container_id}. Installing...")
-            _execute_in_container(container_id, ['apt-get', 'update', '-y'])
             # python3-certbot-nginx or python3-certbot-apache depending on webserver
             # For now, installing generic certbot and nginx plugin as an example
-            install_result = _execute_in_container(container_id, ['apt-get', 'install', '-y', 'certbot', 'python3-certbot-nginx'])
+            install_result = _execute_batch_in_container(container_id, [
+                (['apt-get', 'update', '-y'], True),
+                ['apt-get', 'install', '-y', 'certbot', 'python3-certbot-nginx'],
+            ])[-1]
             if install_result.exit_code != 0:
                 logger.error(f"Failed to install certbot in {container_id}: {install_result.stderr}")
                 raise Exception(f"Failed to install certbot in {container_id}")
         
-        from models import SystemSetting # Assuming models.py is accessible
-        email_setting = SystemSetting.query.filter_by(key='ssl_email').first()
-        email = email_setting.value if email_setting and email_setting.value else ""
+        from .settings import get_setting
+        email = get_setting('ssl_email')
         
         cmd = ['certbot', 'certonly', '--standalone', '--non-interactive', 
                '--agree-tos', '-d', domain]
@@ -45,13 +48,16 @@ def request_ssl_certificate(container_id, domain):
         web_server_service_name = None
         # Detect web server type (nginx or apache) to stop/start it
         # This detection is basic. A more robust way would be to check installed packages or listening ports.
-        nginx_active_check = _execute_in_container(container_id, ['service', 'nginx', 'status'], ignore_failure=True)
+        status_checks = _execute_batch_in_container(container_id, [
+            (['service', 'nginx', 'status'], True),
+            (['service', 'apache2', 'status'], True),
+        ])
+        nginx_active_check = status_checks[0]
+        apache_active_check = status_checks[1] if len(status_checks) > 1 else None
         if nginx_active_check.exit_code == 0 and "active (running)" in nginx_active_check.stdout.lower():
              web_server_service_name = 'nginx'
-        else:
-            apache_active_check = _execute_in_container(container_id, ['service', 'apache2', 'status'], ignore_failure=True)
-            if apache_active_check.exit_code == 0 and "active (running)" in apache_active_check.stdout.lower():
-                web_server_service_name = 'apache2'
+        elif apache_active_check and apache_active_check.exit_code == 0 and "active (running)" in apache_active_check.stdout.lower():
+            web_server_service_name = 'apache2'
         
         if web_server_service_name:
             logger.info(f"Stopping web server {web_server_service_name} in {container_id} for SSL challenge.")
@@ -60,7 +66,7 @@ def request_ssl_certificate(container_id, domain):
         cert_result = None
         try:
             logger.info(f"Requesting SSL certificate for {domain} in {container_id} with command: {' '.join(cmd)}")
-            cert_result = _execute_in_container(container_id, cmd)
+            cert_result = _stream_in_container(container_id, cmd, progress=progress)
             
             if cert_result.exit_code != 0:
                 logger.error(f"Failed to obtain SSL certificate for {domain}: {cert_result.stderr} {cert_result.stdout}")
@@ -75,7 +81,10 @@ def request_ssl_certificate(container_id, domain):
         
         from app import db # Assuming app.py and db are accessible
         from models import Website
-        website = Website.query.filter_by(domain=domain, user_id=current_user.id).first() # Scope to current user if applicable
+        website_query = Website.query.filter_by(domain=domain)
+        if user_id is not None:
+            website_query = website_query.filter_by(user_id=user_id)
+        website = website_query.first()
         if website: # Check if website exists before trying to update it
             website.ssl_expires = datetime.utcnow() + timedelta(days=89) # Let's Encrypt certs valid for 90 days, renew a bit earlier
             db.session.commit()
@@ -107,11 +116,13 @@ def setup_ssl_renewal(container_id):
         # Write to a specific file in cron.d
         from .container import write_file # Use the new write_file from utils.container
         write_file(container_id, "/etc/cron.d/sbpanel-certbot-renew", cron_file_content)
-        _execute_in_container(container_id, ['chmod', '644', "/etc/cron.d/sbpanel-certbot-renew"])
-        _execute_in_container(container_id, ['chown', 'root:root', "/etc/cron.d/sbpanel-certbot-renew"])
+        _execute_batch_in_container(container_id, [
+            ['chmod', '644', "/etc/cron.d/sbpanel-certbot-renew"],
+            ['chown', 'root:root', "/etc/cron.d/sbpanel-certbot-renew"],
+            _service_command('cron', 'restart'), # Ensure cron service re-reads configs
+        ], stop_on_failure=False)
         
         logger.info(f"SSL renewal cron job ensured for container {container_id}.")
-        restart_service(container_id, 'cron') # Ensure cron service re-reads configs
     
     except Exception as e:
         logger.error(f"Error setting up SSL renewal for {container_id}: {str(e)}")
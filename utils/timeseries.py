@@ -0,0 +1,242 @@
+import os
+import re
+import mmap
+import time
+import struct
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# (resolution seconds, slots): 10s for an hour, 1m for a day, 1h for 30 days. Every
+# sample is folded into all three as it is recorded, so the coarser tiers are rollups
+# of the finer ones without a separate compaction pass.
+TIERS = ((10, 360), (60, 1440), (3600, 720))
+
+MAGIC = b'SBTS'
+VERSION = 1
+HEADER_SIZE = 512
+MAX_OPEN_FILES = int(os.environ.get("SBPANEL_TIMESERIES_MAX_OPEN", "256"))
+
+
+def _header(metrics):
+    header = struct.pack('<4sHH', MAGIC, VERSION, len(metrics))
+    header += b''.join(struct.pack('<II', resolution, capacity) for resolution, capacity in TIERS)
+    header += ','.join(metrics).encode()
+    if len(header) > HEADER_SIZE:
+        raise ValueError("Too many metric names for the series header")
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def series_file_size(metrics):
+    """Bytes per entity: fixed, whatever the sampling rate or uptime."""
+    per_slot = 4 + 4 + 8 * len(metrics)  # timestamp, sample count, float32 avg + max per metric
+    return HEADER_SIZE + sum(capacity * per_slot for _, capacity in TIERS)
+
+
+class _Tier:
+    def __init__(self, resolution, capacity, timestamps, counts, averages, maximums):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.timestamps = timestamps
+        self.counts = counts
+        self.averages = averages
+        self.maximums = maximums
+
+    @property
+    def retention(self):
+        return self.resolution * self.capacity
+
+
+class SeriesFile:
+    """
+    Fixed-size ring buffers for one entity's metrics, memory-mapped from a file.
+
+    Each tier is a struct of arrays (slot timestamps, sample counts, then float32
+    averages and maxima laid out slot-major), so a write touches a handful of bytes
+    and readers in other processes see it through the shared mapping.
+    """
+
+    def __init__(self, path, metrics, writable=False):
+        self.path = path
+        self.metrics = list(metrics)
+        self._index = {metric: i for i, metric in enumerate(self.metrics)}
+        size = series_file_size(self.metrics)
+        header = _header(self.metrics)
+
+        if writable:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.pread(fd, HEADER_SIZE, 0) != header or os.fstat(fd).st_size != size:
+                    # New file, or one written with a different layout; start it over.
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, header, 0)
+                self._mm = mmap.mmap(fd, size, access=mmap.ACCESS_WRITE)
+            finally:
+                os.close(fd)
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if os.pread(fd, HEADER_SIZE, 0) != header or os.fstat(fd).st_size != size:
+                    raise ValueError(f"{path} has an unexpected layout")
+                self._mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        self.inode = os.stat(path).st_ino
+
+        self._view = memoryview(self._mm)
+        self._tiers = []
+        offset = HEADER_SIZE
+        n = len(self.metrics)
+        for resolution, capacity in TIERS:
+            views = []
+            for width in (capacity * 4, capacity * 4, capacity * n * 4, capacity * n * 4):
+                views.append(self._view[offset:offset + width])
+                offset += width
+            self._tiers.append(_Tier(resolution, capacity, views[0].cast('I'), views[1].cast('I'),
+                                     views[2].cast('f'), views[3].cast('f')))
+
+    def record(self, timestamp, values):
+        """Fold one sample ({metric: value}) into every tier."""
+        n = len(self.metrics)
+        for tier in self._tiers:
+            bucket = int(timestamp) // tier.resolution * tier.resolution
+            slot = (bucket // tier.resolution) % tier.capacity
+            if tier.timestamps[slot] != bucket:
+                # The slot still holds data from one lap of the ring ago.
+                tier.timestamps[slot] = bucket
+                tier.counts[slot] = 0
+                for j in range(slot * n, slot * n + n):
+                    tier.averages[j] = 0.0
+                    tier.maximums[j] = 0.0
+            count = tier.counts[slot]
+            for metric, value in values.items():
+                i = self._index.get(metric)
+                if i is None or value is None:
+                    continue
+                j = slot * n + i
+                tier.averages[j] += (value - tier.averages[j]) / (count + 1)
+                if count == 0 or value > tier.maximums[j]:
+                    tier.maximums[j] = value
+            tier.counts[slot] = count + 1
+
+    def _pick_tier(self, start, resolution=None):
+        if resolution:
+            for tier in self._tiers:
+                if tier.resolution >= resolution:
+                    return tier
+            return self._tiers[-1]
+        # The tier has to still hold the oldest point asked for, however short the
+        # window. One bucket of slack keeps "the last hour", which reaches the clock a
+        # moment after the caller read it, on the 10s tier.
+        age = time.time() - start
+        for tier in self._tiers:
+            if tier.retention + tier.resolution >= age:
+                return tier
+        return self._tiers[-1]
+
+    def query(self, metric, start, end, resolution=None):
+        """
+        Points for one metric between two epoch timestamps.
+
+        Without `resolution`, the finest tier that still holds `start` is used.
+
+        Returns:
+            tuple: (resolution in seconds, [(bucket timestamp, average, maximum), ...])
+        """
+        i = self._index[metric]
+        tier = self._pick_tier(start, resolution)
+        n = len(self.metrics)
+        points = []
+        first = int(start) // tier.resolution * tier.resolution
+        # Never walk more than one lap of the ring.
+        first = max(first, int(end) // tier.resolution * tier.resolution - (tier.capacity - 1) * tier.resolution)
+        for bucket in range(first, int(end) + 1, tier.resolution):
+            slot = (bucket // tier.resolution) % tier.capacity
+            if tier.timestamps[slot] == bucket and tier.counts[slot]:
+                j = slot * n + i
+                points.append((bucket, round(tier.averages[j], 4), round(tier.maximums[j], 4)))
+        return tier.resolution, points
+
+    def close(self):
+        for tier in self._tiers:
+            for view in (tier.timestamps, tier.counts, tier.averages, tier.maximums):
+                view.release()
+        self._tiers = []
+        self._view.release()
+        self._mm.close()
+
+
+class TimeSeriesStore:
+    """
+    A directory of SeriesFiles, one per entity (a container, the host), sharing a metric list.
+
+    Open mappings are kept in an LRU bounded by MAX_OPEN_FILES, so memory use is set by
+    that bound and series_file_size(), not by how many entities have history.
+    """
+
+    def __init__(self, directory, metrics, max_open=MAX_OPEN_FILES):
+        self.directory = directory
+        self.metrics = list(metrics)
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # (entity, writable) -> SeriesFile
+
+    def _path(self, entity):
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]', '_', str(entity)) + '.ts')
+
+    def _open(self, entity, writable):
+        key = (entity, writable)
+        path = self._path(entity)
+        series = self._files.get(key)
+        if series is not None:
+            try:
+                current_inode = os.stat(path).st_ino
+            except OSError:
+                current_inode = None
+            if current_inode == series.inode:
+                self._files.move_to_end(key)
+                return series
+            # Deleted or recreated by another process since we mapped it.
+            self._files.pop(key).close()
+        if writable:
+            os.makedirs(self.directory, exist_ok=True)
+        elif not os.path.exists(path):
+            return None
+        series = SeriesFile(path, self.metrics, writable=writable)
+        self._files[key] = series
+        while len(self._files) > self.max_open:
+            self._files.popitem(last=False)[1].close()
+        return series
+
+    def record(self, entity, timestamp, values):
+        with self._lock:
+            self._open(entity, writable=True).record(timestamp, values)
+
+    def query(self, entity, metric, start, end=None, resolution=None):
+        """See SeriesFile.query; an entity with no history gives (None, [])."""
+        if metric not in self.metrics:
+            raise ValueError(f"Unknown metric: {metric}")
+        end = time.time() if end is None else end
+        with self._lock:
+            try:
+                series = self._open(entity, writable=False)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not open time series for {entity}: {e}")
+                series = None
+            if series is None:
+                return None, []
+            return series.query(metric, start, end, resolution)
+
+    def delete(self, entity):
+        with self._lock:
+            for writable in (True, False):
+                series = self._files.pop((entity, writable), None)
+                if series is not None:
+                    series.close()
+            try:
+                os.remove(self._path(entity))
+            except FileNotFoundError:
+                pass
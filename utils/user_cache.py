@@ -0,0 +1,108 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+logger = logging.getLogger(__name__)
+
+# Users whose row is kept per worker for Flask-Login, and for how long. A change made
+# through the session reaches every worker on this host straight away (see below);
+# the TTL bounds staleness from changes made elsewhere, e.g. on another host.
+USER_CACHE_SIZE = int(os.environ.get("SBPANEL_USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.environ.get("SBPANEL_USER_CACHE_TTL", "60"))
+# One stamp file per user, rewritten whenever that user changes. A cached user is only
+# used while its stamp's mtime is the one seen when it was loaded, so a change (a login
+# updating last_login, say) costs the other workers that one user, not their whole cache.
+STAMP_DIR = os.environ.get("SBPANEL_USER_CACHE_STAMP_DIR",
+                           os.path.join(tempfile.gettempdir(), "sbpanel-cache", "users"))
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # user id -> (column values, monotonic time loaded, stamp when loaded)
+
+
+def _stamp(user_id):
+    try:
+        return os.stat(os.path.join(STAMP_DIR, str(user_id))).st_mtime_ns
+    except OSError:
+        return None
+
+
+def invalidate_users(user_ids):
+    """Drop users from this worker's cache and tell the host's other workers to do the same."""
+    with _lock:
+        for user_id in user_ids:
+            _entries.pop(user_id, None)
+    os.makedirs(STAMP_DIR, exist_ok=True)
+    for user_id in user_ids:
+        with open(os.path.join(STAMP_DIR, str(user_id)), 'w') as f:
+            f.write(str(time.time_ns()))
+
+
+def load_user(user_id):
+    """
+    The user for Flask-Login's user_loader, from the cache when possible.
+
+    A cached user is rebuilt from its column values and merged into the session
+    without a SELECT, so it behaves like a loaded instance (relationships lazy-load).
+    """
+    from app import db
+    from models import User
+    now = time.monotonic()
+    # Read before any reload, so a change committed while the row is being read
+    # leaves a newer stamp behind and the next load reads it again.
+    stamp = _stamp(user_id)
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is not None:
+            if now - entry[1] < USER_CACHE_TTL and entry[2] == stamp:
+                _entries.move_to_end(user_id)
+            else:
+                del _entries[user_id]
+                entry = None
+    if entry is not None:
+        user = User(**entry[0])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    values = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+    with _lock:
+        _entries[user_id] = (values, now, stamp)
+        while len(_entries) > USER_CACHE_SIZE:
+            _entries.popitem(last=False)
+    return user
+
+
+def _after_flush(session, flush_context):
+    from models import User
+    changed = {obj.id for obj in list(session.dirty) + list(session.deleted)
+               if isinstance(obj, User) and obj.id is not None}
+    if changed:
+        session.info.setdefault('_changed_users', set()).update(changed)
+
+
+def _after_commit(session):
+    # Only once committed: invalidating at flush time would let another thread cache
+    # the old row again before the change is visible to it.
+    changed = session.info.pop('_changed_users', None)
+    if changed:
+        invalidate_users(changed)
+
+
+def _after_rollback(session):
+    session.info.pop('_changed_users', None)
+
+
+def init_user_cache():
+    """Invalidate cached users whenever a session commits a change to one."""
+    from app import db
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
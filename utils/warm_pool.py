@@ -0,0 +1,156 @@
+import os
+import re
+import uuid
+import logging
+import threading
+from docker.errors import APIError
+from .docker_client import client, docker_call
+from .container import TEMPLATES, create_base_docker_container, provision_container_software, \
+                       rename_container, update_container_limits, delete_container
+from .images import get_image_for_template
+from .locks import host_lock, try_become_leader
+
+logger = logging.getLogger(__name__)
+
+# Ready containers kept per template. Off (0) unless set: every pooled container
+# holds memory and disk for each template whether or not anyone claims it.
+WARM_POOL_SIZE = int(os.environ.get("SBPANEL_WARM_POOL_SIZE", "0"))
+# Memory ceiling for idle pool containers; the real limit is applied when one is claimed.
+WARM_POOL_MEMORY = int(os.environ.get("SBPANEL_WARM_POOL_MEMORY", "1024"))
+
+POOL_LABEL = "sbpanel.pool"
+# Containers are renamed from the warming prefix to the ready prefix once provisioned, and
+# to the user's name on claim. Labels can't change after creation, so the name prefix is
+# what tells ready containers apart from warming and claimed ones.
+WARMING_PREFIX = "sbpanel-warming"
+READY_PREFIX = "sbpanel-pool"
+
+_refill_lock = threading.Lock()
+_refills_in_progress = set()
+
+
+def _pool_containers(template, prefix):
+    if client is None:
+        return []
+    name_pattern = f"^/?{re.escape(prefix)}-{re.escape(template)}-"
+    with docker_call('containers.list'):
+        containers = client.containers.list(filters={'label': f"{POOL_LABEL}={template}", 'name': name_pattern})
+    # The name filter is an unanchored match on some daemon versions, so check again here.
+    return [c for c in containers if c.name.startswith(f"{prefix}-{template}-")]
+
+
+def _create_pool_container(template):
+    warming_name = f"{WARMING_PREFIX}-{template}-{uuid.uuid4().hex[:8]}"
+    image, prebuilt = get_image_for_template(template)
+    create_base_docker_container(warming_name, image, None, WARM_POOL_MEMORY, 0, labels={POOL_LABEL: template})
+    return warming_name, prebuilt
+
+
+def _provision_pool_container(template, warming_name, prebuilt):
+    try:
+        provision_container_software(warming_name, template, prebuilt=prebuilt)
+        ready_name = warming_name.replace(WARMING_PREFIX, READY_PREFIX, 1)
+        rename_container(warming_name, ready_name)
+        logger.info(f"Warm pool container {ready_name} ready for template {template}.")
+    except Exception:
+        try:
+            delete_container(warming_name)
+        except Exception as e:
+            logger.error(f"Could not remove failed warm pool container {warming_name}: {e}")
+        raise
+
+
+def refill_pool(template):
+    """Create containers for a template until WARM_POOL_SIZE are ready or warming."""
+    while True:
+        # Counting and creating under the lock keeps workers refilling at once from overshooting.
+        with host_lock(f"warm-pool-{template}"):
+            present = len(_pool_containers(template, READY_PREFIX)) + len(_pool_containers(template, WARMING_PREFIX))
+            if present >= WARM_POOL_SIZE:
+                return
+            warming_name, prebuilt = _create_pool_container(template)
+        _provision_pool_container(template, warming_name, prebuilt)
+
+
+def refill_pool_async(template):
+    """Refill a template's pool in the background unless this worker is already doing so."""
+    if WARM_POOL_SIZE <= 0 or client is None or template not in TEMPLATES:
+        return
+    with _refill_lock:
+        if template in _refills_in_progress:
+            return
+        _refills_in_progress.add(template)
+
+    def _refill():
+        try:
+            refill_pool(template)
+        except Exception as e:
+            logger.error(f"Refilling warm pool for {template} failed: {e}")
+        finally:
+            with _refill_lock:
+                _refills_in_progress.discard(template)
+
+    threading.Thread(target=_refill, name=f"sbpanel-warm-pool-{template}", daemon=True).start()
+
+
+def claim_warm_container(template, container_name_docker, cpu, memory):
+    """
+    Take a ready container from the pool for a new user container.
+
+    The container is renamed to container_name_docker and given the requested limits
+    with a live update, then the pool is refilled in the background.
+
+    Returns:
+        str: The Docker container name, or None if no ready container was available
+    """
+    if WARM_POOL_SIZE <= 0 or client is None or template not in TEMPLATES:
+        return None
+
+    claimed = None
+    try:
+        # The lock keeps two workers from claiming the same container.
+        with host_lock(f"warm-pool-{template}"):
+            for candidate in _pool_containers(template, READY_PREFIX):
+                try:
+                    rename_container(candidate.name, container_name_docker)
+                except Exception as e:
+                    logger.warning(f"Could not claim warm pool container {candidate.name}: {e}")
+                    continue
+                claimed = container_name_docker
+                break
+    except APIError as e:
+        logger.error(f"Could not list warm pool containers for {template}: {e}")
+
+    refill_pool_async(template)
+    if claimed is None:
+        logger.info(f"No warm pool container ready for template {template}.")
+        return None
+
+    try:
+        update_container_limits(claimed, cpu, memory)
+    except Exception:
+        # Don't hand out a container without its limits; the caller falls back to a fresh one.
+        try:
+            delete_container(claimed)
+        except Exception as e:
+            logger.error(f"Could not remove claimed warm pool container {claimed}: {e}")
+        raise
+    logger.info(f"Claimed warm pool container for template {template} as {claimed}.")
+    return claimed
+
+
+def start_warm_pool():
+    """Fill every template's pool in the background; only one worker per host does this."""
+    if WARM_POOL_SIZE <= 0 or client is None:
+        return
+    if not try_become_leader("warm-pool"):
+        return
+    for template in TEMPLATES:
+        # Containers still warming at startup belong to a process that died mid-provision.
+        try:
+            with host_lock(f"warm-pool-{template}"):
+                for stale in _pool_containers(template, WARMING_PREFIX):
+                    delete_container(stale.name)
+        except Exception as e:
+            logger.error(f"Could not clear stale warm pool containers for {template}: {e}")
+        refill_pool_async(template)
@@ -1,7 +1,7 @@
 import logging
 import os
 import tempfile
-from .container import _execute_in_container, write_file, create_directory, restart_service, start_service # Adjusted imports
+from .container import _execute_in_container, _execute_batch_in_container, _service_command, write_file, restart_service # Adjusted imports
 
 logger = logging.getLogger(__name__)
 
@@ -17,9 +17,7 @@ def create_website_config(container_id, domain, server_type, php_version, docume
         document_root: Document root path
         ssl_enabled: Whether SSL is enabled
     """
-    # create_directory and write_file are already using the new _execute_in_container indirectly or directly
-    create_directory(container_id, document_root)
-    
+    # write_file creates the document root on demand, so no separate mkdir exec is needed
     index_content = f"""<!DOCTYPE html>
 <html>
 <head>
@@ -65,14 +63,16 @@ def create_nginx_config(container_id, domain, document_root, php_version, ssl_en
         php_fpm_service_name = f'php{php_version}-fpm' # Common naming convention
         
         logger.info(f"Ensuring PHP {php_version} and FPM are installed in {container_id}...")
-        _execute_in_container(container_id, ['apt-get', 'update', '-y'])
-        install_php_result = _execute_in_container(container_id, ['apt-get', 'install', '-y', php_fpm_package, f'php{php_version}-mysql']) # Add other common extensions if needed
-        if install_php_result.exit_code != 0:
-            logger.error(f"Failed to install {php_fpm_package} in {container_id}: {install_php_result.stderr}")
+        php_results = _execute_batch_in_container(container_id, [
+            (['apt-get', 'update', '-y'], True),
+            ['apt-get', 'install', '-y', php_fpm_package, f'php{php_version}-mysql'], # Add other common extensions if needed
+            (_service_command(php_fpm_service_name, 'start'), True), # Tries service then systemctl
+        ])
+        if len(php_results) < 3:
+            logger.error(f"Failed to install {php_fpm_package} in {container_id}: {php_results[-1].stderr}")
             # Decide if this is a critical failure or just a warning
         else:
             logger.info(f"Successfully installed/verified {php_fpm_package} in {container_id}.")
-            start_service(container_id, php_fpm_service_name) # Use start_service which tries service then systemctl
 
     # Nginx configuration content
     config_parts = []
@@ -164,12 +164,14 @@ server {
     write_file(container_id, config_path_in_container, full_config)
     
     symlink_path_in_container = f"/etc/nginx/sites-enabled/{domain}"
-    _execute_in_container(container_id, ['rm', '-f', symlink_path_in_container], ignore_failure=True)
-    _execute_in_container(container_id, ['ln', '-s', config_path_in_container, symlink_path_in_container])
-
-    # Test Nginx configuration
-    test_nginx_result = _execute_in_container(container_id, ['nginx', '-t'])
-    if test_nginx_result.exit_code != 0:
+    # Enable the site and test Nginx configuration in one exec session
+    enable_results = _execute_batch_in_container(container_id, [
+        (['rm', '-f', symlink_path_in_container], True),
+        ['ln', '-s', config_path_in_container, symlink_path_in_container],
+        ['nginx', '-t'],
+    ])
+    test_nginx_result = enable_results[-1]
+    if len(enable_results) < 3 or test_nginx_result.exit_code != 0:
         logger.error(f"Nginx configuration test failed for {domain} in {container_id}: {test_nginx_result.stderr} {test_nginx_result.stdout}")
         # Optionally, remove the symlink or bad config to prevent Nginx from failing to restart
         _execute_in_container(container_id, ['rm', '-f', symlink_path_in_container], ignore_failure=True)
@@ -185,14 +187,16 @@ def create_apache_config(container_id, domain, document_root, php_version, ssl_e
     # PHP and Apache module (mod_php or php-fpm via proxy_fcgi)
     if php_version:
         logger.info(f"Ensuring PHP {php_version} and Apache PHP module are set up in {container_id}...")
-        _execute_in_container(container_id, ['apt-get', 'update', '-y'])
         # Example for mod_php. For FPM, setup is different (ProxyPassMatch).
         php_apache_package = f'libapache2-mod-php{php_version}' 
-        install_php_result = _execute_in_container(container_id, ['apt-get', 'install', '-y', php_apache_package, f'php{php_version}-mysql'])
-        if install_php_result.exit_code != 0:
-            logger.error(f"Failed to install {php_apache_package} in {container_id}: {install_php_result.stderr}")
+        php_results = _execute_batch_in_container(container_id, [
+            (['apt-get', 'update', '-y'], True),
+            ['apt-get', 'install', '-y', php_apache_package, f'php{php_version}-mysql'],
+            (['a2enmod', f'php{php_version}'], True), # Enable the PHP module
+        ])
+        if len(php_results) < 3:
+            logger.error(f"Failed to install {php_apache_package} in {container_id}: {php_results[-1].stderr}")
         else:
-            _execute_in_container(container_id, [f'a2enmod', f'php{php_version}'], ignore_failure=True) # Enable the PHP module
             logger.info(f"PHP module for Apache (php{php_version}) ensured in {container_id}.")
             # If using PHP-FPM with Apache, you'd enable proxy_fcgi and set up FastCGIExternalServer / ProxyPassMatch
 
@@ -214,9 +218,6 @@ def create_apache_config(container_id, domain, document_root, php_version, ssl_e
 """)
     
     if ssl_enabled:
-        _execute_in_container(container_id, ['a2enmod', 'ssl'], ignore_failure=True)
-        _execute_in_container(container_id, ['a2enmod', 'headers'], ignore_failure=True) # For HSTS if used
-
         config_parts.append(f"""
 <IfModule mod_ssl.c>
 <VirtualHost *:443>
@@ -259,15 +260,23 @@ def create_apache_config(container_id, domain, document_root, php_version, ssl_e
     config_path_in_container = f"/etc/apache2/sites-available/{domain}.conf"
     write_file(container_id, config_path_in_container, full_config)
     
-    _execute_in_container(container_id, ['a2dissite', f'{domain}.conf'], ignore_failure=True)
-    enable_result = _execute_in_container(container_id, ['a2ensite', f'{domain}.conf'])
+    # Enable modules and the site, then test Apache configuration, in one exec session
+    enable_steps = []
+    if ssl_enabled:
+        enable_steps.append((['a2enmod', 'ssl'], True))
+        enable_steps.append((['a2enmod', 'headers'], True)) # For HSTS if used
+    enable_steps.append((['a2dissite', f'{domain}.conf'], True))
+    enable_steps.append((['a2ensite', f'{domain}.conf'], True))
+    enable_steps.append(['apache2ctl', 'configtest'])
+    enable_results = _execute_batch_in_container(container_id, enable_steps)
+
+    enable_result = enable_results[-2] if len(enable_results) >= 2 else enable_results[-1]
     if enable_result.exit_code != 0:
         logger.error(f"Failed to enable Apache site {domain}.conf: {enable_result.stderr}")
         # raise Exception(...)
 
-    # Test Apache configuration
-    test_apache_result = _execute_in_container(container_id, ['apache2ctl', 'configtest'])
-    if test_apache_result.exit_code != 0:
+    test_apache_result = enable_results[-1]
+    if len(enable_results) < len(enable_steps) or test_apache_result.exit_code != 0:
         logger.error(f"Apache configuration test failed for {domain} in {container_id}: {test_apache_result.stderr} {test_apache_result.stdout}")
         _execute_in_container(container_id, ['a2dissite', f'{domain}.conf'], ignore_failure=True) # Disable bad config
         raise Exception(f"Apache configuration error for {domain}. Please check logs.")
@@ -283,25 +292,27 @@ def delete_website_config(container_id, domain):
     nginx_config_path_enabled = f"/etc/nginx/sites-enabled/{domain}"
     apache_config_path = f"/etc/apache2/sites-available/{domain}.conf"
 
-    # Try Nginx
+    # Try Nginx, then Apache. Each probe stops its batch when the config isn't there,
+    # so the common case is a single exec session.
     # Check if enabled symlink exists first
-    check_nginx_enabled = _execute_in_container(container_id, ['test', '-L', nginx_config_path_enabled], ignore_failure=True)
-    if check_nginx_enabled.exit_code == 0:
-        _execute_in_container(container_id, ['rm', '-f', nginx_config_path_enabled])
-        _execute_in_container(container_id, ['rm', '-f', nginx_config_path_avail], ignore_failure=True)
-        restart_service(container_id, 'nginx')
+    nginx_results = _execute_batch_in_container(container_id, [
+        ['test', '-L', nginx_config_path_enabled],
+        ['rm', '-f', nginx_config_path_enabled],
+        (['rm', '-f', nginx_config_path_avail], True),
+        (_service_command('nginx', 'restart'), True),
+    ], log_failures=False)
+    if nginx_results[0].exit_code == 0:
         logger.info(f"Nginx config for {domain} deleted from {container_id}.")
         return
 
-    # Try Apache
-    check_apache_enabled = _execute_in_container(container_id, ['a2query', '-s', f'{domain}.conf'], ignore_failure=True) # a2query tells if site is enabled
-    if "enabled" in check_apache_enabled.stdout.lower(): # Heuristic check
-         _execute_in_container(container_id, ['a2dissite', f'{domain}.conf'], ignore_failure=True)
-    
-    check_apache_avail = _execute_in_container(container_id, ['test', '-f', apache_config_path], ignore_failure=True)
-    if check_apache_avail.exit_code == 0:
-        _execute_in_container(container_id, ['rm', '-f', apache_config_path])
-        restart_service(container_id, 'apache2')
+    # a2dissite is a no-op failure when the site isn't enabled
+    apache_results = _execute_batch_in_container(container_id, [
+        (['a2dissite', f'{domain}.conf'], True),
+        ['test', '-f', apache_config_path],
+        ['rm', '-f', apache_config_path],
+        (_service_command('apache2', 'restart'), True),
+    ], log_failures=False)
+    if len(apache_results) > 1 and apache_results[1].exit_code == 0:
         logger.info(f"Apache config for {domain} deleted from {container_id}.")
         return
         